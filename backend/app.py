@@ -20,8 +20,10 @@ from backend.db import (
     get_db_connection, get_image_by_path
 )
 from backend.config import DB_PATH, THUMBNAILS_DIR, DEFAULT_TOP_K, PROJECT_SLUG, PHOTO_FOLDER, BASE_DIR
-from backend.pdf_generator import PDFGenerator
-from backend.email_service import EmailService
+from backend.leads import init_lead_tables, create_lead, lead_status, start_lead_workers
+from backend.jobs import init_job_tables, add_job, get_job
+from backend.index_store import IndexManifestError
+from backend.thumbnails import add_thumbnail_urls, get_rendition, is_valid_rendition, MEDIA_TYPES
 import json
 import psycopg2.extras
 
@@ -43,6 +45,10 @@ strategy_coordinator = None
 def startup_event():
     global strategy_coordinator
     strategy_coordinator = StrategyCoordinator()
+    # Lead reports and emails are built off the request path (backend/leads.py)
+    init_job_tables()
+    init_lead_tables()
+    start_lead_workers()
 
 # Models
 class SearchRequest(BaseModel):
@@ -51,10 +57,12 @@ class SearchRequest(BaseModel):
     folder: Optional[str] = None
     slug: Optional[str] = None
     favorites_only: bool = False
+    diversify: Optional[bool] = None
 
 class SimilarSearchRequest(BaseModel):
     id: int
     top_k: int = 50
+    diversify: Optional[bool] = None
 
 class ObjectSearchRequest(BaseModel):
     object_id: str
@@ -82,15 +90,15 @@ def health():
 
 @app.post("/api/search")
 async def search_endpoint(req: SearchRequest):
-    search_data = strategy_coordinator.search(req.query, req.top_k, req.favorites_only, req.folder, req.slug)
+    search_data = strategy_coordinator.search(req.query, req.top_k, req.favorites_only, req.folder, req.slug, diversify=req.diversify)
     
     if isinstance(search_data, dict):
         return {
-            "results": search_data.get("results", []),
+            "results": add_thumbnail_urls(search_data.get("results", [])),
             "trust_header": search_data.get("trust_header")
         }
     
-    return {"results": search_data}
+    return {"results": add_thumbnail_urls(search_data)}
 
 @app.get("/api/projects/{slug}")
 async def get_project_metadata(slug: str):
@@ -108,15 +116,44 @@ async def get_project_metadata(slug: str):
     
     return dict(row)
 
+@app.post("/api/index/reload")
+def reload_index():
+    """Called by the indexer watcher after it publishes new vectors."""
+    try:
+        strategy_coordinator.reload_index(force=True)
+    except IndexManifestError as e:
+        # The previous index stays in service
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"status": "reloaded"}
+
 @app.post("/api/similar")
 async def similar_endpoint(req: SimilarSearchRequest):
-    results = strategy_coordinator.search_by_image(req.id, req.top_k)
-    return {"results": results}
+    results = strategy_coordinator.search_by_image(req.id, req.top_k, diversify=req.diversify)
+    return {"results": add_thumbnail_urls(results)}
 
 @app.post("/api/similar-object")
 async def object_search_endpoint(req: ObjectSearchRequest):
     results = strategy_coordinator.search_by_object(req.object_id, req.top_k)
-    return {"results": results}
+    return {"results": add_thumbnail_urls(results)}
+
+@app.get("/api/thumbnails/{file_hash}/{rendition}")
+def get_thumbnail(file_hash: str, rendition: str):
+    """Content-addressed thumbnail rendition (e.g. 400.webp), rendered on first request."""
+    width, _, fmt = rendition.partition(".")
+    if not width.isdigit() or not is_valid_rendition(file_hash, int(width), fmt):
+        raise HTTPException(status_code=404, detail="Unknown thumbnail size or format")
+
+    try:
+        path = get_rendition(file_hash, int(width), fmt)
+    except Exception as e:
+        print(f"Thumbnail render error for {file_hash}: {e}")
+        raise HTTPException(status_code=502, detail="Could not render thumbnail")
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    # The URL changes whenever the content does, so clients may cache it forever
+    return FileResponse(path, media_type=MEDIA_TYPES[fmt],
+                        headers={"Cache-Control": "public, max-age=31536000, immutable"})
 
 @app.get("/api/images/{image_id}/objects")
 async def get_image_objects(image_id: int):
@@ -168,56 +205,51 @@ async def get_image_objects(image_id: int):
         conn.close()
 
 @app.post("/api/images/{image_id}/refine")
-async def refine_image_analysis(image_id: int):
+def refine_image_analysis(image_id: int):
     """
-    Triggers a deep re-analysis of an image:
+    Queues a deep re-analysis of an image for the refine worker
+    (python3 -m backend.worker --stages refine), which keeps the models loaded:
     1. Global GPT-4o Vision scan for rich tags and materials.
     2. Local SAM/CLIP scan for specific object polygons with expanded vocabulary.
+    Poll the returned status_url for progress.
     """
-    import subprocess
-    import os
-    
     conn = get_db_connection()
     try:
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute("SELECT file_path FROM images WHERE id = %s", (image_id,))
-        row = cur.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="Image not found")
-        
-        file_path = row['file_path']
-        
-        # 1. Run Global Enrichment (GPT-4o)
-        # We'll use a simplified version of enrich_images.py logic or call it as a script
-        # For speed and isolation, we'll try running the script via subprocess as it's already set up
-        # However, enrich_images.py processes ALL images. We need a targeted version.
-        # Let's import the logic instead if possible, or just use a small subprocess command.
-        
-        # NOTE: For this implementation, we will assume enrich_images.py and process_objects_m3.py 
-        # can be modified to take a specific image_id, OR we just trigger them and they find the work.
-        # But to be precise for the user, let's run a targeted script.
-        
-        print(f"Triggering refinement for image {image_id}")
-        
-        # Run Object Process (Spatial)
-        # We modify process_objects_m3.py slightly to handle a single ID if passed?
-        # For now, we'll just run them and they will pick up images that need work.
-        # More robust: run a small python snippet that processes THIS specific image.
-        
-        refine_cmd = f"PYTHONPATH=. python3 -c \"from process_objects_m3 import process_image; process_image({image_id}, '{file_path}')\""
-        subprocess.run(refine_cmd, shell=True, check=True)
-        
-        # Run Global Enrichment (Global)
-        # Assuming enrich_images.py has a targeted function
-        enrich_cmd = f"PYTHONPATH=. python3 -c \"import asyncio; from enrich_images import enrich_image; asyncio.run(enrich_image({image_id}, '{file_path}'))\""
-        subprocess.run(enrich_cmd, shell=True, check=True)
-        
-        return {"status": "success", "message": "Refinement complete"}
-    except Exception as e:
-        print(f"Refinement failed: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        with conn.cursor() as cur:
+            sql = "SELECT id FROM images WHERE id = %s"
+            params = [image_id]
+            if PROJECT_SLUG:
+                sql += " AND project_slug = %s"
+                params.append(PROJECT_SLUG)
+            cur.execute(sql, tuple(params))
+            if not cur.fetchone():
+                raise HTTPException(status_code=404, detail="Image not found")
+        # A refinement already queued or running for this image is reused
+        job_id = add_job(conn, 'refine', {'image_id': image_id}, unique=True)
+        conn.commit()
+    finally:
+        conn.close()
+
+    print(f"Queued refinement for image {image_id} (job {job_id})")
+    return {"status": "queued", "job_id": job_id, "status_url": f"/api/refine/{job_id}"}
+
+@app.get("/api/refine/{job_id}")
+def get_refine_status(job_id: int):
+    conn = get_db_connection()
+    try:
+        job = get_job(conn, job_id)
     finally:
         conn.close()
+    if not job or job['stage'] != 'refine':
+        raise HTTPException(status_code=404, detail="Refinement not found")
+    return {
+        "job_id": job['id'],
+        "image_id": job['payload'].get('image_id'),
+        "status": job['status'],  # pending, running, done or failed
+        "progress": job['progress'],
+        "attempts": job['attempts'],
+        "error": job['last_error'] if job['status'] != 'done' else None,
+    }
 
 # Keep legacy endpoint for now to avoid breaking existing frontend if it hasn't refreshed
 @app.get("/api/image-objects/{image_id}")
@@ -271,7 +303,7 @@ def get_collection(id: int):
         if row and row[0] != PROJECT_SLUG:
              raise HTTPException(status_code=403, detail="Access denied to this collection")
              
-    return {"id": id, "images": images}
+    return {"id": id, "images": add_thumbnail_urls(images)}
 
 @app.post("/api/collection/create")
 def create_collection_endpoint(req: CreateCollectionRequest):
@@ -346,10 +378,10 @@ class AnalyzeStyleRequest(BaseModel):
 @app.post("/api/analyze-style")
 def analyze_style(req: AnalyzeStyleRequest):
     """Legacy style detection endpoint."""
-    if not search_engine:
+    if not strategy_coordinator:
         raise HTTPException(status_code=503, detail="Search engine not ready")
     
-    style = search_engine.analyze_board(req.image_ids)
+    style = strategy_coordinator.analyze_board(req.image_ids)
     return {"style": style}
 
 class ImageDetailsRequest(BaseModel):
@@ -364,7 +396,7 @@ def get_images_details(req: ImageDetailsRequest):
     with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
         placeholders = ','.join(['%s'] * len(req.ids))
         query = f"""
-            SELECT id, file_path, filename, thumbnail_path, favorite, tags, style_scores, caption,
+            SELECT id, file_path, filename, thumbnail_path, file_hash, favorite, tags, style_scores, caption,
                    design_style, maintenance_level, seasonal_interest, spatial_purpose, color_palette, project_slug,
                    privacy_level, terrain_type, hardscape_ratio, material_palette, architectural_features
             FROM images 
@@ -378,7 +410,7 @@ def get_images_details(req: ImageDetailsRequest):
         rows = cur.fetchall()
         
     conn.close()
-    return {"images": [dict(r) for r in rows]}
+    return {"images": add_thumbnail_urls([dict(r) for r in rows])}
 
 # Lead Gen Models
 class LeadRequest(BaseModel):
@@ -394,72 +426,33 @@ class LeadRequest(BaseModel):
 
 @app.post("/api/leads/submit")
 def submit_lead(req: LeadRequest):
-    # 1. Fetch Image Details
-    selected_images = []
-    # Using local helper or DB query
-    conn = get_db_connection()
-    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-        if req.image_ids:
-            placeholders = ','.join(['%s'] * len(req.image_ids))
-            cur.execute(f"SELECT * FROM images WHERE id IN ({placeholders})", tuple(req.image_ids))
-            rows = cur.fetchall()
-            # Preserve order?
-            row_map = {r['id']: dict(r) for r in rows}
-            for iid in req.image_ids:
-                if iid in row_map:
-                    img_data = row_map[iid]
-                    # Inject Note if exists
-                    if req.image_notes and str(iid) in req.image_notes:
-                        img_data['user_note'] = req.image_notes[str(iid)]
-                    selected_images.append(img_data)
-    
-    # 2. Vision Analytics (Mind Reader Effect)
+    # 1. Vision Analytics (Mind Reader Effect): averaged from the precomputed attribute matrix
     vision_report = {}
-    if req.image_ids and search_engine:
-        vision_report = search_engine.analyze_board(req.image_ids)
+    if req.image_ids and strategy_coordinator:
+        vision_report = strategy_coordinator.analyze_board(req.image_ids)
     
-    # 3. Save Lead to DB
+    # 2. Save Lead + queue its report job (one transaction)
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO leads (name, email, phone, timeline, budget, address, vision_json, project_slug)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id
-            """, (
-                req.name, req.email, req.phone, req.timeline, req.budget, req.address, 
-                json.dumps({
-                    "ids": req.image_ids,
-                    "notes": req.image_notes,
-                    "manual_style": req.detected_style,
-                    "report": vision_report
-                }),
-                PROJECT_SLUG
-            ))
-            lead_id = cur.fetchone()[0]
-            conn.commit()
+        lead_id = create_lead(req.dict(), {
+            "ids": req.image_ids,
+            "notes": req.image_notes,
+            "manual_style": req.detected_style,
+            "report": vision_report
+        })
     except Exception as e:
-        conn.rollback()
         print(f"Error saving lead: {e}")
         raise HTTPException(status_code=500, detail="Failed to save lead")
-    finally:
-        conn.close()
-
-    # 3. Generate PDF
-    lead_data = req.dict()
-    lead_data['vision_report'] = vision_report # Inject the AI analysis
-    
-    pdf_gen = PDFGenerator()
-    try:
-        report_path = pdf_gen.generate_report(lead_data, selected_images)
-    except Exception as e:
-        print(f"PDF Gen Error: {e}")
-        report_path = "Error generating PDF"
 
-    # 4. Trigger Email
-    email_svc = EmailService()
-    email_svc.send_lead_notification(lead_data, report_path)
+    # 3. PDF + email happen in a lead worker; poll the status URL for delivery
+    return {"status": "success", "lead_id": lead_id, "report_status": "queued",
+            "status_url": f"/api/leads/{lead_id}/status"}
 
-    return {"status": "success", "lead_id": lead_id, "report_path": report_path}
+@app.get("/api/leads/{lead_id}/status")
+def get_lead_status(lead_id: int):
+    status = lead_status(lead_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Lead not found")
+    return status
 
 # Static Mounts
 # Mount thumbnails explicitly to confirm access
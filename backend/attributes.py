@@ -0,0 +1,97 @@
+"""
+Precomputed board attributes (taxonomy.BOARD_ATTRIBUTES).
+The tagger scores every indexed image against each attribute option once and
+stores the (images x options) matrix, in float16, together with the option
+embeddings. A board report is then the mean of the board's rows with an argmax
+per category: no model and no image files. Images indexed after the matrix was
+built are scored from their index vectors with the stored option embeddings.
+"""
+
+import os
+
+import numpy as np
+
+from backend.config import ATTRIBUTE_MATRIX_PATH, CLIP_MODEL_NAME
+from backend.taxonomy import BOARD_ATTRIBUTES
+
+# (category, option) per matrix column
+ATTRIBUTE_OPTIONS = [(cat, option) for cat, options in BOARD_ATTRIBUTES.items() for option in options]
+
+
+def write_attribute_matrix(ids, vectors, option_embeddings, path=ATTRIBUTE_MATRIX_PATH, model_name=CLIP_MODEL_NAME):
+    """
+    Score L2-normalized image vectors against normalized option embeddings and
+    publish the result (temp file + rename).
+    """
+    option_embeddings = np.asarray(option_embeddings, dtype=np.float32)
+    scores = np.asarray(vectors, dtype=np.float32) @ option_embeddings.T
+    order = np.argsort(ids, kind='stable')
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        np.savez(f,
+                 ids=np.asarray(ids, dtype=np.int64)[order],
+                 scores=scores[order].astype(np.float16),
+                 option_embeddings=option_embeddings,
+                 options=np.array([f"{cat}\t{option}" for cat, option in ATTRIBUTE_OPTIONS]),
+                 model=np.array(model_name))
+    os.replace(tmp_path, path)
+    return len(order)
+
+
+def attribute_report(mean_scores):
+    """Best option per category for a board's mean score row."""
+    mean_scores = np.asarray(mean_scores)
+    report = {}
+    col = 0
+    for cat, options in BOARD_ATTRIBUTES.items():
+        report[cat] = options[int(np.argmax(mean_scores[col:col + len(options)]))]
+        col += len(options)
+    return report
+
+
+class AttributeMatrix:
+    """The published matrix, re-read when the file changes."""
+
+    def __init__(self, path=ATTRIBUTE_MATRIX_PATH):
+        self.path = path
+        self.ids = None
+        self.scores = None
+        self.option_embeddings = None
+        self._version = None
+
+    def _refresh(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self.ids = self.scores = self.option_embeddings = None
+            self._version = None
+            return
+        version = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if version == self._version:
+            return
+        self._version = version
+        self.ids = self.scores = self.option_embeddings = None
+        try:
+            data = np.load(self.path, allow_pickle=False)
+            options = [tuple(o.split("\t", 1)) for o in data['options'].tolist()]
+            if str(data['model']) != CLIP_MODEL_NAME or options != ATTRIBUTE_OPTIONS:
+                print(f"{self.path} was built for other attributes or another model; "
+                      f"rebuild it with: python3 backend/batch_tagger.py --attributes")
+                return
+            self.ids, self.scores = data['ids'], data['scores']
+            self.option_embeddings = data['option_embeddings']
+        except Exception as e:
+            print(f"Could not read attribute matrix {self.path}: {e}")
+
+    def lookup(self, image_ids):
+        """
+        Returns:
+            (found mask over image_ids, float32 score rows for the found ids)
+        """
+        self._refresh()
+        wanted = np.asarray(image_ids, dtype=np.int64)
+        if self.ids is None or not len(self.ids) or not len(wanted):
+            return np.zeros(len(wanted), dtype=bool), np.zeros((0, len(ATTRIBUTE_OPTIONS)), np.float32)
+        pos = np.clip(np.searchsorted(self.ids, wanted), 0, len(self.ids) - 1)
+        found = self.ids[pos] == wanted
+        return found, self.scores[pos[found]].astype(np.float32)
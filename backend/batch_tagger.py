@@ -8,9 +8,11 @@ import os
 import sys
 from pathlib import Path
 import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import numpy as np
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import SentenceTransformer
 import psycopg2
 import psycopg2.extras
 from dotenv import load_dotenv
@@ -19,9 +21,46 @@ from tqdm import tqdm
 # Add parent directory to path
 sys.path.append(str(Path(__file__).parent.parent))
 
-from backend.taxonomy import TAXONOMY, ALL_TAGS, get_tag_label
-from backend.config import CLIP_MODEL_NAME
+from backend.taxonomy import TAXONOMY, ALL_TAGS, TAG_TO_CATEGORY, get_tag_label
+from backend.config import CLIP_MODEL_NAME, TAG_EMBEDDINGS_PATH, PROJECT_SLUG
 from backend.db import get_db_connection
+from backend.bulk_writer import BulkWriter
+from backend.embedding_cache import EmbeddingCache
+from backend.index_store import read_index, index_vectors
+from backend.attributes import ATTRIBUTE_OPTIONS, write_attribute_matrix
+from backend.image_io import CLIP_INPUT_SIZE, draft_size, resize_for_clip
+
+PROMPT_TEMPLATE = "a landscape photo featuring {label}"
+BATCH_SIZE = 32
+MAX_TAGS_PER_CATEGORY = 3
+# Images re-scored per round trip by retag_changed
+RETAG_CHUNK_SIZE = 5000
+
+
+def init_tag_tables(conn):
+    """Columns/table that record which taxonomy each image was tagged with."""
+    with conn.cursor() as c:
+        # tag_scores: raw score for every taxonomy tag, so a taxonomy edit only
+        # re-scores the tags that changed and re-runs selection on the rest
+        c.execute("ALTER TABLE images ADD COLUMN IF NOT EXISTS tag_scores JSONB")
+        c.execute("ALTER TABLE images ADD COLUMN IF NOT EXISTS taxonomy_version TEXT")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_images_taxonomy_version ON images (taxonomy_version)")
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS taxonomy_versions (
+                version TEXT PRIMARY KEY,
+                prompt_hashes JSONB NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    conn.commit()
+
+
+def load_clip_image(image_path):
+    """Decode just large enough for CLIP (JPEG draft mode) and downscale."""
+    with Image.open(image_path) as img:
+        img.draft('RGB', draft_size(*img.size, thumb_size=(CLIP_INPUT_SIZE, CLIP_INPUT_SIZE)))
+        return resize_for_clip(img)
+
 
 class BatchTagger:
     def __init__(self):
@@ -29,16 +68,129 @@ class BatchTagger:
         self.model = SentenceTransformer(CLIP_MODEL_NAME)
         print("✓ Model loaded")
         
-        # Precompute tag embeddings (do this once)
-        print("Encoding taxonomy tags...")
-        self.tag_embeddings = {}
-        for category, tags in TAXONOMY.items():
-            # Create natural language prompts for better classification
-            prompts = [f"a landscape photo featuring {get_tag_label(tag)}" for tag in tags]
-            embeddings = self.model.encode(prompts, convert_to_tensor=True)
-            for tag, emb in zip(tags, embeddings):
-                self.tag_embeddings[tag] = emb
-        print(f"✓ Encoded {len(self.tag_embeddings)} tags")
+        # One prompt-embedding row per distinct tag; a tag listed under two
+        # categories counts against the one in TAG_TO_CATEGORY
+        self.tags = list(dict.fromkeys(ALL_TAGS))
+        category_names = list(TAXONOMY.keys())
+        self.tag_categories = np.array(
+            [category_names.index(TAG_TO_CATEGORY[tag]) for tag in self.tags], dtype=np.int64)
+        self.num_categories = len(category_names)
+        self.prompts = [PROMPT_TEMPLATE.format(label=get_tag_label(tag)) for tag in self.tags]
+        self.tag_matrix = self._load_tag_matrix()
+        print(f"✓ {len(self.tags)} tag embeddings ready")
+        
+        # A tag's score only changes with its prompt (and the model); the
+        # version also covers category membership, which changes selection
+        self.prompt_hashes = {
+            tag: hashlib.sha1(f"{CLIP_MODEL_NAME}\n{prompt}".encode()).hexdigest()[:16]
+            for tag, prompt in zip(self.tags, self.prompts)
+        }
+        self.taxonomy_version = hashlib.sha1(json.dumps(
+            [[tag, TAG_TO_CATEGORY[tag], self.prompt_hashes[tag]] for tag in self.tags]
+        ).encode()).hexdigest()[:16]
+        self._register_version()
+    
+    def _register_version(self):
+        conn = get_db_connection()
+        try:
+            init_tag_tables(conn)
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO taxonomy_versions (version, prompt_hashes) VALUES (%s, %s)
+                    ON CONFLICT (version) DO NOTHING
+                """, (self.taxonomy_version, json.dumps(self.prompt_hashes)))
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def _load_tag_matrix(self):
+        """
+        (num_tags, dim) L2-normalized prompt embeddings. Cached on disk keyed by
+        model and template; rows are reused per prompt text, so editing the
+        taxonomy only encodes the new or relabelled prompts.
+        """
+        cached = {}
+        if TAG_EMBEDDINGS_PATH.exists():
+            try:
+                data = np.load(TAG_EMBEDDINGS_PATH, allow_pickle=False)
+                if str(data['model']) == CLIP_MODEL_NAME and str(data['template']) == PROMPT_TEMPLATE:
+                    cached = dict(zip(data['prompts'].tolist(), data['matrix']))
+            except Exception as e:
+                print(f"Could not read tag embedding cache {TAG_EMBEDDINGS_PATH}: {e}")
+        
+        missing = [p for p in self.prompts if p not in cached]
+        if missing:
+            print(f"Encoding {len(missing)} taxonomy prompts...")
+            encoded = self.model.encode(missing, normalize_embeddings=True, convert_to_numpy=True)
+            cached.update(zip(missing, encoded.astype(np.float32)))
+        
+        matrix = np.stack([cached[p] for p in self.prompts]).astype(np.float32)
+        if missing:
+            tmp_path = TAG_EMBEDDINGS_PATH.with_name(TAG_EMBEDDINGS_PATH.name + ".tmp")
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, prompts=np.array(self.prompts), matrix=matrix,
+                         model=np.array(CLIP_MODEL_NAME), template=np.array(PROMPT_TEMPLATE))
+            os.replace(tmp_path, TAG_EMBEDDINGS_PATH)
+        return matrix
+    
+    def encode_images(self, images):
+        """(n, dim) L2-normalized embeddings for a list of PIL images."""
+        return self.model.encode(images, batch_size=BATCH_SIZE, normalize_embeddings=True,
+                                 convert_to_numpy=True).astype(np.float32)
+    
+    def score(self, image_embeddings):
+        """Cosine similarity of every image against every tag: one (n, dim) x (dim, tags) product."""
+        return np.asarray(image_embeddings, dtype=np.float32) @ self.tag_matrix.T
+    
+    def select_tags(self, scores, top_k: int = 5, threshold: float = 0.25):
+        """
+        Per image: tags above threshold, best first, at most MAX_TAGS_PER_CATEGORY
+        per category and top_k * 2 overall.
+        
+        Returns:
+            list of (tags, style_scores) per row of scores
+        """
+        scores = np.atleast_2d(scores)
+        order = np.argsort(-scores, axis=1, kind='stable')
+        sorted_scores = np.take_along_axis(scores, order, axis=1)
+        sorted_cats = self.tag_categories[order]
+        
+        # Rank of each tag within its category (0 = best): a running count per category
+        rank_in_cat = np.empty(sorted_cats.shape, dtype=np.int32)
+        for category in range(self.num_categories):
+            in_cat = sorted_cats == category
+            rank_in_cat[in_cat] = (np.cumsum(in_cat, axis=1, dtype=np.int32) - 1)[in_cat]
+        
+        keep = (sorted_scores >= threshold) & (rank_in_cat < MAX_TAGS_PER_CATEGORY)
+        keep &= np.cumsum(keep, axis=1) <= top_k * 2
+        
+        results = []
+        for row in range(scores.shape[0]):
+            cols = order[row][keep[row]]
+            tags = [self.tags[c] for c in cols]
+            results.append((tags, {self.tags[c]: round(float(scores[row, c]), 3) for c in cols}))
+        return results
+    
+    @staticmethod
+    def make_caption(selected_tags):
+        top_labels = [get_tag_label(tag) for tag in selected_tags[:5]]
+        caption = f"Landscape featuring {', '.join(top_labels[:3])}"
+        if len(top_labels) > 3:
+            caption += f" with {' and '.join(top_labels[3:])}"
+        return caption
+    
+    def results_from_scores(self, scores, top_k: int = 5, threshold: float = 0.25):
+        """Tag results ({'tags', 'caption', 'style_scores', 'tag_scores'}) for a (n, num_tags) score matrix."""
+        rounded = np.round(scores.astype(np.float64), 6).tolist()
+        return [
+            {"tags": tags, "caption": self.make_caption(tags), "style_scores": style_scores,
+             "tag_scores": dict(zip(self.tags, row))}
+            for (tags, style_scores), row in zip(self.select_tags(scores, top_k, threshold), rounded)
+        ]
+    
+    def tag_embeddings(self, image_embeddings, top_k: int = 5, threshold: float = 0.25):
+        """Tag results for precomputed image embeddings."""
+        return self.results_from_scores(self.score(image_embeddings), top_k, threshold)
     
     def tag_image(self, image_path: str, top_k: int = 5, threshold: float = 0.25):
         """
@@ -53,56 +205,258 @@ class BatchTagger:
             dict with 'tags', 'caption', 'style_scores'
         """
         try:
-            # Load and encode image
-            image = Image.open(image_path)
-            img_emb = self.model.encode(image, convert_to_tensor=True)
-            
-            # Calculate similarities for all tags
-            tag_scores = {}
-            for tag, tag_emb in self.tag_embeddings.items():
-                similarity = float(util.cos_sim(img_emb, tag_emb)[0][0])
-                if similarity >= threshold:
-                    tag_scores[tag] = similarity
-            
-            # Sort by score and take top tags
-            sorted_tags = sorted(tag_scores.items(), key=lambda x: x[1], reverse=True)
-            
-            # Build result
-            selected_tags = []
-            style_scores = {}
-            
-            # Take top tags per category to ensure diversity
-            from backend.taxonomy import TAG_TO_CATEGORY
-            category_counts = {}
-            
-            for tag, score in sorted_tags:
-                category = TAG_TO_CATEGORY.get(tag, "unknown")
-                
-                # Limit tags per category to avoid over-representation
-                if category_counts.get(category, 0) < 3:
-                    selected_tags.append(tag)
-                    style_scores[tag] = round(score, 3)
-                    category_counts[category] = category_counts.get(category, 0) + 1
-                
-                if len(selected_tags) >= top_k * 2:  # Max ~10 tags total
-                    break
-            
-            # Generate caption from top tags
-            top_labels = [get_tag_label(tag) for tag in selected_tags[:5]]
-            caption = f"Landscape featuring {', '.join(top_labels[:3])}"
-            if len(top_labels) > 3:
-                caption += f" with {' and '.join(top_labels[3:])}"
-            
-            return {
-                "tags": selected_tags,
-                "caption": caption,
-                "style_scores": style_scores
-            }
-            
+            embedding = self.encode_images([load_clip_image(image_path)])
+            return self.tag_embeddings(embedding, top_k, threshold)[0]
         except Exception as e:
             print(f"Error tagging {image_path}: {e}")
             return {"tags": [], "caption": "", "style_scores": {}}
     
+    def save_results(self, conn, id_results):
+        """Write [(image_id, result)] with a single UPDATE ... FROM unnest(...)."""
+        if not id_results:
+            return
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE images AS i
+                SET tags = v.tags,
+                    caption = v.caption,
+                    style_scores = v.style_scores,
+                    tag_scores = v.tag_scores,
+                    taxonomy_version = %s
+                FROM unnest(%s::int[], %s::jsonb[], %s::text[], %s::jsonb[], %s::jsonb[])
+                    AS v (id, tags, caption, style_scores, tag_scores)
+                WHERE i.id = v.id
+            """, (
+                self.taxonomy_version,
+                [int(img_id) for img_id, _ in id_results],
+                [json.dumps(r['tags']) for _, r in id_results],
+                [r['caption'] for _, r in id_results],
+                [json.dumps(r['style_scores']) for _, r in id_results],
+                [json.dumps(r['tag_scores']) for _, r in id_results],
+            ))
+        conn.commit()
+    
+    def queue_results(self, writer, id_results):
+        """Hand [(image_id, result)] to a BulkWriter."""
+        for img_id, r in id_results:
+            writer.update('images', 'id', int(img_id), {
+                'tags': json.dumps(r['tags']),
+                'caption': r['caption'],
+                'style_scores': json.dumps(r['style_scores']),
+                'tag_scores': json.dumps(r['tag_scores']),
+                'taxonomy_version': self.taxonomy_version,
+            })
+    
+    def tag_rows(self, images, writer=None, progress: bool = False):
+        """
+        Tag (id, file_path) rows, BATCH_SIZE images per CLIP call. Results go
+        to a write-behind BulkWriter, so database writes overlap with encoding;
+        without a writer one is opened and flushed before returning.
+        
+        Returns:
+            (success_count, error_count)
+        """
+        images = list(images)
+        success_count = 0
+        error_count = 0
+        own_writer = writer is None
+        if own_writer:
+            writer = BulkWriter("tagger")
+        failed_before = writer.stats['failed_rows']
+        
+        def load(img):
+            try:
+                return load_clip_image(img['file_path'])
+            except Exception as e:
+                print(f"Error loading {img['file_path']}: {e}")
+                return None
+        
+        batches = range(0, len(images), BATCH_SIZE)
+        try:
+            with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as pool:
+                for start in tqdm(batches, desc="Tagging batches", disable=not progress):
+                    rows = [img for img in images[start:start + BATCH_SIZE] if os.path.exists(img['file_path'])]
+                    error_count += min(BATCH_SIZE, len(images) - start) - len(rows)
+                    
+                    # PIL decodes release the GIL, so files load in parallel
+                    loaded = [(img, pil) for img, pil in zip(rows, pool.map(load, rows)) if pil is not None]
+                    error_count += len(rows) - len(loaded)
+                    if not loaded:
+                        continue
+                    
+                    results = self.tag_embeddings(self.encode_images([pil for _, pil in loaded]))
+                    self.queue_results(writer, [(img['id'], r) for (img, _), r in zip(loaded, results)])
+                    success_count += len(loaded)
+        finally:
+            if own_writer:
+                writer.close()
+            else:
+                writer.flush()
+        
+        # Rows the writer could not save
+        failed = writer.stats['failed_rows'] - failed_before
+        return success_count - failed, error_count + failed
+    
+    def _indexed_vectors(self):
+        index = read_index()
+        if index is None:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, self.tag_matrix.shape[1]), np.float32)
+        return index_vectors(index)
+    
+    def stored_embeddings(self, rows, indexed=None):
+        """
+        Image vectors for (id, file_hash) rows without opening any file: the
+        published FAISS index first, then the indexer's embedding cache.
+        
+        Args:
+            indexed: (ids, vectors) from the index, if already loaded
+        
+        Returns:
+            (ids, vectors) for the rows that have a stored vector
+        """
+        index_ids, index_vecs = indexed if indexed is not None else self._indexed_vectors()
+        
+        row_ids = np.array([r['id'] for r in rows], dtype=np.int64)
+        pos = np.clip(np.searchsorted(index_ids, row_ids), 0, max(len(index_ids) - 1, 0))
+        in_index = (index_ids[pos] == row_ids) if len(index_ids) else np.zeros(len(row_ids), dtype=bool)
+        ids, vectors = list(row_ids[in_index]), [index_vecs[pos[in_index]]]
+        
+        missing = [r for r, found in zip(rows, in_index) if not found and r['file_hash']]
+        if missing:
+            cache = EmbeddingCache()
+            cached = [(r['id'], cache.get(r['file_hash'])) for r in missing]
+            cached = [(img_id, vec) for img_id, vec in cached if vec is not None]
+            if cached:
+                ids += [img_id for img_id, _ in cached]
+                vectors.append(np.stack([vec for _, vec in cached]))
+        return ids, np.concatenate(vectors).astype(np.float32)
+    
+    def tag_from_index(self, limit: int = None, resume: bool = True, project_slug: str = PROJECT_SLUG):
+        """
+        Tag a whole project from stored image vectors: no file reads, so rows
+        whose file_path is a storage URL are tagged too. One matrix product
+        scores every image and one UPDATE writes the results.
+        """
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            query = "SELECT id, file_hash FROM images WHERE TRUE"
+            params = []
+            if project_slug:
+                query += " AND project_slug = %s"
+                params.append(project_slug)
+            if resume:
+                query += " AND (tags IS NULL OR tags = '[]'::jsonb)"
+            query += " ORDER BY id"
+            if limit:
+                query += " LIMIT %s"
+                params.append(limit)
+            cur.execute(query, params)
+            rows = cur.fetchall()
+        
+        indexed = self._indexed_vectors()
+        ids, vectors = self.stored_embeddings(rows, indexed)
+        print(f"Tagging {len(ids)} images from stored embeddings "
+              f"({len(rows) - len(ids)} have no stored vector; run the indexer first)")
+        
+        results = self.tag_embeddings(vectors)
+        try:
+            self.save_results(conn, list(zip(ids, results)))
+        finally:
+            conn.close()
+        print(f"✓ Tagged {len(ids)} images")
+        self.build_attribute_matrix(indexed)
+        return len(ids), len(rows) - len(ids)
+    
+    def build_attribute_matrix(self, indexed=None):
+        """Score every indexed image against the board attributes (see backend/attributes.py)."""
+        ids, vectors = indexed if indexed is not None else self._indexed_vectors()
+        option_embeddings = self.model.encode([option for _, option in ATTRIBUTE_OPTIONS],
+                                              normalize_embeddings=True, convert_to_numpy=True)
+        count = write_attribute_matrix(ids, vectors, option_embeddings)
+        print(f"✓ Attribute matrix: {count} images x {len(ATTRIBUTE_OPTIONS)} options")
+        return count
+    
+    def retag_changed(self, project_slug: str = PROJECT_SLUG, chunk_size: int = RETAG_CHUNK_SIZE):
+        """
+        Bring tagged images up to the current taxonomy. Only tags whose prompt
+        changed (or are new) are re-scored, from stored image vectors; the
+        other scores come from each image's tag_scores, and selection runs
+        again on the merged row. Images tagged before versioning are scored in full.
+        
+        Returns:
+            (updated_count, missing_vector_count)
+        """
+        conn = get_db_connection()
+        with conn.cursor() as cur:
+            cur.execute("SELECT version, prompt_hashes FROM taxonomy_versions")
+            known = dict(cur.fetchall())
+            query = """
+                SELECT taxonomy_version, count(*) FROM images
+                WHERE taxonomy_version IS DISTINCT FROM %s
+                  AND (taxonomy_version IS NOT NULL OR tags <> '[]'::jsonb)
+            """
+            params = [self.taxonomy_version]
+            if project_slug:
+                query += " AND project_slug = %s"
+                params.append(project_slug)
+            cur.execute(query + " GROUP BY taxonomy_version", params)
+            stale = cur.fetchall()
+        
+        if not stale:
+            print(f"All tagged images are on taxonomy {self.taxonomy_version}.")
+            conn.close()
+            return 0, 0
+        
+        indexed = None
+        updated = missing = 0
+        for version, count in stale:
+            old_hashes = known.get(version)
+            if old_hashes is None:
+                changed = list(range(len(self.tags)))
+            else:
+                changed = [col for col, tag in enumerate(self.tags) if old_hashes.get(tag) != self.prompt_hashes[tag]]
+            print(f"Taxonomy {version} -> {self.taxonomy_version}: {count} images, "
+                  f"{len(changed)}/{len(self.tags)} tags to re-score")
+            if changed and indexed is None:
+                indexed = self._indexed_vectors()
+            
+            last_id = 0
+            while True:
+                query = """
+                    SELECT id, file_hash, tag_scores FROM images
+                    WHERE taxonomy_version IS NOT DISTINCT FROM %s AND id > %s
+                      AND (taxonomy_version IS NOT NULL OR tags <> '[]'::jsonb)
+                """
+                params = [version, last_id]
+                if project_slug:
+                    query += " AND project_slug = %s"
+                    params.append(project_slug)
+                with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                    cur.execute(query + " ORDER BY id LIMIT %s", params + [chunk_size])
+                    rows = cur.fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1]['id']
+                
+                # Removed tags simply drop out; tags without a stored score start below any threshold
+                scores = np.array([[(r['tag_scores'] or {}).get(tag, -1.0) for tag in self.tags] for r in rows],
+                                  dtype=np.float32)
+                ids = [r['id'] for r in rows]
+                if changed:
+                    vec_ids, vectors = self.stored_embeddings(rows, indexed)
+                    missing += len(ids) - len(vec_ids)
+                    row_pos = {img_id: pos for pos, img_id in enumerate(ids)}
+                    scores = scores[[row_pos[img_id] for img_id in vec_ids]]
+                    scores[:, changed] = vectors @ self.tag_matrix[changed].T
+                    ids = vec_ids
+                
+                self.save_results(conn, list(zip(ids, self.results_from_scores(scores))))
+                updated += len(ids)
+        
+        conn.close()
+        print(f"✓ Re-tagged {updated} images ({missing} skipped: no stored vector)")
+        return updated, missing
+    
     def batch_tag_all(self, limit: int = None, resume: bool = True):
         """
         Tag all images in the database.
@@ -125,49 +479,13 @@ class BatchTagger:
             
             cur.execute(query)
             images = cur.fetchall()
+        conn.close()
         
         print(f"\n{'='*60}")
         print(f"Batch Tagging: {len(images)} images")
         print(f"{'='*60}\n")
         
-        success_count = 0
-        error_count = 0
-        
-        for img in tqdm(images, desc="Tagging images"):
-            img_id = img['id']
-            file_path = img['file_path']
-            
-            if not os.path.exists(file_path):
-                error_count += 1
-                continue
-            
-            # Tag the image
-            result = self.tag_image(file_path)
-            
-            # Update database
-            try:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        UPDATE images 
-                        SET tags = %s::jsonb,
-                            caption = %s,
-                            style_scores = %s::jsonb
-                        WHERE id = %s
-                    """, (
-                        json.dumps(result['tags']),
-                        result['caption'],
-                        json.dumps(result['style_scores']),
-                        img_id
-                    ))
-                conn.commit()
-                success_count += 1
-                
-            except Exception as e:
-                print(f"\nDB Error for image {img_id}: {e}")
-                conn.rollback()
-                error_count += 1
-        
-        conn.close()
+        success_count, error_count = self.tag_rows(images, progress=True)
         
         print(f"\n{'='*60}")
         print(f"Batch Tagging Complete!")
@@ -183,12 +501,24 @@ def main():
     parser.add_argument('--limit', type=int, help='Max images to process')
     parser.add_argument('--no-resume', action='store_true', help='Re-tag all images')
     parser.add_argument('--test', action='store_true', help='Test mode (10 images)')
+    parser.add_argument('--from-index', action='store_true',
+                        help='Tag from vectors in the FAISS index / embedding cache instead of image files')
+    parser.add_argument('--attributes', action='store_true',
+                        help='Only rebuild the board attribute matrix from the index')
+    parser.add_argument('--retag-changed', action='store_true',
+                        help='Re-score only tags whose prompt changed since each image was tagged')
     
     args = parser.parse_args()
     
     tagger = BatchTagger()
     
-    if args.test:
+    if args.attributes:
+        tagger.build_attribute_matrix()
+    elif args.retag_changed:
+        tagger.retag_changed()
+    elif args.from_index:
+        tagger.tag_from_index(limit=10 if args.test else args.limit, resume=not args.no_resume)
+    elif args.test:
         print("🧪 TEST MODE: Processing 10 images")
         tagger.batch_tag_all(limit=10, resume=True)
     else:
@@ -0,0 +1,304 @@
+"""
+Write-behind database writer shared by the enrichment pipelines (tagging,
+GPT enrichment, object extraction).
+Callers queue row updates and child-row replacements and carry on; a
+background thread flushes them on a pooled connection (execute_values for
+updates, COPY for inserted rows) once WRITE_BEHIND_ROWS rows are buffered or
+WRITE_BEHIND_SECONDS have passed, one transaction per flush. A flush that
+fails is split in halves until the offending rows are isolated; only those
+are dropped (and kept in `failures`). close() (also run at exit) flushes what
+is left.
+"""
+
+import io
+import time
+import atexit
+import threading
+from collections import deque
+
+import psycopg2.extras
+
+from backend.config import WRITE_BEHIND_ROWS, WRITE_BEHIND_SECONDS
+from backend.db import get_db_pool
+
+# Producers block once this many flushes' worth of rows is waiting
+MAX_PENDING_FLUSHES = 4
+# Rows that could not be written, most recent last (older ones only stay counted in stats)
+MAX_FAILURES = 1000
+
+_open_writers = set()
+
+
+def _close_open_writers():
+    for writer in list(_open_writers):
+        writer.close()
+
+
+atexit.register(_close_open_writers)
+
+
+def _copy_field(value, sql_type):
+    """One value in COPY text format. Lists become Postgres arrays, or pgvector literals for vector columns."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, (list, tuple)):
+        if sql_type.endswith("[]"):
+            text = "{" + ",".join(
+                "NULL" if v is None else '"' + str(v).replace("\\", "\\\\").replace('"', '\\"') + '"'
+                for v in value) + "}"
+        else:
+            text = "[" + ",".join(str(v) for v in value) + "]"
+    elif isinstance(value, bool):
+        text = "t" if value else "f"
+    else:
+        text = str(value)
+    return text.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class BulkWriter:
+    def __init__(self, name="writer", max_rows=WRITE_BEHIND_ROWS, max_delay=WRITE_BEHIND_SECONDS):
+        self.name = name
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        # (table, key_column, columns) -> {key: row values}; the last update per key wins
+        self._updates = {}
+        # (table, key_column, columns) -> {key: [row values]}; replaces every child row of key
+        self._replacements = {}
+        self._pending = 0
+        self._oldest = None
+        self._column_types = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self.stats = {'flushes': 0, 'rows': 0, 'failed_rows': 0, 'flush_seconds': 0.0, 'max_flush_seconds': 0.0}
+        # {'table', 'key_column', 'key', 'values', 'error'} per key that could not be written
+        self.failures = deque(maxlen=MAX_FAILURES)
+        self._thread = threading.Thread(target=self._run, name=f"bulk-writer-{name}", daemon=True)
+        self._thread.start()
+        _open_writers.add(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def update(self, table, key_column, key, values, block=True):
+        """
+        Queue UPDATE table SET <values> WHERE key_column = key. With block=False
+        the call never waits on backpressure (for callers on an event loop).
+        """
+        group = (table, key_column, tuple(values))
+        with self._cond:
+            self._updates.setdefault(group, {})[key] = tuple(values.values())
+            self._added(1, block)
+
+    def replace(self, table, key_column, key, rows, block=True):
+        """Queue DELETE FROM table WHERE key_column = key, then INSERT rows (dicts with the same keys)."""
+        columns = tuple(rows[0]) if rows else ()
+        with self._cond:
+            # An empty replacement is a plain delete; it shares a group with any column set
+            group = (table, key_column, columns)
+            for other, pending in self._replacements.items():
+                if other[:2] == group[:2] and other != group:
+                    pending.pop(key, None)
+            self._replacements.setdefault(group, {})[key] = [tuple(r[c] for c in columns) for r in rows]
+            self._added(max(1, len(rows)), block)
+
+    def _added(self, count, block=True):
+        self._pending += count
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        if self._pending >= self.max_rows:
+            self._cond.notify_all()
+        # Backpressure: don't let a fast producer buffer without bound
+        while block and self._pending >= self.max_rows * MAX_PENDING_FLUSHES and not self._closed:
+            self._cond.wait(1.0)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._pending >= self.max_rows:
+                        break
+                    if self._oldest is not None:
+                        remaining = self.max_delay - (time.monotonic() - self._oldest)
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                closed = self._closed
+            try:
+                self.flush()
+            except Exception as e:
+                # Keep the thread alive: producers blocked on backpressure depend on it
+                print(f"[{self.name}] flush crashed: {e}")
+            if closed:
+                return
+
+    def _take(self):
+        with self._cond:
+            updates, replacements = self._updates, self._replacements
+            count = self._pending
+            self._updates, self._replacements = {}, {}
+            self._pending, self._oldest = 0, None
+            self._cond.notify_all()
+        return updates, replacements, count
+
+    def flush(self):
+        """Write everything buffered so far. Returns the number of rows written."""
+        with self._flush_lock:
+            updates, replacements, count = self._take()
+            if not count:
+                return 0
+            try:
+                return self._flush_taken(updates, replacements, count)
+            except Exception:
+                # The rows are out of the buffer either way: count them as lost
+                self.stats['failed_rows'] += count
+                raise
+
+    def _flush_taken(self, updates, replacements, count):
+        """Write rows already taken from the buffer, isolating the ones that fail."""
+        # One entry per key: (kind, (table, key_column, columns), key, values)
+        items = [('replace', group, key, rows) for group, by_key in replacements.items()
+                 for key, rows in by_key.items()]
+        items += [('update', group, key, values) for group, by_key in updates.items()
+                  for key, values in by_key.items()]
+        start = time.perf_counter()
+        failed = self._write(items)
+        if failed is None:
+            # The connection itself failed: try the whole flush once more on a fresh one
+            print(f"[{self.name}] retrying flush of {count} rows")
+            failed = self._write(items)
+        if failed is None:
+            failed = [(item, "connection failed") for item in items]
+
+        failed_rows = 0
+        for (kind, (table, key_column, _), key, values), error in failed:
+            failed_rows += max(1, len(values)) if kind == 'replace' else 1
+            self.failures.append({'table': table, 'key_column': key_column, 'key': key,
+                                  'values': values, 'error': str(error)})
+            print(f"[{self.name}] could not write {table} {key_column}={key}: {error}")
+        self.stats['failed_rows'] += failed_rows
+        if len(failed) == len(items):
+            return 0
+
+        elapsed = time.perf_counter() - start
+        self.stats['flushes'] += 1
+        self.stats['rows'] += count - failed_rows
+        self.stats['flush_seconds'] += elapsed
+        self.stats['max_flush_seconds'] = max(self.stats['max_flush_seconds'], elapsed)
+        return count - failed_rows
+
+    def _write(self, items):
+        """
+        Write items in one transaction, leaving out the ones that fail.
+        Returns [(item, error)] for those, or None if the connection failed.
+        """
+        pool = conn = None
+        try:
+            # Inside the try: a failed connect is retried and counted like any connection failure
+            pool = get_db_pool()
+            conn = pool.getconn()
+            with conn.cursor() as cur:
+                failed = self._write_isolating(cur, items)
+            conn.commit()
+            return failed
+        except Exception as e:
+            print(f"[{self.name}] flush failed: {e}")
+            if conn is not None and not conn.closed:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            return None
+        finally:
+            if conn is not None:
+                pool.putconn(conn, close=bool(conn.closed))
+
+    def _write_isolating(self, cur, items):
+        """Try items under a savepoint; on failure roll it back and bisect down to the failing keys."""
+        cur.execute("SAVEPOINT bulk_writer")
+        try:
+            self._write_items(cur, items)
+        except Exception as e:
+            if cur.connection.closed:
+                raise
+            cur.execute("ROLLBACK TO SAVEPOINT bulk_writer")
+            cur.execute("RELEASE SAVEPOINT bulk_writer")
+            if len(items) == 1:
+                return [(items[0], e)]
+            half = len(items) // 2
+            return self._write_isolating(cur, items[:half]) + self._write_isolating(cur, items[half:])
+        cur.execute("RELEASE SAVEPOINT bulk_writer")
+        return []
+
+    def _write_items(self, cur, items):
+        updates, replacements = {}, {}
+        for kind, group, key, values in items:
+            (replacements if kind == 'replace' else updates).setdefault(group, {})[key] = values
+        for (table, key_column, columns), rows in replacements.items():
+            self._write_replacements(cur, table, key_column, columns, rows)
+        for (table, key_column, columns), rows in updates.items():
+            self._write_updates(cur, table, key_column, columns, rows)
+
+    def _types(self, cur, table):
+        """Column -> SQL type, used to cast VALUES literals (empty arrays, NULLs, JSON text)."""
+        if table not in self._column_types:
+            cur.execute("""
+                SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute
+                WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+            """, (table,))
+            self._column_types[table] = dict(cur.fetchall())
+        return self._column_types[table]
+
+    def _template(self, cur, table, columns):
+        types = self._types(cur, table)
+        return "(" + ", ".join(f"%s::{types[c]}" for c in columns) + ")"
+
+    def _write_updates(self, cur, table, key_column, columns, rows):
+        assignments = ", ".join(f"{c} = v.{c}" for c in columns)
+        psycopg2.extras.execute_values(
+            cur,
+            f"UPDATE {table} AS t SET {assignments} FROM (VALUES %s) AS v ({key_column}, {', '.join(columns)}) "
+            f"WHERE t.{key_column} = v.{key_column}",
+            [(key, *values) for key, values in rows.items()],
+            template=self._template(cur, table, (key_column, *columns)),
+            page_size=1000,
+        )
+
+    def _write_replacements(self, cur, table, key_column, columns, rows):
+        cur.execute(f"DELETE FROM {table} WHERE {key_column} = ANY(%s)", (list(rows),))
+        values = [v for children in rows.values() for v in children]
+        if values:
+            # COPY: embedding-sized rows parse far faster than as VALUES literals
+            types = self._types(cur, table)
+            buf = io.StringIO()
+            for row in values:
+                buf.write("\t".join(_copy_field(v, types[c]) for c, v in zip(columns, row)))
+                buf.write("\n")
+            buf.seek(0)
+            cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+    def close(self):
+        """Flush everything and stop the background thread."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        _open_writers.discard(self)
+        self.report()
+
+    def report(self):
+        s = self.stats
+        if not s['flushes'] and not s['failed_rows']:
+            return
+        rate = s['rows'] / s['flush_seconds'] if s['flush_seconds'] else 0.0
+        print(f"[{self.name}] {s['rows']} rows in {s['flushes']} flushes, "
+              f"{s['flush_seconds'] / max(1, s['flushes']) * 1000:.0f} ms avg / "
+              f"{s['max_flush_seconds'] * 1000:.0f} ms max flush latency, {rate:.0f} rows/s"
+              + (f", {s['failed_rows']} rows failed" if s['failed_rows'] else ""))
@@ -0,0 +1,122 @@
+"""
+Theme clustering for vision boards.
+Spherical k-means (cosine k-means on L2-normalized CLIP vectors) with k
+picked by silhouette score, all in NumPy so a board clusters in milliseconds
+from the vectors already stored in the index.
+"""
+
+import numpy as np
+from typing import Optional, Sequence, Tuple
+
+# Silhouette is O(n^2); larger boards are scored on a fixed random sample
+SILHOUETTE_SAMPLE = 1000
+
+
+def _normalize(X: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    return X / np.maximum(norms, 1e-12)
+
+
+def spherical_kmeans(X: np.ndarray, k: int, max_iter: int = 50,
+                     seed: int = 42) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cluster unit vectors by cosine similarity.
+
+    Args:
+        X: (n, d) L2-normalized vectors, n >= k
+        k: Number of clusters
+        max_iter: Iteration cap (stops early once assignments settle)
+        seed: k-means++ seeding, fixed so a board always gets the same themes
+
+    Returns:
+        (labels (n,), centroids (k, d))
+    """
+    rng = np.random.default_rng(seed)
+    n = len(X)
+
+    # k-means++ seeding on cosine distance
+    centroids = np.empty((k, X.shape[1]), dtype=X.dtype)
+    centroids[0] = X[rng.integers(n)]
+    dist = 1.0 - X @ centroids[0]
+    for c in range(1, k):
+        weights = np.maximum(dist, 0) ** 2
+        total = weights.sum()
+        idx = rng.choice(n, p=weights / total) if total > 0 else rng.integers(n)
+        centroids[c] = X[idx]
+        dist = np.minimum(dist, 1.0 - X @ centroids[c])
+
+    labels = np.full(n, -1)
+    for _ in range(max_iter):
+        sims = X @ centroids.T
+        new_labels = np.argmax(sims, axis=1)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+
+        one_hot = np.zeros((n, k), dtype=X.dtype)
+        one_hot[np.arange(n), labels] = 1
+        sums = one_hot.T @ X
+        counts = one_hot.sum(axis=0)
+        # An empty cluster takes over the point worst served by its centroid
+        for c in np.flatnonzero(counts == 0):
+            worst = int(np.argmin(sims[np.arange(n), labels]))
+            sums[c] = X[worst]
+            labels[worst] = c
+            sims[worst, c] = 1.0
+        centroids = _normalize(sums)
+
+    return labels, centroids
+
+
+def silhouette_score(X: np.ndarray, labels: np.ndarray, seed: int = 42) -> float:
+    """Mean silhouette with cosine distance (points in singleton clusters score 0)."""
+    k = int(labels.max()) + 1
+    if k < 2:
+        return 0.0
+    sample = np.arange(len(X))
+    if len(X) > SILHOUETTE_SAMPLE:
+        sample = np.random.default_rng(seed).choice(len(X), SILHOUETTE_SAMPLE, replace=False)
+
+    one_hot = np.zeros((len(X), k), dtype=X.dtype)
+    one_hot[np.arange(len(X)), labels] = 1
+    counts = one_hot.sum(axis=0)
+
+    # Sum of distances from each sampled point to every cluster, via one product
+    dist_sums = (1.0 - X[sample] @ X.T) @ one_hot
+    own = labels[sample]
+    own_counts = counts[own]
+
+    rows = np.arange(len(sample))
+    a = dist_sums[rows, own] / np.maximum(own_counts - 1, 1)
+    mean_other = dist_sums / np.maximum(counts, 1)
+    mean_other[rows, own] = np.inf
+    mean_other[:, counts == 0] = np.inf
+    b = mean_other.min(axis=1)
+
+    s = (b - a) / np.maximum(np.maximum(a, b), 1e-12)
+    s[own_counts <= 1] = 0.0
+    return float(s.mean())
+
+
+def cluster_auto(X: np.ndarray, k_range: Sequence[int] = range(2, 6),
+                 seed: int = 42) -> Tuple[np.ndarray, np.ndarray, Optional[float]]:
+    """
+    Spherical k-means for every k in k_range (capped at n - 1), keeping the
+    one with the best silhouette.
+
+    Returns:
+        (labels, centroids, silhouette); silhouette is None when n < 3
+    """
+    X = _normalize(np.asarray(X, dtype=np.float32))
+    if len(X) < 3:
+        return np.zeros(len(X), dtype=np.int64), _normalize(X.sum(axis=0, keepdims=True)), None
+
+    best = None
+    for k in k_range:
+        if k >= len(X):
+            break
+        labels, centroids = spherical_kmeans(X, k, seed=seed)
+        score = silhouette_score(X, labels, seed=seed)
+        if best is None or score > best[2]:
+            best = (labels, centroids, score)
+    return best
@@ -23,6 +23,38 @@ DEFAULT_INDEX_PATH = BASE_DIR / "faiss_index.bin"
 DB_PATH = Path(os.getenv("DB_PATH", DEFAULT_DB_PATH))
 THUMBNAILS_DIR = Path(os.getenv("THUMBNAILS_DIR", DEFAULT_THUMBNAILS_DIR))
 INDEX_PATH = Path(os.getenv("INDEX_PATH", DEFAULT_INDEX_PATH))
+# How often (seconds) a running server checks whether the indexer published a new index
+INDEX_RELOAD_INTERVAL = float(os.getenv("INDEX_RELOAD_INTERVAL", "2.0"))
+EMBEDDING_CACHE_PATH = Path(os.getenv("EMBEDDING_CACHE_PATH", INDEX_PATH.with_name("embedding_cache.npz")))
+# Taxonomy prompt embeddings (BatchTagger), keyed by model + prompt template
+TAG_EMBEDDINGS_PATH = Path(os.getenv("TAG_EMBEDDINGS_PATH", INDEX_PATH.with_name("tag_embeddings.npz")))
+# Per-image scores for the board attributes (taxonomy.BOARD_ATTRIBUTES), built by the tagger
+ATTRIBUTE_MATRIX_PATH = Path(os.getenv("ATTRIBUTE_MATRIX_PATH", INDEX_PATH.with_name("attribute_scores.npz")))
+# Raw SAM masks per image content + SAM settings (backend/mask_cache.py)
+SAM_CACHE_DIR = Path(os.getenv("SAM_CACHE_DIR", INDEX_PATH.with_name("sam_cache")))
+SCAN_MANIFEST_PATH = Path(os.getenv("SCAN_MANIFEST_PATH", INDEX_PATH.with_name("scan_manifest.json")))
+
+# Write-behind database writer (backend/bulk_writer.py): flush after this many
+# buffered rows or this many seconds, whichever comes first
+WRITE_BEHIND_ROWS = int(os.getenv("WRITE_BEHIND_ROWS", "500"))
+WRITE_BEHIND_SECONDS = float(os.getenv("WRITE_BEHIND_SECONDS", "2.0"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "4"))
+
+# Vision-board analysis cache: boards kept, and how long (seconds) a cached
+# image row is trusted before its xmin is re-checked
+VISION_CACHE_BOARDS = int(os.getenv("VISION_CACHE_BOARDS", "128"))
+VISION_CACHE_TTL = float(os.getenv("VISION_CACHE_TTL", "10"))
+
+# Lead reports (backend/leads.py): job attempts, first retry delay in seconds
+# (doubling per attempt), and report/email threads run inside the API process
+LEAD_MAX_ATTEMPTS = int(os.getenv("LEAD_MAX_ATTEMPTS", "5"))
+LEAD_RETRY_SECONDS = float(os.getenv("LEAD_RETRY_SECONDS", "30"))
+LEAD_WORKER_THREADS = int(os.getenv("LEAD_WORKER_THREADS", "1"))
+
+# Lead PDF images: print resolution (dpi) of the board photos, and how many are
+# fetched/rendered at once
+PDF_IMAGE_DPI = int(os.getenv("PDF_IMAGE_DPI", "200"))
+PDF_FETCH_WORKERS = int(os.getenv("PDF_FETCH_WORKERS", "8"))
 
 # Model
 CLIP_MODEL_NAME = "clip-ViT-B-32" 
@@ -31,5 +63,18 @@ CLIP_MODEL_NAME = "clip-ViT-B-32"
 DEFAULT_TOP_K = 50
 PROJECT_SLUG = os.getenv("PROJECT_SLUG", "lynch")
 
+# Result diversification (MMR). Off by default; requests can opt in per call.
+DIVERSIFY_RESULTS = os.getenv("DIVERSIFY_RESULTS", "false").lower() == "true"
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+MMR_GROUP_BY = os.getenv("MMR_GROUP_BY", "folder")  # "folder" or "project_container_id"
+MMR_MAX_PER_GROUP = int(os.getenv("MMR_MAX_PER_GROUP", "3"))
+
+# Multi-resolution thumbnails (content-addressed, served from /api/thumbnails)
+THUMBNAIL_WIDTHS = tuple(int(w) for w in os.getenv("THUMBNAIL_WIDTHS", "200,400,800").split(","))
+THUMBNAIL_FORMATS = ("webp", "jpg")
+# Render every width during indexing instead of on first request
+THUMBNAIL_EAGER = os.getenv("THUMBNAIL_EAGER", "false").lower() == "true"
+THUMBNAIL_CACHE_MAX_MB = int(os.getenv("THUMBNAIL_CACHE_MAX_MB", "2048"))
+
 # Ensure directories exist
 THUMBNAILS_DIR.mkdir(parents=True, exist_ok=True)
@@ -1,11 +1,14 @@
+import io
 import os
+import csv
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 from datetime import datetime
 from dotenv import load_dotenv
 
 # Import config for PROJECT_SLUG
-from backend.config import PROJECT_SLUG
+from backend.config import PROJECT_SLUG, DB_POOL_MAX
 
 # Load env in case it's not loaded (e.g. running script directly)
 load_dotenv()
@@ -18,6 +21,17 @@ def get_db_connection():
     conn = psycopg2.connect(DATABASE_URL)
     return conn
 
+_pool = None
+
+def get_db_pool():
+    """Process-wide connection pool for long-running writers (see backend/bulk_writer.py)."""
+    global _pool
+    if _pool is None:
+        if not DATABASE_URL:
+            raise ValueError("DATABASE_URL environment variable is not set")
+        _pool = psycopg2.pool.ThreadedConnectionPool(1, DB_POOL_MAX, DATABASE_URL)
+    return _pool
+
 def init_db():
     conn = get_db_connection()
     c = conn.cursor()
@@ -32,7 +46,7 @@ def init_db():
             file_path TEXT UNIQUE NOT NULL,
             filename TEXT,
             folder TEXT,
-            mtime REAL,
+            mtime DOUBLE PRECISION,
             file_hash TEXT,
             exif_date TEXT,
             width INTEGER,
@@ -44,6 +58,19 @@ def init_db():
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+
+    # Older databases stored mtime as REAL (float4), which cannot hold an epoch
+    # timestamp to the second and made every file look modified on each run
+    c.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'images' AND column_name = 'mtime'
+    """)
+    row = c.fetchone()
+    if row and row[0] == 'real':
+        c.execute('ALTER TABLE images ALTER COLUMN mtime TYPE DOUBLE PRECISION')
+
+    # Content-hash lookups (thumbnail renditions, enrichment copy)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_images_file_hash ON images (file_hash)')
     
     # Collections table
     c.execute('''
@@ -120,6 +147,173 @@ def upsert_image(metadata):
     conn.close()
     return img_id
 
+# --- Bulk paths (indexer / importers) ---
+
+UPSERT_COLUMNS = ['file_path', 'filename', 'folder', 'mtime', 'file_hash', 'exif_date',
+                  'width', 'height', 'thumbnail_path', 'project_slug']
+
+def bulk_upsert_images(metadata_list, conn=None, page_size=500):
+    """
+    Multi-row upsert keyed on file_path. Same semantics as upsert_image
+    (existing rows keep filename/folder/project_slug) in one round trip per page.
+    Returns the image ids in the order of metadata_list.
+    """
+    if not metadata_list:
+        return []
+
+    # ON CONFLICT cannot touch the same row twice in one statement: last one wins
+    by_path = {m['file_path']: m for m in metadata_list}
+    rows = [(
+        m['file_path'], m['filename'], m['folder'], m['mtime'], m['file_hash'],
+        m.get('exif_date'), m['width'], m['height'], m['thumbnail_path'], PROJECT_SLUG
+    ) for m in by_path.values()]
+
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        with conn.cursor() as c:
+            returned = psycopg2.extras.execute_values(c, f'''
+                INSERT INTO images ({', '.join(UPSERT_COLUMNS)})
+                VALUES %s
+                ON CONFLICT (file_path) DO UPDATE SET
+                    mtime = EXCLUDED.mtime, file_hash = EXCLUDED.file_hash, exif_date = EXCLUDED.exif_date,
+                    width = EXCLUDED.width, height = EXCLUDED.height, thumbnail_path = EXCLUDED.thumbnail_path,
+                    updated_at = CURRENT_TIMESTAMP
+                RETURNING file_path, id
+            ''', rows, page_size=page_size, fetch=True)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if own_conn:
+            conn.close()
+
+    ids = dict(returned)
+    return [ids[m['file_path']] for m in metadata_list]
+
+def copy_images(rows, columns, conn=None, on_conflict="DO NOTHING"):
+    """
+    COPY-based load: streams rows into a temp table, then merges into images.
+    rows: iterable of tuples matching `columns` (None -> NULL).
+    Returns the number of rows inserted/updated.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow(['\\N' if v is None else v for v in row])
+    buf.seek(0)
+
+    cols = ', '.join(columns)
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        with conn.cursor() as c:
+            # Column types only (no constraints/defaults, so no sequence values are burned)
+            c.execute(f"CREATE TEMP TABLE images_load ON COMMIT DROP AS SELECT {cols} FROM images WITH NO DATA")
+            c.copy_expert(f"COPY images_load ({cols}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf)
+            c.execute(f"""
+                INSERT INTO images ({cols})
+                SELECT {cols} FROM images_load
+                ON CONFLICT (file_path) {on_conflict}
+            """)
+            count = c.rowcount
+        conn.commit()
+        return count
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if own_conn:
+            conn.close()
+
+def delete_images(image_ids, conn=None):
+    """Batched delete in a single statement."""
+    if not image_ids:
+        return 0
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        with conn.cursor() as c:
+            c.execute('DELETE FROM images WHERE id = ANY(%s)', (list(image_ids),))
+            count = c.rowcount
+        conn.commit()
+        return count
+    finally:
+        if own_conn:
+            conn.close()
+
+def touch_images(id_mtimes, conn=None):
+    """Record a new mtime for files whose content hash did not change."""
+    if not id_mtimes:
+        return
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        with conn.cursor() as c:
+            psycopg2.extras.execute_values(c, '''
+                UPDATE images SET mtime = v.mtime
+                FROM (VALUES %s) AS v(id, mtime)
+                WHERE images.id = v.id
+            ''', id_mtimes)
+        conn.commit()
+    finally:
+        if own_conn:
+            conn.close()
+
+ENRICHMENT_COLUMNS = [
+    'tags', 'caption', 'style_scores', 'rich_tags', 'hardscape_materials', 'softscape_elements',
+    'architectural_features', 'design_style', 'lighting_atmosphere', 'maintenance_level',
+    'seasonal_interest', 'spatial_purpose', 'color_palette', 'privacy_level', 'terrain_type',
+    'hardscape_ratio', 'material_palette'
+]
+
+def copy_enrichment_by_hash(image_ids, conn=None):
+    """
+    Fill missing tagging/GPT enrichment on the given rows from another row
+    with the same file_hash. Returns the number of rows touched.
+    """
+    if not image_ids:
+        return 0
+    # tags/style_scores default to empty JSON rather than NULL
+    empty = {'tags': "'[]'::jsonb", 'style_scores': "'{}'::jsonb"}
+    assignments = ', '.join(
+        f"{col} = COALESCE(NULLIF(dst.{col}, {empty[col]}), src.{col})" if col in empty
+        else f"{col} = COALESCE(dst.{col}, src.{col})"
+        for col in ENRICHMENT_COLUMNS
+    )
+    src_cols = ', '.join(ENRICHMENT_COLUMNS)
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    try:
+        with conn.cursor() as c:
+            c.execute(f'''
+                UPDATE images dst SET {assignments}
+                FROM (
+                    SELECT DISTINCT ON (file_hash) id, file_hash, {src_cols}
+                    FROM images
+                    WHERE file_hash IS NOT NULL
+                      AND ((tags IS NOT NULL AND tags <> '[]'::jsonb) OR rich_tags IS NOT NULL)
+                    ORDER BY file_hash, (rich_tags IS NULL), id
+                ) src
+                WHERE dst.id = ANY(%s)
+                  AND src.file_hash = dst.file_hash AND src.id <> dst.id
+            ''', (list(image_ids),))
+            count = c.rowcount
+        conn.commit()
+        return count
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if own_conn:
+            conn.close()
+
 def set_favorite(image_id, is_favorite):
     conn = get_db_connection()
     c = conn.cursor()
@@ -214,6 +408,59 @@ def get_all_images_map():
     conn.close()
     return {r['file_path']: dict(r) for r in rows}
 
+def get_images_by_paths(file_paths):
+    """Same shape as get_all_images_map, restricted to the given paths."""
+    if not file_paths:
+        return {}
+    conn = get_db_connection()
+    c = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    sql = 'SELECT id, file_path, mtime, file_hash FROM images WHERE file_path = ANY(%s)'
+    params = [list(file_paths)]
+    if PROJECT_SLUG:
+        sql += " AND project_slug = %s"
+        params.append(PROJECT_SLUG)
+    c.execute(sql, tuple(params))
+    rows = c.fetchall()
+    conn.close()
+    return {r['file_path']: dict(r) for r in rows}
+
+def get_all_image_ids():
+    """Every image id across all projects (the index may be shared)."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT id FROM images')
+    ids = {r[0] for r in c.fetchall()}
+    conn.close()
+    return ids
+
+def get_image_by_hash(file_hash):
+    """Source location (file_path, thumbnail_path) for a content hash, or None."""
+    conn = get_db_connection()
+    c = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    sql = 'SELECT file_path, thumbnail_path FROM images WHERE file_hash = %s'
+    params = [file_hash]
+    if PROJECT_SLUG:
+        sql += " AND project_slug = %s"
+        params.append(PROJECT_SLUG)
+    c.execute(sql + ' LIMIT 1', tuple(params))
+    img = c.fetchone()
+    conn.close()
+    return dict(img) if img else None
+
+def get_thumbnail_references():
+    """
+    (thumbnail_path set, file_hash set) across ALL projects, since every
+    project shares the thumbnails directory. Used for orphan collection.
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT thumbnail_path, file_hash FROM images')
+    rows = c.fetchall()
+    conn.close()
+    thumbs = {os.path.basename(t) for t, _ in rows if t and not t.startswith('http')}
+    hashes = {h for _, h in rows if h}
+    return thumbs, hashes
+
 def delete_image(image_id):
     conn = get_db_connection()
     c = conn.cursor()
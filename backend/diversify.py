@@ -0,0 +1,76 @@
+"""
+Result diversification via maximal marginal relevance (MMR).
+Portfolios contain many near-identical shots of the same job, so after
+retrieval we re-rank candidates to trade a little relevance for variety,
+optionally capping how many results a single folder/project may contribute.
+"""
+
+import numpy as np
+from typing import List, Optional, Sequence
+
+
+def mmr_select(vectors: np.ndarray,
+               relevance: Sequence[float],
+               top_k: int,
+               lambda_: float = 0.7,
+               groups: Optional[Sequence] = None,
+               max_per_group: Optional[int] = None) -> List[int]:
+    """
+    Greedy MMR selection over a candidate set.
+
+    Args:
+        vectors: (n, d) L2-normalized candidate embeddings
+        relevance: Retrieval score per candidate (higher is better)
+        top_k: Number of results to select
+        lambda_: 1.0 = pure relevance, 0.0 = pure diversity
+        groups: Optional group key per candidate (folder, project id, ...)
+        max_per_group: Hard cap on results per group (None = no cap)
+
+    Returns:
+        Indices into the candidate list, in selection order
+    """
+    n = len(relevance)
+    if n == 0 or top_k <= 0:
+        return []
+
+    V = np.ascontiguousarray(vectors, dtype=np.float32)
+    rel = np.asarray(relevance, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+
+    # Redundancy of each candidate w.r.t. the selected set: max cosine sim.
+    # Each step only needs the similarity column of the newly selected item,
+    # so we fill the (n x k) slice of the Gram matrix on demand rather than
+    # materializing the full (n x n) matrix.
+    max_sim = np.zeros(n, dtype=np.float32)
+
+    if groups is not None and max_per_group:
+        _, group_codes = np.unique(np.asarray([str(g) for g in groups]), return_inverse=True)
+        group_counts = np.zeros(group_codes.max() + 1, dtype=np.int32)
+    else:
+        group_codes = None
+
+    selected = []
+    while len(selected) < top_k and available.any():
+        if selected:
+            mmr = lambda_ * rel - (1.0 - lambda_) * max_sim
+        else:
+            mmr = rel.copy()
+        mmr[~available] = -np.inf
+        j = int(np.argmax(mmr))
+
+        selected.append(j)
+        available[j] = False
+
+        sims = V @ V[j]
+        if len(selected) == 1:
+            max_sim = sims
+        else:
+            np.maximum(max_sim, sims, out=max_sim)
+
+        if group_codes is not None:
+            g = group_codes[j]
+            group_counts[g] += 1
+            if group_counts[g] >= max_per_group:
+                available &= group_codes != g
+
+    return selected
@@ -0,0 +1,66 @@
+"""
+Content-hash -> CLIP vector cache, persisted next to the FAISS index.
+Lets the indexer skip the encode for byte-identical files (copies under a new
+path, or files whose mtime was touched by rsync / Drive sync).
+"""
+
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from backend.config import EMBEDDING_CACHE_PATH, CLIP_MODEL_NAME
+
+
+class EmbeddingCache:
+    def __init__(self, path=EMBEDDING_CACHE_PATH, model_name=CLIP_MODEL_NAME, load=True):
+        self.path = Path(path)
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._vectors = {}  # file_hash -> float32 vector (L2-normalized)
+        self._dirty = False
+        if load:
+            self.load()
+
+    def __len__(self):
+        return len(self._vectors)
+
+    def load(self):
+        if not self.path.exists():
+            return
+        try:
+            data = np.load(self.path, allow_pickle=False)
+            if str(data['model']) != self.model_name:
+                print(f"Embedding cache {self.path} was built with {data['model']}, ignoring it.")
+                return
+            self._vectors = dict(zip(data['hashes'].tolist(), data['vectors']))
+        except Exception as e:
+            print(f"Could not read embedding cache {self.path}: {e}")
+
+    def get(self, file_hash) -> Optional[np.ndarray]:
+        if not file_hash:
+            return None
+        with self._lock:
+            return self._vectors.get(file_hash)
+
+    def put(self, file_hash, vector):
+        if not file_hash:
+            return
+        with self._lock:
+            self._vectors[file_hash] = np.asarray(vector, dtype=np.float32)
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            hashes = np.array(list(self._vectors.keys()))
+            vectors = np.stack(list(self._vectors.values())) if self._vectors else np.zeros((0, 0), np.float32)
+            self._dirty = False
+
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, hashes=hashes, vectors=vectors, model=np.array(self.model_name))
+        os.replace(tmp_path, self.path)
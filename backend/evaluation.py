@@ -0,0 +1,241 @@
+"""
+Offline retrieval evaluation harness.
+Builds a judged query set from stored labels (CLIP `tags` from the TAXONOMY and
+GPT `rich_tags`), then runs every retrieval configuration against it and reports
+recall@k, nDCG@k and latency side by side.
+
+Usage:
+    python3 -m backend.evaluation --k 10
+    python3 -m backend.evaluation --configs baseline,strict --save-queries data/eval_queries.json
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+from collections import Counter
+from pathlib import Path
+from typing import List, Dict, Any
+
+import numpy as np
+import psycopg2.extras
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.config import PROJECT_SLUG
+from backend.db import get_db_connection
+from backend.taxonomy import TAXONOMY, get_tag_label
+
+# Each configuration is a set of attribute overrides applied to the strategy
+# instance for the duration of its run. Attributes that a strategy does not
+# define are ignored, so one config can cover both strategies.
+CONFIGS = {
+    "baseline": {},
+    "strict": {"SEMANTIC_CUTOFF": 0.27, "LOW_CONFIDENCE_CUTOFF": 0.25},
+    "loose": {"SEMANTIC_CUTOFF": 0.22, "LOW_CONFIDENCE_CUTOFF": 0.20},
+    "no_keyword_boost": {"KEYWORD_BOOST": 0.0, "KEYWORD_ONLY_SCORE": 0.0},
+    "small_pool": {"MIN_SEARCH_K": 200, "SEARCH_K": 200},
+}
+
+
+# --- Judged query set ---
+
+def build_judged_queries(project_slug: str = PROJECT_SLUG, min_relevant: int = 3,
+                         max_rich_tags: int = 50) -> List[Dict[str, Any]]:
+    """
+    Build judged queries from the labels already stored on each image.
+
+    Args:
+        project_slug: Restrict the judged set to one project (None = all)
+        min_relevant: Drop queries with fewer relevant images than this
+        max_rich_tags: Number of most frequent rich_tags to turn into queries
+
+    Returns:
+        List of {"query", "source", "relevant"} dicts
+    """
+    conn = get_db_connection()
+    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+        sql = "SELECT id, tags, rich_tags FROM images"
+        params = []
+        if project_slug:
+            sql += " WHERE project_slug = %s"
+            params.append(project_slug)
+        cur.execute(sql, tuple(params))
+        rows = cur.fetchall()
+    conn.close()
+
+    by_tag = {}
+    by_rich_tag = {}
+    for row in rows:
+        for tag in row['tags'] or []:
+            by_tag.setdefault(tag, set()).add(row['id'])
+        for rich in row['rich_tags'] or []:
+            by_rich_tag.setdefault(rich.strip().lower(), set()).add(row['id'])
+
+    queries = []
+    for category, tags in TAXONOMY.items():
+        for tag in tags:
+            relevant = by_tag.get(tag, set())
+            if len(relevant) >= min_relevant:
+                queries.append({
+                    "query": get_tag_label(tag).lower(),
+                    "source": f"taxonomy:{category}",
+                    "relevant": sorted(relevant),
+                })
+
+    rich_counts = Counter({tag: len(ids) for tag, ids in by_rich_tag.items()})
+    for rich, count in rich_counts.most_common(max_rich_tags):
+        if count >= min_relevant:
+            queries.append({
+                "query": rich,
+                "source": "rich_tags",
+                "relevant": sorted(by_rich_tag[rich]),
+            })
+
+    return queries
+
+
+def save_queries(queries: List[Dict[str, Any]], path: str):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(queries, f, indent=2)
+
+
+def load_queries(path: str) -> List[Dict[str, Any]]:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+# --- Metrics ---
+
+def recall_at_k(ranked_ids: List[int], relevant: set, k: int) -> float:
+    """Share of all relevant images found in the top k (below 1 whenever |relevant| > k)."""
+    if not relevant:
+        return 0.0
+    hits = len(set(ranked_ids[:k]) & relevant)
+    return hits / len(relevant)
+
+
+def ndcg_at_k(ranked_ids: List[int], relevant: set, k: int) -> float:
+    """Binary-gain nDCG."""
+    dcg = sum(1.0 / math.log2(rank + 2) for rank, iid in enumerate(ranked_ids[:k]) if iid in relevant)
+    ideal = sum(1.0 / math.log2(rank + 2) for rank in range(min(len(relevant), k)))
+    return dcg / ideal if ideal else 0.0
+
+
+def ranked_image_ids(search_data) -> List[int]:
+    """Flatten either strategy's output into an ordered list of image ids."""
+    results = search_data.get("results", []) if isinstance(search_data, dict) else search_data
+    ranked = []
+    seen = set()
+    for item in results:
+        if 'assets' in item:
+            images = item['assets'].get('after', [])
+        elif 'id' in item and item.get('type') != 'knowledge_card':
+            images = [item]
+        else:
+            images = []
+        for img in images:
+            if img['id'] not in seen:
+                seen.add(img['id'])
+                ranked.append(img['id'])
+    return ranked
+
+
+# --- Runner ---
+
+def evaluate_config(strategy, queries: List[Dict[str, Any]], overrides: Dict[str, Any],
+                    k: int = 10, project_slug: str = PROJECT_SLUG) -> Dict[str, float]:
+    """Run all queries against one strategy with the given attribute overrides."""
+    saved = {}
+    for attr, value in overrides.items():
+        if hasattr(strategy, attr):
+            saved[attr] = getattr(strategy, attr)
+            setattr(strategy, attr, value)
+
+    recalls, ndcgs, latencies = [], [], []
+    try:
+        for q in queries:
+            relevant = set(q['relevant'])
+            start = time.perf_counter()
+            search_data = strategy.search(q['query'], k, False, None, project_slug)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+            ranked = ranked_image_ids(search_data)
+            recalls.append(recall_at_k(ranked, relevant, k))
+            ndcgs.append(ndcg_at_k(ranked, relevant, k))
+    finally:
+        for attr, value in saved.items():
+            setattr(strategy, attr, value)
+
+    lat = np.array(latencies) if latencies else np.zeros(1)
+    return {
+        f"recall@{k}": float(np.mean(recalls)) if recalls else 0.0,
+        f"ndcg@{k}": float(np.mean(ndcgs)) if ndcgs else 0.0,
+        "p50_ms": float(np.percentile(lat, 50)),
+        "p95_ms": float(np.percentile(lat, 95)),
+    }
+
+
+def run_evaluation(queries: List[Dict[str, Any]], config_names: List[str] = None, k: int = 10,
+                   project_slug: str = PROJECT_SLUG) -> Dict[str, Dict[str, float]]:
+    from backend.search_strategies.coordinator import StrategyCoordinator
+
+    strategy = StrategyCoordinator().get_strategy(project_slug)
+    # Warm up once so model/index first-touch cost is not charged to the first config
+    if queries:
+        strategy.search(queries[0]['query'], k, False, None, project_slug)
+
+    report = {}
+    for name in config_names or list(CONFIGS.keys()):
+        report[name] = evaluate_config(strategy, queries, CONFIGS[name], k, project_slug)
+    return report
+
+
+def print_report(report: Dict[str, Dict[str, float]]):
+    if not report:
+        return
+    columns = list(next(iter(report.values())).keys())
+    print(f"{'config':<20}" + "".join(f"{c:>12}" for c in columns))
+    print("-" * (20 + 12 * len(columns)))
+    for name, metrics in report.items():
+        print(f"{name:<20}" + "".join(f"{metrics[c]:>12.3f}" for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate retrieval quality vs. speed")
+    parser.add_argument('--k', type=int, default=10, help='Cutoff for recall/nDCG')
+    parser.add_argument('--configs', type=str, help='Comma-separated config names (default: all)')
+    parser.add_argument('--queries', type=str, help='Load judged queries from JSON instead of the DB')
+    parser.add_argument('--save-queries', type=str, help='Write the judged query set to JSON')
+    parser.add_argument('--min-relevant', type=int, default=3, help='Minimum relevant images per query')
+    parser.add_argument('--slug', type=str, default=PROJECT_SLUG,
+                        help='Project slug to evaluate (only when PROJECT_SLUG is unset)')
+    args = parser.parse_args()
+    # Search always filters on a configured PROJECT_SLUG, so judging another project would score the wrong results
+    if PROJECT_SLUG and args.slug != PROJECT_SLUG:
+        parser.error(f"search is pinned to PROJECT_SLUG={PROJECT_SLUG}; run with PROJECT_SLUG={args.slug} instead")
+
+    config_names = args.configs.split(',') if args.configs else None
+    unknown = set(config_names or ()) - set(CONFIGS)
+    if unknown:
+        parser.error(f"unknown configs: {', '.join(sorted(unknown))} (choose from {', '.join(CONFIGS)})")
+
+    if args.queries:
+        queries = load_queries(args.queries)
+    else:
+        queries = build_judged_queries(args.slug, min_relevant=args.min_relevant)
+    print(f"Judged queries: {len(queries)}")
+
+    if args.save_queries:
+        save_queries(queries, args.save_queries)
+        print(f"Saved judged queries to {args.save_queries}")
+
+    report = run_evaluation(queries, config_names, k=args.k, project_slug=args.slug)
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Per-image ingestion helpers used by the indexer.
+Kept free of torch/faiss imports so process-pool workers start quickly.
+"""
+
+import io
+import os
+import math
+import time
+import hashlib
+from datetime import datetime
+
+from PIL import Image
+
+from backend.config import THUMBNAILS_DIR, THUMBNAIL_EAGER, THUMBNAIL_WIDTHS
+from backend.thumbnails import write_renditions
+
+# CLIP (ViT-B-32) resizes the shortest side to 224 before center-cropping,
+# so shipping anything larger between processes is wasted bandwidth.
+CLIP_INPUT_SIZE = 224
+THUMBNAIL_SIZE = (600, 600)
+
+# EXIF tag ids (PIL exposes them numerically)
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 36867
+
+
+def calculate_file_hash(filepath, block_size=65536):
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def read_and_hash(filepath, block_size=1 << 20):
+    """Read a file into memory, hashing it in the same pass."""
+    sha256 = hashlib.sha256()
+    buf = io.BytesIO()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha256.update(block)
+            buf.write(block)
+    buf.seek(0)
+    return buf, sha256.hexdigest()
+
+
+def exif_date_from_pil(img):
+    """DateTimeOriginal from an already-open PIL image (no extra file read)."""
+    try:
+        date_str = img.getexif().get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL)
+        if date_str:
+            return datetime.strptime(str(date_str).strip('\x00 '), '%Y:%m:%d %H:%M:%S').isoformat()
+    except Exception as e:
+        print(f"Error reading EXIF: {e}")
+    return None
+
+
+def draft_size(width, height, thumb_size=THUMBNAIL_SIZE):
+    """Smallest size that still serves both the thumbnail and the CLIP input."""
+    scale = max(max(thumb_size) / max(width, height), CLIP_INPUT_SIZE / min(width, height))
+    scale = min(scale, 1.0)
+    return math.ceil(width * scale), math.ceil(height * scale)
+
+
+def thumbnail_name(key):
+    """Thumbnail filename for a path or content hash."""
+    return hashlib.md5(key.encode()).hexdigest() + ".jpg"
+
+
+def resize_for_clip(img):
+    """Downscale so the shortest side is CLIP_INPUT_SIZE (same as CLIP's own preprocessing)."""
+    img = img.convert('RGB')
+    w, h = img.size
+    scale = CLIP_INPUT_SIZE / min(w, h)
+    if scale < 1:
+        img = img.resize((max(1, round(w * scale)), max(1, round(h * scale))), Image.BICUBIC)
+    return img
+
+
+def prepare_image(path):
+    """
+    Decode stage of the indexing pipeline (runs in a worker process).
+
+    Returns:
+        dict with DB metadata, the CLIP-ready PIL image and stage timing,
+        or {'file_path', 'error'} if the file could not be processed
+    """
+    start = time.perf_counter()
+    try:
+        stat = os.stat(path)
+        # One read (hashed on the way in) and one decode serve everything below
+        buf, file_hash = read_and_hash(path)
+        with Image.open(buf) as img:
+            width, height = img.size
+            exif_date = exif_date_from_pil(img)
+            # JPEG draft mode decodes at 1/2, 1/4 or 1/8 scale directly from the DCT
+            longest = max(THUMBNAIL_SIZE + (THUMBNAIL_WIDTHS if THUMBNAIL_EAGER else ()))
+            img.draft('RGB', draft_size(width, height, (longest, longest)))
+            img.load()
+
+            rgb = img.convert('RGB')
+
+        thumb = rgb.copy()
+        thumb.thumbnail(THUMBNAIL_SIZE)
+        clip_image = resize_for_clip(rgb)
+        # Content-addressed, so byte-identical copies share one thumbnail
+        rel_path = thumbnail_name(file_hash)
+        thumb_path = THUMBNAILS_DIR / rel_path
+        if not thumb_path.exists():
+            thumb.save(thumb_path, "JPEG", optimize=True, quality=80)
+        if THUMBNAIL_EAGER:
+            write_renditions(rgb, file_hash)
+
+        return {
+            'meta': {
+                'file_path': path,
+                'filename': os.path.basename(path),
+                'folder': os.path.dirname(path),
+                'mtime': stat.st_mtime,
+                'file_hash': file_hash,
+                'exif_date': exif_date,
+                'width': width,
+                'height': height,
+                'thumbnail_path': rel_path
+            },
+            'clip_image': clip_image,
+            'seconds': time.perf_counter() - start,
+        }
+    except Exception as e:
+        return {'file_path': path, 'error': str(e), 'seconds': time.perf_counter() - start}
@@ -0,0 +1,352 @@
+"""
+Publishing and loading of the FAISS index.
+The indexer writes the index to a temp file, fsyncs it and renames it into
+place, next to a JSON manifest (model, dim, metric, index type, id range,
+checksum). Loaders verify the manifest before using the index, and a running
+server picks up a new index by noticing the files changed and re-reading them.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+import faiss
+
+from backend.config import INDEX_PATH, INDEX_RELOAD_INTERVAL, CLIP_MODEL_NAME
+
+MANIFEST_FORMAT = 1
+METRIC_NAMES = {faiss.METRIC_INNER_PRODUCT: "inner_product", faiss.METRIC_L2: "l2"}
+
+
+class IndexManifestError(ValueError):
+    """The index on disk does not match its manifest or the running configuration."""
+
+
+class IndexChecksumError(IndexManifestError):
+    """The index bytes do not match the manifest checksum (usually a publish in progress)."""
+
+
+def manifest_path(path=INDEX_PATH):
+    return path.with_name(path.name + ".manifest.json")
+
+
+def index_version(path=INDEX_PATH):
+    """Cheap change token for the published index + manifest (None if missing)."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    try:
+        mst = os.stat(manifest_path(path))
+        manifest_token = (mst.st_mtime_ns, mst.st_size, mst.st_ino)
+    except FileNotFoundError:
+        manifest_token = None
+    return (st.st_mtime_ns, st.st_size, st.st_ino, manifest_token)
+
+
+def hashes_path(path=INDEX_PATH):
+    return path.with_name(path.name + ".hashes.npz")
+
+
+def read_index_hashes(path=INDEX_PATH):
+    """id -> content hash its vector was computed from ({} if never written)."""
+    try:
+        with np.load(hashes_path(path), allow_pickle=False) as data:
+            return dict(zip(data['ids'].tolist(), (h.decode() for h in data['hashes'].tolist())))
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Could not read {hashes_path(path)}: {e}")
+        return {}
+
+
+def write_index_hashes(hashes, path=INDEX_PATH):
+    """
+    Publish id -> content hash for the vectors in the index. Written after the
+    index itself, so after a crash in between it can only be older than the
+    index: an id then looks stale and is re-embedded, never the other way round.
+    """
+    hpath = hashes_path(path)
+    tmp_path = hpath.with_name(hpath.name + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, ids=np.fromiter(hashes.keys(), dtype=np.int64, count=len(hashes)),
+                 hashes=np.array([h or '' for h in hashes.values()], dtype='S64'))
+    os.replace(tmp_path, hpath)
+
+
+def read_manifest(path=INDEX_PATH):
+    try:
+        with open(manifest_path(path), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def describe_index(index):
+    """Structural facts recorded in (and checked against) the manifest."""
+    if hasattr(index, 'id_map'):
+        ids = faiss.vector_to_array(index.id_map)
+        inner = type(faiss.downcast_index(index.index)).__name__
+        index_type = f"{type(index).__name__}({inner})"
+    else:
+        ids = np.arange(index.ntotal, dtype=np.int64)
+        index_type = type(index).__name__
+    return {
+        'dim': index.d,
+        'metric': METRIC_NAMES.get(index.metric_type, str(index.metric_type)),
+        'index_type': index_type,
+        'ntotal': int(index.ntotal),
+        'unique_ids': int(len(np.unique(ids))),
+        'id_min': int(ids.min()) if len(ids) else None,
+        'id_max': int(ids.max()) if len(ids) else None,
+    }
+
+
+def _sha256_file(path, block_size=1 << 20):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass  # directories cannot be fsynced on every platform
+    finally:
+        os.close(fd)
+
+
+def write_index(index, path=INDEX_PATH, model_name=CLIP_MODEL_NAME, **extra):
+    """
+    Publish an index: temp file -> fsync -> atomic rename, then the same for
+    its manifest. A reader that lands between the two renames sees a checksum
+    mismatch and keeps its current index until the manifest arrives.
+
+    Returns:
+        The manifest that was written
+    """
+    tmp_path = path.with_name(path.name + ".tmp")
+    faiss.write_index(index, str(tmp_path))
+    _fsync_path(tmp_path)
+
+    previous = read_manifest(path) or {}
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'version': previous.get('version', 0) + 1,
+        'built_at': datetime.now(timezone.utc).isoformat(),
+        'model': model_name,
+        **describe_index(index),
+        'size_bytes': os.path.getsize(tmp_path),
+        'sha256': _sha256_file(tmp_path),
+        **extra,
+    }
+    mpath = manifest_path(path)
+    tmp_manifest = mpath.with_name(mpath.name + ".tmp")
+    with open(tmp_manifest, 'w') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+    os.replace(tmp_manifest, mpath)
+    _fsync_path(path.parent)
+    return manifest
+
+
+def load_index(path=INDEX_PATH, model_name=CLIP_MODEL_NAME):
+    """
+    Read and verify a published index.
+
+    Returns:
+        (index, manifest), (None, None) if there is no index yet. Indexes
+        written before manifests existed load with manifest None.
+
+    Raises:
+        IndexManifestError: model, checksum or shape does not match
+    """
+    if not path.exists():
+        return None, None
+
+    manifest = read_manifest(path)
+    # One read serves both the checksum and deserialization
+    with open(path, 'rb') as f:
+        blob = f.read()
+
+    if manifest is None:
+        print(f"WARNING: {path} has no manifest; loading it unverified.")
+    else:
+        if manifest.get('model') != model_name:
+            raise IndexManifestError(
+                f"{path} was built with {manifest.get('model')}, but {model_name} is configured. "
+                f"Rebuild it with: python3 backend/indexer.py --reindex")
+        if hashlib.sha256(blob).hexdigest() != manifest.get('sha256'):
+            raise IndexChecksumError(f"{path} does not match its manifest checksum (publish in progress or corrupt file)")
+
+    index = faiss.deserialize_index(np.frombuffer(blob, dtype=np.uint8))
+    if manifest is not None and (index.d != manifest.get('dim') or index.ntotal != manifest.get('ntotal')):
+        raise IndexManifestError(
+            f"{path} has dim={index.d}, ntotal={index.ntotal}; manifest says "
+            f"dim={manifest.get('dim')}, ntotal={manifest.get('ntotal')}")
+    return index, manifest
+
+
+def read_index(path=INDEX_PATH):
+    return load_index(path)[0]
+
+
+def compact_index(index, keep_ids=None):
+    """
+    Rebuild an IndexIDMap so it holds exactly one vector per id (the most
+    recently added), optionally only for keep_ids, with rows sorted by id.
+    Clears out duplicates left by interrupted updates and vectors whose rows
+    were deleted behind the indexer's back.
+
+    Returns:
+        (new_index, number of vectors dropped)
+    """
+    ids, vectors = index_vectors(index)
+    if keep_ids is not None:
+        keep = np.isin(ids, np.fromiter(keep_ids, dtype=np.int64))
+        ids, vectors = ids[keep], vectors[keep]
+
+    flat = faiss.IndexFlatIP(index.d) if index.metric_type == faiss.METRIC_INNER_PRODUCT else faiss.IndexFlatL2(index.d)
+    compacted = faiss.IndexIDMap(flat)
+    if len(ids):
+        compacted.add_with_ids(np.ascontiguousarray(vectors), ids)
+    return compacted, int(index.ntotal - compacted.ntotal)
+
+
+def index_vectors(index):
+    """
+    Stored vectors of an IndexIDMap, one per id (the most recently added).
+
+    Returns:
+        (ids, vectors) sorted by id
+    """
+    unique_ids, rows = _id_rows(index)
+    return unique_ids, _stored_vectors(index)[rows]
+
+
+def _id_rows(index):
+    """(sorted unique ids, storage row of each id's most recently added vector)."""
+    ids = faiss.vector_to_array(index.id_map)
+    # np.unique over the reversed ids gives the last occurrence of each id, in id order
+    unique_ids, first_in_reversed = np.unique(ids[::-1], return_index=True)
+    return unique_ids, len(ids) - 1 - first_in_reversed
+
+
+def _stored_vectors(index):
+    """
+    All stored vectors of an IndexIDMap in storage order. For flat indexes this
+    is a view of the index's own memory (valid only while index is alive).
+    """
+    if not index.ntotal:
+        return np.zeros((0, index.d), np.float32)
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexFlat):
+        return faiss.rev_swig_ptr(inner.get_xb(), inner.ntotal * inner.d).reshape(inner.ntotal, inner.d)
+    return index.index.reconstruct_n(0, index.ntotal)
+
+
+class IndexHandle:
+    """Holds the current index and reloads it when the published files change."""
+
+    def __init__(self, path=INDEX_PATH, reload_interval=INDEX_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.index = None
+        self.manifest = None
+        self.version = None
+        self._last_check = 0.0
+        self._table = None  # (index, ids, rows, vectors) behind lookup()
+        self._table_lock = threading.Lock()
+        self.reload()
+
+    def reload(self, attempts=3):
+        # A publish may be between its two renames; give it a moment to finish
+        for attempt in range(attempts):
+            self.version = index_version(self.path)
+            try:
+                self.index, self.manifest = load_index(self.path)
+                break
+            except IndexChecksumError:
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(0.5)
+        self._last_check = time.monotonic()
+        return self.index
+
+    def refresh(self):
+        """Reload if the files changed. Returns True when a new index was loaded."""
+        now = time.monotonic()
+        if now - self._last_check < self.reload_interval:
+            return False
+        self._last_check = now
+        version = index_version(self.path)
+        if version is None or version == self.version:
+            return False
+        print(f"Index changed on disk, reloading {self.path}")
+        try:
+            index, manifest = load_index(self.path)
+        except IndexManifestError as e:
+            # Keep serving the current index; a completed publish changes the version again
+            print(f"Refusing new index: {e}")
+            self.version = version
+            return False
+        self.index, self.manifest, self.version = index, manifest, version
+        return True
+
+    def lookup(self, image_ids):
+        """
+        Stored vectors for DB ids, read straight from the loaded index (no
+        second copy of the vectors is kept).
+
+        Returns:
+            (found mask over image_ids, float32 vectors for the found ids)
+        """
+        index, ids, rows, vectors = self._vector_table()
+        wanted = np.asarray(image_ids, dtype=np.int64)
+        if not len(ids) or not len(wanted):
+            return np.zeros(len(wanted), dtype=bool), np.zeros((0, vectors.shape[1]), np.float32)
+        pos = np.clip(np.searchsorted(ids, wanted), 0, len(ids) - 1)
+        found = ids[pos] == wanted
+        # Fancy indexing copies out of the index while `index` keeps it alive
+        return found, vectors[rows[pos[found]]]
+
+    def _vector_table(self):
+        table = self._table
+        if table is not None and table[0] is self.index:
+            return table
+        with self._table_lock:
+            index = self.index
+            if self._table is None or self._table[0] is not index:
+                if index is None:
+                    empty = np.zeros(0, dtype=np.int64)
+                    self._table = (None, empty, empty, np.zeros((0, 1), np.float32))
+                else:
+                    ids, rows = _id_rows(index)
+                    self._table = (index, ids, rows, _stored_vectors(index))
+            return self._table
+
+
+_shared_handles = {}
+_shared_lock = threading.Lock()
+
+
+def shared_index_handle(path=INDEX_PATH):
+    """
+    The process-wide IndexHandle for path. Search strategies and the vision
+    analyzer share it, so the API holds the index (and its vectors) once.
+    """
+    with _shared_lock:
+        if path not in _shared_handles:
+            _shared_handles[path] = IndexHandle(path)
+        return _shared_handles[path]
@@ -1,67 +1,107 @@
 import os
 import sys
-import hashlib
 import time
-import shutil
+import queue
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from datetime import datetime
 import argparse
 
 import numpy as np
-from PIL import Image
-import exifread
 import faiss
-from sentence_transformers import SentenceTransformer
 
 # Add parent directory to path to allow importing backend modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from backend.config import PHOTO_FOLDER, THUMBNAILS_DIR, INDEX_PATH, CLIP_MODEL_NAME
-from backend.db import init_db, upsert_image, get_all_images_map, delete_image, get_db_connection
+from backend.config import PHOTO_FOLDER, INDEX_PATH, CLIP_MODEL_NAME
+from backend.db import (
+    init_db, get_all_images_map, get_db_connection,
+    bulk_upsert_images, delete_images, touch_images, copy_enrichment_by_hash,
+    get_images_by_paths, get_all_image_ids
+)
+from backend.embedding_cache import EmbeddingCache
+from backend.scan_manifest import ScanManifest
+from backend.index_store import (
+    load_index, write_index, compact_index, read_index_hashes, write_index_hashes,
+    IndexManifestError, IndexChecksumError
+)
+from backend.image_io import calculate_file_hash, prepare_image
 
 # Supported image extensions
 IMAGE_EXTS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tiff'}
 
-def calculate_file_hash(filepath, block_size=65536):
-    sha256 = hashlib.sha256()
-    with open(filepath, 'rb') as f:
-        for block in iter(lambda: f.read(block_size), b''):
-            sha256.update(block)
-    return sha256.hexdigest()
-
-def get_exif_date(filepath):
-    try:
-        with open(filepath, 'rb') as f:
-            tags = exifread.process_file(f, stop_tag='EXIF DateTimeOriginal')
-            date_str = str(tags.get('EXIF DateTimeOriginal', ''))
-            if date_str:
-                # Format: YYYY:MM:DD HH:MM:SS
-                return datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S').isoformat()
-    except Exception as e:
-        print(f"Error reading EXIF for {filepath}: {e}")
-    return None
-
-def create_thumbnail(image_path, thumb_path, size=(600, 600)):
-    try:
-        with Image.open(image_path) as img:
-            img.thumbnail(size)
-            img.save(thumb_path, "JPEG", optimize=True, quality=80)
-            return True
-    except Exception as e:
-        print(f"Error creating thumbnail for {image_path}: {e}")
-        return False
+# Pools are spawned, not forked: by then the writer thread runs and torch may be loaded
+MP_CONTEXT = multiprocessing.get_context("spawn")
+
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_CHECKPOINT_EVERY = 500
+# Dimension for CLIP ViT-B-32
+EMBEDDING_DIM = 512
+# Compact once this fraction of the index has been removed/replaced since the last compaction
+COMPACT_RATIO = 0.2
+
+class StageMetrics:
+    """Thread-safe per-stage counters for the indexing pipeline."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}  # name -> {'count', 'seconds', 'parallelism'}
+
+    def record(self, stage, count, seconds, parallelism=1):
+        with self._lock:
+            s = self.stages.setdefault(stage, {'count': 0, 'seconds': 0.0, 'parallelism': parallelism})
+            s['count'] += count
+            s['seconds'] += seconds
+
+    def rate(self, stage):
+        s = self.stages.get(stage)
+        if not s or not s['seconds']:
+            return 0.0
+        # Busy time is summed across workers, so scale by the worker count
+        return s['count'] / s['seconds'] * s['parallelism']
+
+    def report(self, wall_seconds):
+        print("Pipeline throughput:")
+        for name, s in self.stages.items():
+            print(f"  {name:<8} {s['count']:>7} images  {self.rate(name):>8.1f} img/s  (x{s['parallelism']})")
+        total = max((s['count'] for s in self.stages.values()), default=0)
+        if wall_seconds > 0:
+            print(f"  overall  {total:>7} images  {total / wall_seconds:>8.1f} img/s  ({wall_seconds:.1f}s wall)")
 
 class Indexer:
-    def __init__(self, root_dir=PHOTO_FOLDER):
+    def __init__(self, root_dir=PHOTO_FOLDER, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE,
+                 checkpoint_every=DEFAULT_CHECKPOINT_EVERY, load_state=True):
+        # load_state=False (queue workers): start empty instead of loading the
+        # published index, the embedding cache and the scan manifest
         self.root_dir = Path(root_dir)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.checkpoint_every = checkpoint_every
+        self._since_checkpoint = 0
+        self._removed_since_compaction = 0
+        self.embedding_cache = EmbeddingCache(load=load_state)
+        self.manifest = ScanManifest(self.root_dir) if load_state else None
         self.model = None
         self.index = None
         self.image_ids = [] # To map FAISS index back to DB IDs (1-indexed?)
+        # DB id -> file_hash its vector was computed from (ids indexed before this was tracked are absent)
+        self.indexed_hashes = {}
         
         # Load existing FAISS index if available
-        if INDEX_PATH.exists():
+        if load_state and INDEX_PATH.exists():
             print(f"Loading existing index from {INDEX_PATH}")
-            self.index = faiss.read_index(str(INDEX_PATH))
+            try:
+                self.index, manifest = load_index(INDEX_PATH)
+                self._removed_since_compaction = (manifest or {}).get('removed_since_compaction', 0)
+                self.indexed_hashes = read_index_hashes(INDEX_PATH)
+            except IndexChecksumError:
+                raise
+            except IndexManifestError as e:
+                # Vectors from another model are useless; the DB rows they belonged to
+                # are picked up again by the missing-from-index reconcile in sync()
+                print(f"{e}\nStarting a new index.")
         
         # But wait, FAISS index indices are consecutive integers 0..N.
         # We need to map FAISS ID -> DB ID.
@@ -72,33 +112,91 @@ class Indexer:
         # Let's use IndexFlatIP with IDMap.
         
         if self.index is None:
-             # Dimension for CLIP ViT-B-32 is 512
-            d = 512 
-            self.index = faiss.IndexIDMap(faiss.IndexFlatIP(d))
+            self.index = faiss.IndexIDMap(faiss.IndexFlatIP(EMBEDDING_DIM))
 
     def load_model(self):
         if self.model is None:
+            # Imported lazily: spawned decode workers re-import this module
+            # and must not pay for torch.
+            from sentence_transformers import SentenceTransformer
             print(f"Loading CLIP model: {CLIP_MODEL_NAME}...")
             self.model = SentenceTransformer(CLIP_MODEL_NAME)
             print("Model loaded.")
 
-    def scan_files(self):
-        print(f"Scanning files in {self.root_dir}...")
-        found_files = {}
-        for root, _, files in os.walk(self.root_dir):
-            for file in files:
-                if Path(file).suffix.lower() in IMAGE_EXTS:
-                    full_path = str(Path(root) / file)
-                    found_files[full_path] = os.path.getmtime(full_path)
-        return found_files
-
-    def run(self, force_reindex=False):
+    def indexed_ids(self):
+        """DB ids that currently have a vector in the index."""
+        return set(int(i) for i in faiss.vector_to_array(self.index.id_map))
+
+    def save_index(self):
+        # Write, fsync, rename, then the manifest: a crash never leaves a truncated
+        # index behind and readers can verify what they loaded
+        write_index(self.index, INDEX_PATH, removed_since_compaction=self._removed_since_compaction)
+        write_index_hashes(self.indexed_hashes, INDEX_PATH)
+        self.embedding_cache.save()
+        self._since_checkpoint = 0
+
+    def scan_files(self, verbose=True):
+        if verbose:
+            print(f"Scanning files in {self.root_dir}...")
+        return {path: st[1] for path, st in self.manifest.scan(IMAGE_EXTS).items()}
+
+    def run(self, force_reindex=False, trust_dir_mtime=False):
         init_db()
-        
-        # Get existing state
-        db_images = get_all_images_map() # path -> {id, mtime, file_hash}
-        disk_files = self.scan_files()   # path -> mtime
-        
+
+        print(f"Scanning files in {self.root_dir}...")
+        disk_stats = self.manifest.scan(IMAGE_EXTS, trust_dir_mtime=trust_dir_mtime)  # path -> (size, mtime, inode)
+
+        # The manifest only lists files whose vectors reached a saved index, so
+        # it can stand in for the DB pull. Without one (first run, or the index
+        # was reset underneath it) reconcile against the whole table.
+        full = force_reindex or not len(self.manifest) or self.index.ntotal < len(self.manifest)
+        if full:
+            db_images = get_all_images_map() # path -> {id, mtime, file_hash}
+            check = list(disk_stats)
+            removed = [p for p in self.manifest.files if p not in disk_stats]
+        else:
+            check, removed = self.manifest.diff(disk_stats)
+            if not (check or removed):
+                print(f"No changes detected ({len(disk_stats)} files match the scan manifest).")
+                self.manifest.record_dirs(disk_stats)
+                self.manifest.save()
+                return
+            db_images = get_images_by_paths(check + removed)
+
+        disk_files = {path: disk_stats[path][1] for path in check}
+        self.sync(db_images, disk_files, force_reindex)
+        self._update_manifest(disk_stats, check, removed, full=full)
+        self.manifest.record_dirs(disk_stats)
+        self.manifest.save()
+
+    def sync_paths(self, paths):
+        """Incremental sync limited to the given paths (watch mode)."""
+        paths = [p for p in paths if Path(p).suffix.lower() in IMAGE_EXTS]
+        if not paths:
+            return False
+        db_images = get_images_by_paths(paths)
+        disk_stats = {}
+        for path in paths:
+            try:
+                st = os.stat(path)
+                disk_stats[path] = (st.st_size, st.st_mtime, st.st_ino)
+            except FileNotFoundError:
+                pass  # deleted (or moved away): handled as a deletion below
+        changed = self.sync(db_images, {path: st[1] for path, st in disk_stats.items()})
+        if changed:
+            removed = [p for p in paths if p not in disk_stats]
+            self._update_manifest(disk_stats, list(disk_stats), removed)
+            self.manifest.save()
+        return changed
+
+    def plan(self, db_images, disk_files, force_reindex=False):
+        """
+        Work out what a sync has to do. Files whose mtime moved but whose bytes
+        did not are settled here (touch_images) rather than returned.
+
+        Returns:
+            (paths to add, paths to update, ids to delete)
+        """
         to_add = []
         to_update = []
         to_delete = []
@@ -116,12 +214,42 @@ class Indexer:
                 # Check mtime first (fast)
                 if abs(mtime - db_images[path]['mtime']) > 1.0 or force_reindex:
                      to_update.append(path)
+
+        # mtime moved but bytes identical (rsync / Drive copies): just record the new mtime
+        if to_update and not force_reindex:
+            to_update, touched = self._split_unchanged_content(to_update, db_images, disk_files)
+            if touched:
+                print(f"{len(touched)} files changed mtime only (same content hash), skipping re-embed.")
+                touch_images(touched)
+
+        # Reconcile: rows committed to the DB whose vectors never reached a saved
+        # index (crash/OOM mid-run) look unchanged by mtime, so redo them explicitly.
+        # For an updated file the old vector is still there under the same id;
+        # it shows up as an indexed hash that differs from the row's.
+        indexed = self.indexed_ids()
+        queued = set(to_update)
+        to_resume = [
+            path for path, meta in db_images.items()
+            if path in disk_files and path not in queued and (
+                meta['id'] not in indexed
+                or self.indexed_hashes.get(meta['id'], meta['file_hash']) != meta['file_hash'])
+        ]
+        to_update.extend(to_resume)
         
-        print(f"Found {len(to_add)} new, {len(to_update)} changed, {len(to_delete)} deleted images.")
+        print(f"Found {len(to_add)} new, {len(to_update) - len(to_resume)} changed, {len(to_delete)} deleted images.")
+        if to_resume:
+            print(f"Resuming {len(to_resume)} images whose vectors are missing from (or stale in) the saved index.")
+        return to_add, to_update, to_delete
 
+    def sync(self, db_images, disk_files, force_reindex=False):
+        """
+        Bring DB + index in line with disk_files for the paths covered by db_images/disk_files.
+        Returns True if anything was written.
+        """
+        to_add, to_update, to_delete = self.plan(db_images, disk_files, force_reindex)
         if not (to_add or to_update or to_delete):
             print("No changes detected.")
-            return
+            return False
 
         # Load Model only if needed
         if to_add or to_update:
@@ -131,87 +259,344 @@ class Indexer:
         if to_delete:
             print(f"Removing {len(to_delete)} images...")
             # Remove from DB
-            for img_id in to_delete:
-                delete_image(img_id)
+            delete_images(to_delete)
             # Remove from FAISS
             # FAISS IndexIDMap supports remove_ids
-            self.index.remove_ids(np.array(to_delete, dtype=np.int64))
+            self._removed_since_compaction += self.index.remove_ids(np.array(to_delete, dtype=np.int64))
+            for iid in to_delete:
+                self.indexed_hashes.pop(iid, None)
+            self.save_index()
 
         # Process New/Updated
-        process_list = to_add + to_update
-        total = len(process_list)
-        
-        for i, path in enumerate(process_list):
-            print(f"[{i+1}/{total}] Processing {path}")
-            
-            try:
-                # 1. Metadata
-                stat = os.stat(path)
-                file_hash = calculate_file_hash(path)
-                exif_date = get_exif_date(path)
-                img_obj = Image.open(path)
-                width, height = img_obj.size
-                
-                # 2. Thumbnail
-                rel_path = hashlib.md5(path.encode()).hexdigest() + ".jpg"
-                thumb_path = THUMBNAILS_DIR / rel_path
-                create_thumbnail(path, thumb_path)
-                
-                # 3. Embedding
-                # Image.open is lazy, need to ensure it's loaded for CLIP
-                # sentence-transformers handles loading from path string usually, or PIL image
-                embedding = self.model.encode(img_obj)
-                embedding = embedding.astype('float32')
-                # Normalize for Cosine Similarity (IndexFlatIP)
-                faiss.normalize_L2(embedding.reshape(1, -1))
-                
-                # 4. Save to DB
-                meta = {
-                    'file_path': path,
-                    'filename': os.path.basename(path),
-                    'folder': os.path.dirname(path),
-                    'mtime': stat.st_mtime,
-                    'file_hash': file_hash,
-                    'exif_date': exif_date,
-                    'width': width,
-                    'height': height,
-                    'thumbnail_path': rel_path
-                }
-                img_id = upsert_image(meta)
-                
-                # 5. Update Index
-                # If updating, remove old vector first if strictly needed, but IDMap replace might not exist?
-                # FAISS IDMap doesn't support update well without remove first?
-                # "add_with_ids" will add. If ID exists, multiple vectors per ID? 
-                # Yes, standard IndexIDMap allows multiple vectors for same ID. 
-                # So we should remove first if it's an update.
-                
-                if path in to_update:
-                     # Find ID from DB map (we have it)
-                     old_id = db_images[path]['id']
-                     self.index.remove_ids(np.array([old_id], dtype=np.int64))
-                     # We use same ID? upsert_image returns ID. 
-                     # If we used replace in sqlite, ID might change? No, we used UPDATE. ID stays.
-                     # So img_id should be same as old_id.
-                
-                self.index.add_with_ids(
-                    embedding.reshape(1, -1), 
-                    np.array([img_id], dtype=np.int64)
-                )
-
-            except Exception as e:
-                print(f"Failed to process {path}: {e}")
-                continue
+        if to_add:
+            self._seed_embedding_cache(db_images)
+        update_ids = {path: db_images[path]['id'] for path in to_update}
+        self._run_pipeline(to_add + to_update, update_ids)
+
+        if self._removed_since_compaction > COMPACT_RATIO * max(self.index.ntotal, 1):
+            self.compact(save=False)
 
         # Save Index
         print(f"Saving index to {INDEX_PATH}...")
-        faiss.write_index(self.index, str(INDEX_PATH))
+        self.save_index()
         print("Done.")
+        return True
+
+    def compact(self, save=True):
+        """
+        Rebuild the index with one vector per live image row, sorted by id.
+        Drops duplicates and vectors of rows deleted outside the indexer.
+        """
+        keep_ids = get_all_image_ids()
+        self.index, dropped = compact_index(self.index, keep_ids)
+        live = self.indexed_ids()
+        self.indexed_hashes = {iid: h for iid, h in self.indexed_hashes.items() if iid in live}
+        self._removed_since_compaction = 0
+        print(f"Compacted index: {self.index.ntotal} vectors, {dropped} dropped.")
+        if save:
+            self.save_index()
+        return dropped
+
+    def watch(self, debounce=2.0, max_delay=30.0, poll_interval=5.0, notify_url=None):
+        """
+        Long-running mode: catch up once, then index files as they appear/change.
+        File events are debounced into small batches; each batch is published
+        with an atomic index save, which running servers pick up on their own
+        (and immediately if notify_url points at /api/index/reload).
+        """
+        self.run()
+        self.load_model()  # keep it resident between batches
+
+        events = queue.Queue()
+        stop = self._start_watcher(events, poll_interval)
+        print(f"Watching {self.root_dir} for changes (Ctrl+C to stop)...")
+
+        pending = set()
+        first_event = None
+        try:
+            while True:
+                try:
+                    pending.add(events.get(timeout=debounce if pending else None))
+                    first_event = first_event or time.monotonic()
+                    # Keep collecting until things go quiet, but never hold a batch forever
+                    if time.monotonic() - first_event < max_delay:
+                        continue
+                except queue.Empty:
+                    pass
+
+                batch, pending, first_event = pending, set(), None
+                print(f"Processing {len(batch)} changed paths...")
+                if self.sync_paths(batch) and notify_url:
+                    self._notify_server(notify_url)
+        except KeyboardInterrupt:
+            print("Stopping watcher.")
+        finally:
+            stop()
+
+    def _start_watcher(self, events, poll_interval):
+        """inotify/FSEvents via watchdog when installed, otherwise a polling scanner."""
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            Observer = None
+
+        if Observer is not None:
+            # Only content changes: newer watchdog versions also report opened/closed,
+            # which the indexer's own reads would turn into an endless resync
+            class Handler(FileSystemEventHandler):
+                def _queue(self, event):
+                    if not event.is_directory:
+                        events.put(event.src_path)
+
+                on_created = on_modified = on_deleted = _queue
+
+                def on_moved(self, event):
+                    if not event.is_directory:
+                        events.put(event.src_path)
+                        events.put(event.dest_path)
+
+            observer = Observer()
+            observer.schedule(Handler(), str(self.root_dir), recursive=True)
+            observer.start()
+
+            def stop():
+                observer.stop()
+                observer.join()
+            return stop
+
+        print("watchdog not installed, falling back to polling every "
+              f"{poll_interval:.0f}s (pip install watchdog for inotify).")
+        stop_event = threading.Event()
+
+        def poll():
+            snapshot = self.scan_files(verbose=False)
+            while not stop_event.wait(poll_interval):
+                current = self.scan_files(verbose=False)
+                for path, mtime in current.items():
+                    if snapshot.get(path) != mtime:
+                        events.put(path)
+                for path in snapshot.keys() - current.keys():
+                    events.put(path)
+                snapshot = current
+
+        threading.Thread(target=poll, daemon=True).start()
+        return stop_event.set
+
+    def _notify_server(self, url):
+        import requests
+        try:
+            requests.post(url, timeout=5)
+        except Exception as e:
+            print(f"Could not notify server at {url}: {e}")
+
+    def _update_manifest(self, disk_stats, paths, removed, full=False):
+        """Add the paths that are now in the DB and the saved index to the scan manifest."""
+        rows = get_all_images_map() if full else get_images_by_paths(paths)
+        indexed = self.indexed_ids()
+        hashes = {}
+        for path in paths:
+            meta = rows.get(path)
+            if meta and meta['id'] in indexed and abs(meta['mtime'] - disk_stats[path][1]) <= 1.0:
+                hashes[path] = meta['file_hash']
+        self.manifest.commit(disk_stats, hashes, removed)
+
+    def _seed_embedding_cache(self, db_images):
+        """Backfill the hash cache from vectors already in the index (first run after upgrade)."""
+        missing = {m['id']: m['file_hash'] for m in db_images.values()
+                   if m['file_hash'] and self.embedding_cache.get(m['file_hash']) is None}
+        if not missing or not self.index.ntotal:
+            return
+        vectors = self.index.index.reconstruct_n(0, self.index.ntotal)
+        for row, iid in enumerate(faiss.vector_to_array(self.index.id_map)):
+            file_hash = missing.get(int(iid))
+            if file_hash:
+                self.embedding_cache.put(file_hash, vectors[row])
+
+    def _split_unchanged_content(self, paths, db_images, disk_files):
+        """Hash mtime-changed files in parallel; keep only those whose bytes really changed."""
+        indexed = self.indexed_ids()
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=MP_CONTEXT) as pool:
+            hashes = list(pool.map(calculate_file_hash, paths, chunksize=16))
+
+        changed, touched = [], []
+        for path, file_hash in zip(paths, hashes):
+            meta = db_images[path]
+            if file_hash == meta['file_hash'] and meta['id'] in indexed:
+                touched.append((meta['id'], disk_files[path]))
+            else:
+                changed.append(path)
+        return changed, touched
+
+    def _run_pipeline(self, process_list, update_ids):
+        """
+        Bounded producer/consumer pipeline:
+          decode  - process pool: hash, EXIF, decode, thumbnail
+          encode  - this thread: batched CLIP encode
+          write   - writer thread: DB upserts + FAISS adds per batch
+        """
+        total = len(process_list)
+        if not total:
+            return
+
+        metrics = StageMetrics()
+        write_q = queue.Queue(maxsize=4)
+        writer_error = []
+        writer = threading.Thread(target=self._write_stage, args=(write_q, update_ids, metrics, writer_error),
+                                  daemon=True)
+        writer.start()
+
+        def put(item):
+            # A dead writer never drains the queue: stop producing instead of blocking forever
+            while not writer_error:
+                try:
+                    write_q.put(item, timeout=1.0)
+                    return
+                except queue.Full:
+                    pass
+            raise writer_error[0]
+
+        wall_start = time.perf_counter()
+        done = 0
+        batch = []
+        max_in_flight = self.workers * 4
+
+        with ProcessPoolExecutor(max_workers=min(self.workers, total), mp_context=MP_CONTEXT) as pool:
+            pending = deque()
+            paths = iter(process_list)
+
+            def fill():
+                while len(pending) < max_in_flight:
+                    path = next(paths, None)
+                    if path is None:
+                        return
+                    pending.append(pool.submit(prepare_image, path))
+
+            try:
+                fill()
+                while pending:
+                    prepared = pending.popleft().result()
+                    fill()
+                    done += 1
+                    metrics.record('decode', 1, prepared['seconds'], self.workers)
+
+                    if 'error' in prepared:
+                        print(f"[{done}/{total}] Failed to process {prepared['file_path']}: {prepared['error']}")
+                        continue
+
+                    batch.append(prepared)
+                    if len(batch) >= self.batch_size:
+                        put(self._encode_batch(batch, metrics))
+                        batch = []
+                        print(f"[{done}/{total}] encoded")
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+
+        if batch:
+            put(self._encode_batch(batch, metrics))
+
+        put(None)
+        writer.join()
+        if writer_error:
+            raise writer_error[0]
+        metrics.report(time.perf_counter() - wall_start)
+
+    def _encode_batch(self, batch, metrics):
+        start = time.perf_counter()
+        images = [item.pop('clip_image') for item in batch]
+        hashes = [item['meta']['file_hash'] for item in batch]
+        embeddings = np.zeros((len(batch), self.index.d), dtype='float32')
+
+        # Byte-identical content (another path, or a previous run) reuses its vector
+        misses = []
+        for i, file_hash in enumerate(hashes):
+            cached = self.embedding_cache.get(file_hash)
+            if cached is None:
+                misses.append(i)
+            else:
+                embeddings[i] = cached
+
+        if misses:
+            encoded = self.model.encode([images[i] for i in misses], batch_size=len(misses)).astype('float32')
+            # Normalize for Cosine Similarity (IndexFlatIP)
+            faiss.normalize_L2(encoded)
+            for row, i in enumerate(misses):
+                embeddings[i] = encoded[row]
+                self.embedding_cache.put(hashes[i], encoded[row])
+
+        metrics.record('encode', len(misses), time.perf_counter() - start)
+        metrics.record('reused', len(batch) - len(misses), 0.0)
+        return [item['meta'] for item in batch], embeddings
+
+    def _write_stage(self, write_q, update_ids, metrics, errors):
+        """Writer thread body; an exception ends the run and is re-raised by _run_pipeline via errors."""
+        try:
+            self._write_batches(write_q, update_ids, metrics)
+        except BaseException as e:
+            print(f"Index writer failed: {e}")
+            errors.append(e)
+
+    def _write_batches(self, write_q, update_ids, metrics):
+        # One connection for the whole run; one multi-row upsert per batch
+        conn = get_db_connection()
+        try:
+            while True:
+                item = write_q.get()
+                if item is None:
+                    return
+                metas, embeddings = item
+                start = time.perf_counter()
+                try:
+                    ids = bulk_upsert_images(metas, conn=conn)
+                except Exception as e:
+                    print(f"Failed to save batch of {len(metas)} images: {e}")
+                    continue
+
+                # IndexIDMap allows duplicate ids, so drop the old vector of updated files first
+                stale = [update_ids[m['file_path']] for m in metas if m['file_path'] in update_ids]
+                if stale:
+                    self._removed_since_compaction += self.index.remove_ids(np.array(stale, dtype=np.int64))
+                self.index.add_with_ids(embeddings, np.array(ids, dtype=np.int64))
+                for meta, iid in zip(metas, ids):
+                    self.indexed_hashes[iid] = meta['file_hash']
+
+                # New paths for already-enriched content inherit tags/GPT enrichment
+                try:
+                    copy_enrichment_by_hash(ids, conn=conn)
+                except Exception as e:
+                    print(f"Could not copy enrichment by content hash: {e}")
+                metrics.record('write', len(ids), time.perf_counter() - start)
+
+                # Checkpoint: vectors for everything committed so far survive a crash
+                self._since_checkpoint += len(ids)
+                if self.checkpoint_every and self._since_checkpoint >= self.checkpoint_every:
+                    print(f"Checkpointing index ({self.index.ntotal} vectors)...")
+                    self.save_index()
+        finally:
+            conn.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--reindex", action="store_true", help="Force reindex changed files")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Decode worker processes")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Images per CLIP encode batch")
+    parser.add_argument("--checkpoint-every", type=int, default=DEFAULT_CHECKPOINT_EVERY,
+                        help="Save the index every N written images (0 = only at the end)")
+    parser.add_argument("--trust-dir-mtime", action="store_true",
+                        help="Skip listing directories whose mtime is unchanged (misses in-place rewrites)")
+    parser.add_argument("--compact", action="store_true",
+                        help="Rebuild the index without duplicate/orphaned vectors and exit")
+    parser.add_argument("--watch", action="store_true", help="Keep running and index new/changed photos as they appear")
+    parser.add_argument("--debounce", type=float, default=2.0, help="Seconds of quiet before a watch batch is processed")
+    parser.add_argument("--notify", type=str, help="URL to POST after each watch batch (e.g. http://localhost:8000/api/index/reload)")
     args = parser.parse_args()
     
-    idx = Indexer()
-    idx.run(force_reindex=args.reindex)
+    idx = Indexer(workers=args.workers, batch_size=args.batch_size, checkpoint_every=args.checkpoint_every)
+    if args.compact:
+        idx.compact()
+    elif args.watch:
+        idx.watch(debounce=args.debounce, notify_url=args.notify)
+    else:
+        idx.run(force_reindex=args.reindex, trust_dir_mtime=args.trust_dir_mtime)
@@ -0,0 +1,437 @@
+"""
+Postgres-backed job queue for the indexing, tagging and object stages, and
+for lead reports (backend/leads.py) and single-image refinements.
+
+Work is split into jobs of N images. Workers (backend/worker.py, any number,
+on any machine that can reach the database) lease one job at a time with
+FOR UPDATE SKIP LOCKED, heartbeat while they work and either complete it or
+release it for a retry, after a backoff if the stage asks for one. Every
+new job is announced with NOTIFY job_added (idle workers wake on it), and
+every completion or failure with NOTIFY job_status. Index workers
+store their vectors as shards in the database; a single merger folds them
+into the published FAISS index.
+
+Usage:
+    python3 -m backend.jobs enqueue index|tag|objects [--chunk-size N] [--all]
+    python3 -m backend.jobs merge            # fold finished index shards into the index
+    python3 -m backend.jobs status
+"""
+
+import json
+import argparse
+
+import numpy as np
+import psycopg2.extras
+
+from backend.config import INDEX_PATH, PROJECT_SLUG
+from backend.db import get_db_connection
+
+# Stages enqueued in chunks of images; 'lead' and 'refine' jobs are added one at a time
+BATCH_STAGES = ('index', 'tag', 'objects')
+STAGES = BATCH_STAGES + ('lead', 'refine')
+DEFAULT_CHUNK_SIZE = {'index': 256, 'tag': 128, 'objects': 16}
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+# pg_advisory_lock key so only one process merges shards at a time
+MERGE_LOCK_KEY = 0x1d5e4a
+
+
+def init_job_tables(conn=None):
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    with conn.cursor() as c:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id BIGSERIAL PRIMARY KEY,
+                stage TEXT NOT NULL,
+                payload JSONB NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT %s,
+                leased_by TEXT,
+                lease_expires_at TIMESTAMPTZ,
+                heartbeat_at TIMESTAMPTZ,
+                last_error TEXT,
+                result JSONB,
+                project_slug TEXT,
+                created_at TIMESTAMPTZ DEFAULT NOW(),
+                updated_at TIMESTAMPTZ DEFAULT NOW()
+            )
+        ''', (MAX_ATTEMPTS,))
+        # Retries with a backoff wait until available_at
+        c.execute('ALTER TABLE jobs ADD COLUMN IF NOT EXISTS available_at TIMESTAMPTZ NOT NULL DEFAULT NOW()')
+        # Step reported by a running job (set_progress), for pollers
+        c.execute('ALTER TABLE jobs ADD COLUMN IF NOT EXISTS progress JSONB')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (stage, status, id)')
+        # Vector shards written by index workers, merged into the published index
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS index_shards (
+                id BIGSERIAL PRIMARY KEY,
+                job_id BIGINT REFERENCES jobs(id) ON DELETE SET NULL,
+                ids BYTEA NOT NULL,
+                vectors BYTEA NOT NULL,
+                dim INTEGER NOT NULL,
+                removed_ids BYTEA,
+                created_at TIMESTAMPTZ DEFAULT NOW(),
+                merged_at TIMESTAMPTZ
+            )
+        ''')
+    conn.commit()
+    if own_conn:
+        conn.close()
+
+
+def enqueue(stage, items, chunk_size=None, conn=None):
+    """Split items (paths for 'index', image ids otherwise) into jobs. Returns the job count."""
+    if stage not in BATCH_STAGES:
+        raise ValueError(f"Unknown stage {stage!r}, expected one of {BATCH_STAGES}")
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE[stage]
+    key = 'paths' if stage == 'index' else 'image_ids'
+    rows = [
+        (stage, json.dumps({key: items[i:i + chunk_size]}), PROJECT_SLUG)
+        for i in range(0, len(items), chunk_size)
+    ]
+    if not rows:
+        return 0
+
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    with conn.cursor() as c:
+        psycopg2.extras.execute_values(
+            c, 'INSERT INTO jobs (stage, payload, project_slug) VALUES %s', rows)
+        c.execute('SELECT pg_notify(%s, %s)', ('job_added', stage))
+    conn.commit()
+    if own_conn:
+        conn.close()
+    return len(rows)
+
+
+def add_job(conn, stage, payload, max_attempts=MAX_ATTEMPTS, unique=False):
+    """
+    Insert one job in the caller's transaction (no commit). Returns its id.
+    With unique=True an unfinished job with the same stage and payload is
+    returned instead of queueing a duplicate.
+    """
+    with conn.cursor() as c:
+        if unique:
+            c.execute('''
+                SELECT id FROM jobs
+                WHERE stage = %s AND payload = %s::jsonb AND status IN ('pending', 'running')
+                  AND project_slug IS NOT DISTINCT FROM %s
+                ORDER BY id LIMIT 1
+            ''', (stage, json.dumps(payload), PROJECT_SLUG))
+            row = c.fetchone()
+            if row:
+                return row[0]
+        c.execute('''
+            INSERT INTO jobs (stage, payload, max_attempts, project_slug) VALUES (%s, %s, %s, %s)
+            RETURNING id
+        ''', (stage, json.dumps(payload), max_attempts, PROJECT_SLUG))
+        job_id = c.fetchone()[0]
+        c.execute('SELECT pg_notify(%s, %s)', ('job_added', stage))
+        return job_id
+
+
+def get_job(conn, job_id):
+    """Status, progress and result of one job of this project, or None."""
+    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as c:
+        c.execute('''
+            SELECT id, stage, payload, status, attempts, max_attempts, progress, result, last_error,
+                   created_at, updated_at
+            FROM jobs WHERE id = %s AND project_slug IS NOT DISTINCT FROM %s
+        ''', (job_id, PROJECT_SLUG))
+        row = c.fetchone()
+    conn.commit()
+    return dict(row) if row else None
+
+
+def _notify(c, job_id, stage, status):
+    c.execute('SELECT pg_notify(%s, %s)',
+              ('job_status', json.dumps({'id': job_id, 'stage': stage, 'status': status})))
+
+
+def claim(conn, worker_id, stages=STAGES, lease_seconds=LEASE_SECONDS):
+    """
+    Lease the oldest runnable job of this project: pending, or running with an
+    expired lease (its worker died). SKIP LOCKED lets any number of workers poll at once
+    without blocking on each other. Returns a dict or None.
+    """
+    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as c:
+        c.execute('''
+            UPDATE jobs SET
+                status = 'running',
+                attempts = attempts + 1,
+                leased_by = %s,
+                lease_expires_at = NOW() + make_interval(secs => %s),
+                heartbeat_at = NOW(),
+                updated_at = NOW()
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE stage = ANY(%s)
+                  AND project_slug IS NOT DISTINCT FROM %s
+                  AND (status = 'pending' OR (status = 'running' AND lease_expires_at < NOW()))
+                  AND available_at <= NOW()
+                  AND attempts < max_attempts
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING id, stage, payload, attempts, max_attempts
+        ''', (worker_id, lease_seconds, list(stages), PROJECT_SLUG))
+        row = c.fetchone()
+    conn.commit()
+    return dict(row) if row else None
+
+
+def heartbeat(conn, job_id, worker_id, lease_seconds=LEASE_SECONDS):
+    """Extend the lease. False means another worker took the job over."""
+    with conn.cursor() as c:
+        c.execute('''
+            UPDATE jobs SET heartbeat_at = NOW(), lease_expires_at = NOW() + make_interval(secs => %s)
+            WHERE id = %s AND leased_by = %s AND status = 'running'
+        ''', (lease_seconds, job_id, worker_id))
+        owned = c.rowcount == 1
+    conn.commit()
+    return owned
+
+
+def set_progress(conn, job_id, worker_id, progress):
+    """Record the step a running job is on (any JSON value)."""
+    with conn.cursor() as c:
+        c.execute('''
+            UPDATE jobs SET progress = %s, updated_at = NOW()
+            WHERE id = %s AND leased_by = %s AND status = 'running'
+        ''', (json.dumps(progress), job_id, worker_id))
+    conn.commit()
+
+
+def complete(conn, job_id, worker_id, result=None, shard=None):
+    """
+    Mark a job done (and store its vector shard) in one transaction, provided
+    this worker still holds the lease. Returns False if the lease was lost.
+    """
+    with conn.cursor() as c:
+        c.execute('''
+            UPDATE jobs SET status = 'done', result = %s, lease_expires_at = NULL, updated_at = NOW()
+            WHERE id = %s AND leased_by = %s AND status = 'running'
+            RETURNING stage
+        ''', (json.dumps(result or {}), job_id, worker_id))
+        if c.rowcount != 1:
+            conn.rollback()
+            return False
+        _notify(c, job_id, c.fetchone()[0], 'done')
+        if shard is not None:
+            ids, vectors = shard
+            c.execute('''
+                INSERT INTO index_shards (job_id, ids, vectors, dim) VALUES (%s, %s, %s, %s)
+            ''', (job_id, psycopg2.Binary(np.asarray(ids, dtype=np.int64).tobytes()),
+                  psycopg2.Binary(np.ascontiguousarray(vectors, dtype=np.float32).tobytes()),
+                  int(vectors.shape[1])))
+    conn.commit()
+    return True
+
+
+def fail(conn, job_id, worker_id, error, retry_delay=0):
+    """
+    Release a job for retry, or mark it failed once it is out of attempts.
+    The retry waits retry_delay * 2^(attempts - 1) seconds.
+    """
+    with conn.cursor() as c:
+        c.execute('''
+            UPDATE jobs SET
+                status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END,
+                available_at = NOW() + make_interval(secs => %s * power(2, attempts - 1)),
+                last_error = %s, leased_by = NULL, lease_expires_at = NULL, updated_at = NOW()
+            WHERE id = %s AND leased_by = %s
+            RETURNING stage, status
+        ''', (retry_delay, str(error)[:2000], job_id, worker_id))
+        row = c.fetchone()
+        if row:
+            _notify(c, job_id, *row)
+    conn.commit()
+
+
+def reap_expired(conn):
+    """Jobs whose last lease expired with no attempts left are failed, not retried."""
+    with conn.cursor() as c:
+        c.execute('''
+            UPDATE jobs SET status = 'failed', last_error = COALESCE(last_error, 'lease expired'), updated_at = NOW()
+            WHERE status = 'running' AND lease_expires_at < NOW() AND attempts >= max_attempts
+            RETURNING id, stage
+        ''')
+        reaped = c.fetchall()
+        for job_id, stage in reaped:
+            _notify(c, job_id, stage, 'failed')
+    conn.commit()
+    return len(reaped)
+
+
+def queue_status(conn=None):
+    """Job counts per stage and status, plus unmerged shards."""
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    with conn.cursor() as c:
+        c.execute('SELECT stage, status, COUNT(*) FROM jobs GROUP BY stage, status ORDER BY stage, status')
+        counts = {}
+        for stage, status, n in c.fetchall():
+            counts.setdefault(stage, {})[status] = n
+        c.execute('SELECT COUNT(*) FROM index_shards WHERE merged_at IS NULL')
+        unmerged = c.fetchone()[0]
+    if own_conn:
+        conn.close()
+    return {'jobs': counts, 'unmerged_shards': unmerged}
+
+
+def record_removals(conn, removed_ids, dim):
+    """Queue deletions for the merger as a shard with no vectors."""
+    with conn.cursor() as c:
+        c.execute('''
+            INSERT INTO index_shards (ids, vectors, dim, removed_ids) VALUES (%s, %s, %s, %s)
+        ''', (psycopg2.Binary(b''), psycopg2.Binary(b''), dim,
+              psycopg2.Binary(np.asarray(removed_ids, dtype=np.int64).tobytes())))
+    conn.commit()
+
+
+def merge_shards(path=INDEX_PATH):
+    """
+    Apply unmerged shards, oldest first, to the published index and publish
+    it once. Only one merger runs at a time (advisory lock). Returns the
+    number of shards merged.
+    """
+    import faiss
+    from backend.index_store import load_index, write_index, read_index_hashes, write_index_hashes
+
+    conn = get_db_connection()
+    conn.autocommit = True  # the advisory lock is per session, not per transaction
+    with conn.cursor() as c:
+        c.execute('SELECT pg_try_advisory_lock(%s)', (MERGE_LOCK_KEY,))
+        if not c.fetchone()[0]:
+            conn.close()
+            print("Another process is merging shards.")
+            return 0
+    try:
+        with conn.cursor() as c:
+            c.execute('''
+                SELECT id, ids, vectors, dim, removed_ids FROM index_shards
+                WHERE merged_at IS NULL ORDER BY id
+            ''')
+            shards = c.fetchall()
+        if not shards:
+            return 0
+
+        index, manifest = load_index(path)
+        if index is None:
+            index = faiss.IndexIDMap(faiss.IndexFlatIP(shards[0][3]))
+        removed = (manifest or {}).get('removed_since_compaction', 0)
+
+        for _, ids_bytes, vec_bytes, dim, removed_bytes in shards:
+            ids = np.frombuffer(bytes(ids_bytes), dtype=np.int64)
+            vectors = np.frombuffer(bytes(vec_bytes), dtype=np.float32).reshape(-1, dim)
+            drop = ids
+            if removed_bytes:
+                drop = np.concatenate([drop, np.frombuffer(bytes(removed_bytes), dtype=np.int64)])
+            if len(drop):
+                # Updated images replace their old vector
+                removed += index.remove_ids(drop)
+            if len(ids):
+                index.add_with_ids(vectors, ids)
+
+        write_index(index, path, removed_since_compaction=removed)
+        # Shard vectors are durable once their job completes, so the local
+        # indexer's crash check (indexed hash vs. DB hash) doesn't apply to them
+        hashes = read_index_hashes(path)
+        if hashes:
+            for _, ids_bytes, _, _, removed_bytes in shards:
+                for iid in np.frombuffer(bytes(ids_bytes) + bytes(removed_bytes or b''), dtype=np.int64).tolist():
+                    hashes.pop(iid, None)
+            write_index_hashes(hashes, path)
+        with conn.cursor() as c:
+            c.execute('UPDATE index_shards SET merged_at = NOW() WHERE id = ANY(%s)', ([s[0] for s in shards],))
+        print(f"Merged {len(shards)} shards; index now holds {index.ntotal} vectors.")
+        return len(shards)
+    finally:
+        with conn.cursor() as c:
+            c.execute('SELECT pg_advisory_unlock(%s)', (MERGE_LOCK_KEY,))
+        conn.close()
+
+
+def plan_index_jobs(force_reindex=False):
+    """
+    Diff disk vs. DB + published index like a local indexer run. Deletions are
+    applied right away (DB rows, plus a removal shard for the index); the
+    paths to (re)embed are returned for enqueueing.
+    """
+    from backend.db import init_db, get_all_images_map, delete_images
+    from backend.indexer import Indexer
+
+    init_db()
+    indexer = Indexer()
+    db_images = get_all_images_map()
+    to_add, to_update, to_delete = indexer.plan(db_images, indexer.scan_files(), force_reindex)
+    if to_delete:
+        delete_images(to_delete)
+        conn = get_db_connection()
+        record_removals(conn, to_delete, indexer.index.d)
+        conn.close()
+    return to_add + to_update
+
+
+def _unfinished_index_work(conn):
+    with conn.cursor() as c:
+        c.execute("SELECT COUNT(*) FROM jobs WHERE stage = 'index' AND status IN ('pending', 'running')")
+        jobs = c.fetchone()[0]
+        c.execute("SELECT COUNT(*) FROM index_shards WHERE merged_at IS NULL")
+        return jobs + c.fetchone()[0]
+
+
+def _ids_needing(stage, all_images=False):
+    sql = {
+        'tag': "SELECT id FROM images WHERE (tags IS NULL OR tags = '[]'::jsonb)",
+        'objects': "SELECT id FROM images i WHERE NOT EXISTS (SELECT 1 FROM image_objects io WHERE io.image_id = i.id)",
+    }[stage]
+    if all_images:
+        sql = "SELECT id FROM images WHERE TRUE"
+    params = []
+    if PROJECT_SLUG:
+        sql += " AND project_slug = %s"
+        params.append(PROJECT_SLUG)
+    conn = get_db_connection()
+    with conn.cursor() as c:
+        c.execute(sql + " ORDER BY id", tuple(params))
+        ids = [r[0] for r in c.fetchall()]
+    conn.close()
+    return ids
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distributed job queue")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_enqueue = sub.add_parser("enqueue", help="Create jobs for a stage")
+    p_enqueue.add_argument("stage", choices=BATCH_STAGES)
+    p_enqueue.add_argument("--chunk-size", type=int, help="Images per job")
+    p_enqueue.add_argument("--all", action="store_true", help="tag/objects: every image, not just unprocessed ones")
+    p_enqueue.add_argument("--reindex", action="store_true", help="index: re-embed every file")
+    p_enqueue.add_argument("--force", action="store_true", help="index: enqueue even if earlier index work is unfinished")
+    sub.add_parser("merge", help="Merge finished index shards into the published index")
+    sub.add_parser("status", help="Show queue status")
+    args = parser.parse_args()
+
+    init_job_tables()
+    if args.command == "enqueue":
+        if args.stage == 'index':
+            conn = get_db_connection()
+            unfinished = _unfinished_index_work(conn)
+            conn.close()
+            if unfinished and not args.force:
+                # Rows written by running jobs are not in the index yet and would be queued twice
+                raise SystemExit(f"{unfinished} index jobs/shards are still outstanding; "
+                                 f"run workers and 'merge' first (or pass --force).")
+            items = plan_index_jobs(force_reindex=args.reindex)
+        else:
+            items = _ids_needing(args.stage, all_images=args.all)
+        n = enqueue(args.stage, items, args.chunk_size)
+        print(f"Enqueued {len(items)} images as {n} '{args.stage}' jobs.")
+    elif args.command == "merge":
+        merge_shards()
+    else:
+        print(json.dumps(queue_status(), indent=2))
@@ -0,0 +1,221 @@
+"""
+Lead submissions.
+/api/leads/submit saves the lead and queues its 'lead' job (backend/jobs.py)
+in one transaction and returns. A worker builds the PDF report and sends the
+emails, retrying failures with a backoff: LEAD_WORKER_THREADS threads inside
+the API process, plus any `python3 -m backend.worker --stages lead`
+processes. Progress is read from the lead row and its job by lead_status().
+"""
+
+import json
+import time
+import threading
+
+import psycopg2.extras
+
+from backend.config import LEAD_MAX_ATTEMPTS, LEAD_WORKER_THREADS, PROJECT_SLUG
+from backend.db import get_db_connection
+from backend import jobs
+
+# Set on submit so the API's own lead workers pick the job up without polling
+_wake = threading.Event()
+_workers = []
+
+
+def init_lead_tables(conn=None):
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    with conn.cursor() as c:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS leads (
+                id SERIAL PRIMARY KEY,
+                name TEXT NOT NULL,
+                email TEXT NOT NULL,
+                phone TEXT,
+                timeline TEXT,
+                budget TEXT,
+                address TEXT,
+                vision_json JSONB,
+                project_slug TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Report delivery; NULL report_job_id marks leads handled before the queue existed
+        c.execute('ALTER TABLE leads ADD COLUMN IF NOT EXISTS report_job_id BIGINT')
+        c.execute('ALTER TABLE leads ADD COLUMN IF NOT EXISTS report_path TEXT')
+        c.execute('ALTER TABLE leads ADD COLUMN IF NOT EXISTS report_error TEXT')
+        c.execute('ALTER TABLE leads ADD COLUMN IF NOT EXISTS emailed_at TIMESTAMPTZ')
+    conn.commit()
+    if own_conn:
+        conn.close()
+
+
+def create_lead(lead, vision_json):
+    """
+    Insert the lead and its report job atomically.
+
+    Args:
+        lead: dict with name, email, phone, timeline, budget, address
+        vision_json: board ids, notes, manual style and vision report
+
+    Returns:
+        lead id
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO leads (name, email, phone, timeline, budget, address, vision_json, project_slug)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            """, (lead['name'], lead['email'], lead.get('phone'), lead.get('timeline'), lead.get('budget'),
+                  lead.get('address'), json.dumps(vision_json), PROJECT_SLUG))
+            lead_id = cur.fetchone()[0]
+            job_id = jobs.add_job(conn, 'lead', {'lead_id': lead_id}, max_attempts=LEAD_MAX_ATTEMPTS)
+            cur.execute("UPDATE leads SET report_job_id = %s WHERE id = %s", (job_id, lead_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    _wake.set()
+    return lead_id
+
+
+def lead_status(lead_id):
+    """
+    Delivery status of a lead: queued, processing, retrying, sent or failed.
+    Returns None if the lead doesn't exist (in this project).
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            sql = """
+                SELECT l.id, l.report_job_id, l.report_path, l.report_error, l.emailed_at,
+                       j.status AS job_status, j.attempts, j.max_attempts, j.last_error, j.available_at
+                FROM leads l LEFT JOIN jobs j ON j.id = l.report_job_id
+                WHERE l.id = %s
+            """
+            params = [lead_id]
+            if PROJECT_SLUG:
+                sql += " AND l.project_slug = %s"
+                params.append(PROJECT_SLUG)
+            cur.execute(sql, tuple(params))
+            row = cur.fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+
+    if row['report_job_id'] is None:
+        status = 'sent'  # submitted synchronously, before the queue existed
+    elif row['job_status'] == 'done':
+        status = 'sent'
+    elif row['job_status'] == 'failed':
+        status = 'failed'
+    elif row['job_status'] == 'running':
+        status = 'processing'
+    else:
+        status = 'retrying' if row['attempts'] else 'queued'
+
+    return {
+        "lead_id": row['id'],
+        "status": status,
+        "attempts": row['attempts'] or 0,
+        "max_attempts": row['max_attempts'],
+        "report_path": row['report_path'],
+        "report_error": row['report_error'],
+        "emailed_at": row['emailed_at'].isoformat() if row['emailed_at'] else None,
+        "next_attempt_at": row['available_at'].isoformat() if status == 'retrying' else None,
+        "last_error": row['last_error'] if status in ('retrying', 'failed') else None,
+    }
+
+
+def _board_images(conn, image_ids, notes):
+    """Board images in board order, each with its user note."""
+    if not image_ids:
+        return []
+    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+        cur.execute("SELECT * FROM images WHERE id = ANY(%s)", (list(image_ids),))
+        row_map = {r['id']: dict(r) for r in cur.fetchall()}
+    images = []
+    for iid in image_ids:
+        if iid in row_map:
+            img = row_map[iid]
+            if notes and str(iid) in notes:
+                img['user_note'] = notes[str(iid)]
+            images.append(img)
+    return images
+
+
+def process_lead(lead_id):
+    """
+    Build the lead's PDF and send the notification emails. Each step is
+    recorded on the lead row, so a retry skips whatever already succeeded.
+    """
+    from backend.pdf_generator import PDFGenerator
+    from backend.email_service import EmailService
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            cur.execute("SELECT * FROM leads WHERE id = %s", (lead_id,))
+            lead = cur.fetchone()
+        if lead is None:
+            raise ValueError(f"Lead {lead_id} not found")
+
+        vision = lead['vision_json'] or {}
+        lead_data = {
+            'name': lead['name'], 'email': lead['email'], 'phone': lead['phone'],
+            'timeline': lead['timeline'], 'budget': lead['budget'], 'address': lead['address'],
+            'image_ids': vision.get('ids') or [],
+            'image_notes': vision.get('notes') or {},
+            'detected_style': vision.get('manual_style'),
+            'vision_report': vision.get('report') or {},
+        }
+
+        report_path = lead['report_path']
+        if report_path is None and lead['report_error'] is None:
+            selected_images = _board_images(conn, lead_data['image_ids'], lead_data['image_notes'])
+            try:
+                report_path = PDFGenerator().generate_report(lead_data, selected_images)
+                report_error = None
+            except Exception as e:
+                # A bad image won't get better on retry: the lead still goes out, without the PDF
+                print(f"PDF Gen Error (lead {lead_id}): {e}")
+                report_error = str(e)[:2000]
+            with conn.cursor() as cur:
+                cur.execute("UPDATE leads SET report_path = %s, report_error = %s WHERE id = %s",
+                            (report_path, report_error, lead_id))
+            conn.commit()
+
+        if lead['emailed_at'] is None:
+            if not EmailService().send_lead_notification(lead_data, report_path or "Error generating PDF"):
+                raise RuntimeError("email delivery failed")
+            with conn.cursor() as cur:
+                cur.execute("UPDATE leads SET emailed_at = NOW() WHERE id = %s", (lead_id,))
+            conn.commit()
+    finally:
+        conn.close()
+    return {'lead_id': lead_id, 'report_path': report_path}
+
+
+def _serve():
+    from backend.worker import work, IDLE_SLEEP
+
+    while True:
+        try:
+            work(['lead'], wake=_wake)
+        except Exception as e:
+            # e.g. the database went away; keep the thread alive and try again
+            print(f"Lead worker error: {e}")
+            time.sleep(IDLE_SLEEP)
+
+
+def start_lead_workers(threads=LEAD_WORKER_THREADS):
+    """Serve 'lead' jobs from daemon threads in this process (the API server)."""
+    while len(_workers) < threads:
+        t = threading.Thread(target=_serve, name=f"lead-worker-{len(_workers)}", daemon=True)
+        t.start()
+        _workers.append(t)
@@ -0,0 +1,102 @@
+"""
+Raw SAM output cache for object extraction (process_objects_m3.py).
+Segmentation is the expensive step and only depends on the image content and
+the SAM settings, so each image's masks are stored once, run-length encoded,
+as <SAM_CACHE_DIR>/ab/<content hash>_<settings key>.npz. Changing the label
+vocabulary, the confidence threshold or the crop filter then only redoes the
+crop/CLIP work.
+"""
+
+import os
+import json
+import hashlib
+import threading
+
+import numpy as np
+
+from backend.config import SAM_CACHE_DIR
+
+
+def settings_key(settings):
+    """Short stable key for a dict of SAM settings (model, checkpoint, generator params, input size)."""
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def rle_encode(mask):
+    """Run lengths of a boolean mask in row-major order, starting with a (possibly empty) run of False."""
+    flat = np.asarray(mask, dtype=bool).ravel()
+    if not flat.size:
+        return np.zeros(1, dtype=np.uint32)
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate([[0], changes, [flat.size]]))
+    if flat[0]:
+        counts = np.concatenate([[0], counts])
+    return counts.astype(np.uint32)
+
+
+def rle_decode(counts, shape):
+    values = np.zeros(len(counts), dtype=bool)
+    values[1::2] = True
+    return np.repeat(values, counts).reshape(shape)
+
+
+class MaskCache:
+    def __init__(self, settings, cache_dir=SAM_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.key = settings_key(settings)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def path(self, file_hash):
+        return self.cache_dir / file_hash[:2] / f"{file_hash}_{self.key}.npz"
+
+    def get(self, file_hash):
+        """SAM-style mask dicts (segmentation, bbox, area, predicted_iou, stability_score), or None."""
+        try:
+            with np.load(self.path(file_hash), allow_pickle=False) as data:
+                shape = tuple(data['shape'])
+                counts, offsets = data['counts'], data['offsets']
+                masks = [
+                    {
+                        'segmentation': rle_decode(counts[offsets[i]:offsets[i + 1]], shape),
+                        'bbox': data['bbox'][i].tolist(),
+                        'area': int(data['area'][i]),
+                        'predicted_iou': float(data['predicted_iou'][i]),
+                        'stability_score': float(data['stability_score'][i]),
+                    }
+                    for i in range(len(offsets) - 1)
+                ]
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except Exception as e:
+            print(f"Ignoring unreadable SAM cache entry {file_hash}: {e}")
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return masks
+
+    def put(self, file_hash, masks, shape):
+        """Store SAM output for an image whose SAM input had the given (height, width)."""
+        encoded = [rle_encode(m['segmentation']) for m in masks]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(c) for c in encoded])
+        path = self.path(file_hash)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                shape=np.array(shape[:2], dtype=np.int64),
+                counts=np.concatenate(encoded) if encoded else np.zeros(0, dtype=np.uint32),
+                offsets=offsets,
+                bbox=np.array([m['bbox'] for m in masks], dtype=np.float32).reshape(-1, 4),
+                area=np.array([m['area'] for m in masks], dtype=np.int64),
+                predicted_iou=np.array([m['predicted_iou'] for m in masks], dtype=np.float32),
+                stability_score=np.array([m['stability_score'] for m in masks], dtype=np.float32),
+            )
+        os.replace(tmp_path, path)
@@ -4,18 +4,96 @@ from reportlab.pdfgen import canvas
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import io
 import os
+import time
+import argparse
 from datetime import datetime
-from backend.config import BASE_DIR, THUMBNAILS_DIR, DEFAULT_PHOTO_FOLDER
+from PIL import Image as PILImage
+from backend.config import BASE_DIR, THUMBNAILS_DIR, DEFAULT_PHOTO_FOLDER, PDF_IMAGE_DPI, PDF_FETCH_WORKERS, PROJECT_SLUG
+from backend.thumbnails import RENDITIONS_DIR, SAVE_OPTIONS, TOUCH_INTERVAL, open_source, save_atomic
 
 OUTPUT_DIR = BASE_DIR / "generated_reports"
 OUTPUT_DIR.mkdir(exist_ok=True)
 
 LOGO_PATH = BASE_DIR / "backend/static/logo.jpg"
 
+# Inspiration board cell in points (1/72 in); photos are fitted inside it
+CELL_WIDTH, CELL_HEIGHT = 220, 140
+
+
+def pdf_rendition_path(file_hash, dpi=PDF_IMAGE_DPI):
+    # Next to the thumbnail renditions, so thumbnail GC and the cache budget cover it
+    return RENDITIONS_DIR / file_hash[:2] / f"{file_hash}_pdf{CELL_WIDTH}x{CELL_HEIGHT}@{dpi}.jpg"
+
+
+def _fit(size, box):
+    """(w, h) scaled to fit inside box, aspect preserved."""
+    scale = min(box[0] / size[0], box[1] / size[1])
+    return size[0] * scale, size[1] * scale
+
+
+def prepare_image(img_meta, dpi=PDF_IMAGE_DPI):
+    """
+    One board photo at its printed size and dpi (never upscaled), cached by
+    content hash. Local and remote originals both work.
+
+    Returns:
+        (file path or JPEG buffer, width pt, height pt), or None without a source
+    """
+    file_hash = img_meta.get('file_hash')
+    path = pdf_rendition_path(file_hash, dpi) if file_hash else None
+    if path is not None:
+        try:
+            st = path.stat()
+            if time.time() - st.st_mtime > TOUCH_INTERVAL:
+                os.utime(path)
+            with PILImage.open(path) as cached:
+                return (str(path), *_fit(cached.size, (CELL_WIDTH, CELL_HEIGHT)))
+        except FileNotFoundError:
+            pass
+
+    box = (round(CELL_WIDTH * dpi / 72), round(CELL_HEIGHT * dpi / 72))
+    img = open_source(img_meta.get('file_path'), img_meta.get('thumbnail_path'), box[0])
+    if img is None:
+        return None
+    w, h = _fit(img.size, box)
+    if w < img.size[0]:
+        img = img.resize((max(1, round(w)), max(1, round(h))), PILImage.LANCZOS)
+
+    if path is not None:
+        save_atomic(img, path, 'jpg')
+        source = str(path)
+    else:
+        source = io.BytesIO()
+        img.save(source, **SAVE_OPTIONS['jpg'])
+        source.seek(0)
+    return (source, *_fit(img.size, (CELL_WIDTH, CELL_HEIGHT)))
+
+
+def _prepare_or_skip(img_meta, dpi):
+    try:
+        return prepare_image(img_meta, dpi)
+    except Exception as e:
+        print(f"PDF image error ({img_meta.get('file_path')}): {e}")
+        return None
+
+
 class PDFGenerator:
-    def __init__(self):
+    def __init__(self, downsample=True, dpi=PDF_IMAGE_DPI):
+        """downsample=False embeds the original files as-is (local only); kept for benchmarking."""
         self.width, self.height = letter
+        self.downsample = downsample
+        self.dpi = dpi
+
+    def prepare_images(self, selected_images):
+        """Board photos in order, fetched/rendered concurrently. None marks images without a source."""
+        if not self.downsample:
+            return [(p, CELL_WIDTH, CELL_HEIGHT) if p and os.path.exists(p) else None
+                    for p in (m.get('file_path') for m in selected_images)]
+        with ThreadPoolExecutor(max_workers=PDF_FETCH_WORKERS) as pool:
+            return list(pool.map(lambda m: _prepare_or_skip(m, self.dpi), selected_images))
 
     def generate_report(self, lead_data, selected_images):
         """
@@ -107,25 +185,10 @@ class PDFGenerator:
         img_data = []
         row = []
         
-        for img_meta in selected_images:
-            # Try to use thumbnail logic or full path
-            # We need absolute path on disk
-            # In DB we store file_path (full path)
-            # But let's verify it exists
-            
-            p = img_meta.get('file_path')
-            # If we don't have file_path, maybe we have ID and can look it up?
-            # Assuming passed list has 'file_path'
-            
-            if p and os.path.exists(p):
-                # Resize for PDF - maintain aspect a bit?
-                # reportlab Image can take width/height
-                # 3 inches ~ 216 pts
-                im = Image(p, width=220, height=140) 
-                # Keep ratio? Image(path, width, height) squezzes. 
-                # Better to use preserveAspectRatio=True? Reportlab 4 might do it differently
-                # For simplicity, fixed box
-                row.append(im)
+        for prepared in self.prepare_images(selected_images):
+            if prepared:
+                source, w, h = prepared
+                row.append(Image(source, width=w, height=h))
             
             if len(row) == 2:
                 img_data.append(row)
@@ -159,3 +222,50 @@ class PDFGenerator:
 
         doc.build(story)
         return str(output_path)
+
+
+def benchmark(limit=12, dpi=PDF_IMAGE_DPI):
+    """Generation time and file size: originals vs. downsampled (cold and warm cache)."""
+    import psycopg2.extras
+    from backend.db import get_db_connection
+
+    conn = get_db_connection()
+    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+        sql = "SELECT * FROM images"
+        params = []
+        if PROJECT_SLUG:
+            sql += " WHERE project_slug = %s"
+            params.append(PROJECT_SLUG)
+        cur.execute(sql + " ORDER BY id LIMIT %s", tuple(params + [limit]))
+        images = [dict(r) for r in cur.fetchall()]
+    conn.close()
+
+    lead = {'name': 'Benchmark Lead', 'email': 'benchmark@example.com', 'timeline': 'N/A', 'budget': 'N/A',
+            'vision_report': {'Style': 'Modern Minimalist', 'Material': 'Natural Stone', 'Atmosphere': 'Bright & Airy'}}
+    for img in images:
+        if img.get('file_hash'):
+            pdf_rendition_path(img['file_hash'], dpi).unlink(missing_ok=True)
+
+    print(f"{len(images)} board images, {dpi} dpi")
+    for label, generator in (("originals", PDFGenerator(downsample=False)),
+                             ("downsampled, cold cache", PDFGenerator(dpi=dpi)),
+                             ("downsampled, warm cache", PDFGenerator(dpi=dpi))):
+        start = time.perf_counter()
+        path = generator.generate_report(lead, images)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(path)
+        os.remove(path)
+        print(f"  {label:<24} {elapsed * 1000:8.0f} ms  {size / 1e6:7.2f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lead PDF reports")
+    parser.add_argument("--benchmark", action="store_true", help="Time a report with and without downsampling")
+    parser.add_argument("--images", type=int, default=12, help="Board size for --benchmark")
+    parser.add_argument("--dpi", type=int, default=PDF_IMAGE_DPI, help="Print resolution of board photos")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.images, args.dpi)
+    else:
+        parser.print_help()
@@ -0,0 +1,137 @@
+"""
+Local scan manifest for the indexer.
+Remembers (size, mtime, inode, hash) for every indexed file and the mtime of
+every directory, so a no-change run is an os.scandir walk (or, with
+trust_dir_mtime, one stat per directory) instead of a stat per file plus a
+full pull of the images table.
+"""
+
+import os
+import json
+from pathlib import Path
+
+from backend.config import SCAN_MANIFEST_PATH, PROJECT_SLUG
+
+MANIFEST_VERSION = 1
+
+
+class ScanManifest:
+    def __init__(self, root, path=SCAN_MANIFEST_PATH, project_slug=PROJECT_SLUG):
+        self.root = str(root)
+        self.project_slug = project_slug
+        self.path = Path(path)
+        self.files = {}  # path -> [size, mtime, inode, file_hash]
+        self.dirs = {}   # dir  -> [mtime, [subdirs]]
+        self._scanned_dirs = {}
+        self.load()
+
+    def __len__(self):
+        return len(self.files)
+
+    def load(self):
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"Could not read scan manifest {self.path}: {e}")
+            return
+        if (data.get('version') != MANIFEST_VERSION or data.get('root') != self.root
+                or data.get('project_slug') != self.project_slug):
+            print("Scan manifest is for a different root/project, ignoring it.")
+            return
+        self.files = data.get('files', {})
+        self.dirs = data.get('dirs', {})
+
+    def save(self):
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'version': MANIFEST_VERSION,
+                'root': self.root,
+                'project_slug': self.project_slug,
+                'files': self.files,
+                'dirs': self.dirs,
+            }, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    def scan(self, exts, trust_dir_mtime=False):
+        """
+        Walk the root with os.scandir.
+
+        Args:
+            exts: Lower-case file extensions to include
+            trust_dir_mtime: Reuse the manifest for directories whose mtime has not
+                changed (skips listing them). Faster on NAS mounts, but misses files
+                rewritten in place without a rename.
+
+        Returns:
+            dict of path -> (size, mtime, inode)
+        """
+        found = {}
+        self._scanned_dirs = {}
+        by_dir = {}
+        if trust_dir_mtime:
+            for path, entry in self.files.items():
+                by_dir.setdefault(os.path.dirname(path), []).append((path, entry))
+        stack = [self.root]
+        while stack:
+            directory = stack.pop()
+            try:
+                dir_mtime = os.stat(directory).st_mtime
+            except FileNotFoundError:
+                continue
+
+            known = self.dirs.get(directory)
+            if trust_dir_mtime and known and known[0] == dir_mtime:
+                for path, entry in by_dir.get(directory, ()):
+                    found[path] = (entry[0], entry[1], entry[2])
+                stack.extend(known[1])
+                self._scanned_dirs[directory] = [dir_mtime, known[1]]
+                continue
+
+            subdirs = []
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif os.path.splitext(entry.name)[1].lower() in exts:
+                            st = entry.stat()
+                            found[entry.path] = (st.st_size, st.st_mtime, st.st_ino)
+            except (FileNotFoundError, PermissionError) as e:
+                print(f"Skipping {directory}: {e}")
+                continue
+            stack.extend(subdirs)
+            self._scanned_dirs[directory] = [dir_mtime, subdirs]
+        return found
+
+    def diff(self, stats):
+        """Paths that are new/changed vs. the manifest, and paths that disappeared."""
+        changed = []
+        for path, (size, mtime, inode) in stats.items():
+            entry = self.files.get(path)
+            if entry is None or entry[0] != size or entry[1] != mtime or entry[2] != inode:
+                changed.append(path)
+        removed = [path for path in self.files if path not in stats]
+        return changed, removed
+
+    def commit(self, stats, hashes, removed=()):
+        """Record files that are now fully indexed (hashes: path -> file_hash) and forget removed ones."""
+        for path in removed:
+            self.files.pop(path, None)
+        for path, file_hash in hashes.items():
+            size, mtime, inode = stats[path]
+            self.files[path] = [size, mtime, inode, file_hash]
+
+    def record_dirs(self, stats):
+        """
+        Remember directory mtimes from the last full scan. A directory is only
+        recorded once every file in it is up to date, so a file that failed to
+        index keeps its directory from being skipped next time.
+        """
+        pending = {os.path.dirname(path) for path, st in stats.items()
+                   if self.files.get(path, [None] * 3)[:3] != list(st)}
+        self.dirs = {directory: state for directory, state in self._scanned_dirs.items()
+                     if directory not in pending}
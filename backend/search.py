@@ -3,6 +3,7 @@ import numpy as np
 from sentence_transformers import SentenceTransformer
 from .config import INDEX_PATH, CLIP_MODEL_NAME, DEFAULT_TOP_K, PROJECT_SLUG
 from .db import get_db_connection
+from .index_store import read_index
 import psycopg2.extras
 from PIL import Image
 import os
@@ -16,7 +17,7 @@ class SearchEngine:
     def load_resources(self):
         if INDEX_PATH.exists():
             print(f"Loading index from {INDEX_PATH}")
-            self.index = faiss.read_index(str(INDEX_PATH))
+            self.index = read_index(INDEX_PATH)
         else:
             print("WARNING: No index found. Search will return empty.")
         
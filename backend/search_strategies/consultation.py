@@ -7,10 +7,15 @@ import numpy as np
 from sentence_transformers import SentenceTransformer
 from ..config import INDEX_PATH, CLIP_MODEL_NAME, DEFAULT_TOP_K
 from ..db import get_db_connection
+from ..index_store import shared_index_handle
 import psycopg2.extras
 from ..consultation_engine import ConsultationEngine
 
 class ConsultationSearch(SearchInterface):
+    # Below this top score the query falls back to knowledge cards
+    LOW_CONFIDENCE_CUTOFF = 0.23
+    SEARCH_K = 1000
+
     def __init__(self):
         self.model = None
         self.index = None
@@ -18,18 +23,29 @@ class ConsultationSearch(SearchInterface):
         self.load_resources()
 
     def load_resources(self):
-        if INDEX_PATH.exists():
-            print(f"Loading Consultation index from {INDEX_PATH}")
-            self.index = faiss.read_index(str(INDEX_PATH))
+        print(f"Loading Consultation index from {INDEX_PATH}")
+        self._index_handle = shared_index_handle(INDEX_PATH)
+        self.index = self._index_handle.index
         
         print(f"Loading CLIP model: {CLIP_MODEL_NAME}...")
         self.model = SentenceTransformer(CLIP_MODEL_NAME)
         print("Model loaded.")
 
-    def search(self, query: str, top_k: int = 20, favorites_only: bool = False, folder: str = None, project_slug: str = None):
+    def reload_index(self, force: bool = False):
+        # The handle is shared: another strategy may already have loaded the new index
+        if force:
+            self._index_handle.reload()
+        else:
+            self._index_handle.refresh()
+        self.index = self._index_handle.index
+
+    def search(self, query: str, top_k: int = 20, favorites_only: bool = False, folder: str = None, project_slug: str = None, diversify: bool = None):
+        # Results are already grouped one container per project, so `diversify` is a no-op here
         if not query:
             return self._get_recent_projects(top_k)
 
+        self.reload_index()
+
         query_terms = query.split()
         user_city = self._extract_city(query)
         
@@ -39,7 +55,7 @@ class ConsultationSearch(SearchInterface):
         # 2. Semantic Search (Only matching "After" images)
         text_emb = self.model.encode([query]).astype('float32')
         faiss.normalize_L2(text_emb)
-        D, I = self.index.search(text_emb, 1000)
+        D, I = self.index.search(text_emb, self.SEARCH_K)
         
         found_ids = [int(id) for id in I[0] if id != -1]
         scores = {int(id): float(score) for id, score in zip(I[0], D[0]) if id != -1}
@@ -63,7 +79,7 @@ class ConsultationSearch(SearchInterface):
             conn.close()
 
         # High confidence threshold
-        is_low_confidence = not after_images or max(scores.values()) < 0.23
+        is_low_confidence = not after_images or max(scores.values()) < self.LOW_CONFIDENCE_CUTOFF
 
         if is_low_confidence:
              return {
@@ -160,6 +176,6 @@ class ConsultationSearch(SearchInterface):
             })
         return {"results": results, "trust_header": f"Serving {self.engine.profile['hq_city']} and the North Shore since {self.engine.profile['founded']}."}
 
-    def search_by_image(self, image_id: int, top_k: int = 20): return []
+    def search_by_image(self, image_id: int, top_k: int = 20, diversify: bool = None): return []
     def search_by_object(self, object_id: str, top_k: int = 20): return []
     def analyze_board(self, image_ids: List[int]): return {}
@@ -1,6 +1,7 @@
 from .standard import StandardSearch
 from .consultation import ConsultationSearch
-from ..config import PROJECT_SLUG
+from ..config import PROJECT_SLUG, INDEX_PATH
+from ..index_store import shared_index_handle
 
 class StrategyCoordinator:
     def __init__(self):
@@ -40,3 +41,11 @@ class StrategyCoordinator:
         slug = kwargs.get('project_slug') or (args[1] if len(args) > 1 else None)
         strategy = self.get_strategy(slug)
         return strategy.analyze_board(*args, **kwargs)
+
+    def reload_index(self, force: bool = True):
+        # Strategies share one index handle: reload it once, then let each pick it up
+        if force and (self._standard or self._consultation):
+            shared_index_handle(INDEX_PATH).reload()
+        for strategy in (self._standard, self._consultation):
+            if strategy:
+                strategy.reload_index()
@@ -8,16 +8,19 @@ class SearchInterface(ABC):
                top_k: int = 50, 
                favorites_only: bool = False, 
                folder: Optional[str] = None, 
-               project_slug: Optional[str] = None) -> List[Dict[Any, Any]]:
+               project_slug: Optional[str] = None,
+               diversify: Optional[bool] = None) -> List[Dict[Any, Any]]:
         """
         Standard text-to-image or text-to-container search.
+        diversify=None falls back to the DIVERSIFY_RESULTS config default.
         """
         pass
 
     @abstractmethod
     def search_by_image(self, 
                         image_id: int, 
-                        top_k: int = 50) -> List[Dict[Any, Any]]:
+                        top_k: int = 50,
+                        diversify: Optional[bool] = None) -> List[Dict[Any, Any]]:
         """
         Find similar images based on an anchor image.
         """
@@ -39,3 +42,9 @@ class SearchInterface(ABC):
         Composite analysis of a collection of images.
         """
         pass
+
+    def reload_index(self, force: bool = False):
+        """
+        Re-read the published index if it changed on disk (or unconditionally with force).
+        """
+        pass
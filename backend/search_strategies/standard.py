@@ -1,8 +1,14 @@
 import faiss
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from ..config import INDEX_PATH, CLIP_MODEL_NAME, DEFAULT_TOP_K, PROJECT_SLUG, PHOTO_FOLDER
+from ..config import (
+    INDEX_PATH, CLIP_MODEL_NAME, DEFAULT_TOP_K, PROJECT_SLUG, PHOTO_FOLDER,
+    DIVERSIFY_RESULTS, MMR_LAMBDA, MMR_GROUP_BY, MMR_MAX_PER_GROUP
+)
 from ..db import get_db_connection
+from ..diversify import mmr_select
+from ..index_store import shared_index_handle
+from ..attributes import AttributeMatrix, ATTRIBUTE_OPTIONS, attribute_report
 import psycopg2.extras
 from PIL import Image
 import os
@@ -10,27 +16,45 @@ from .interface import SearchInterface
 from typing import List, Dict, Any, Optional
 
 class StandardSearch(SearchInterface):
+    # Ranking knobs (tuned by eye; see backend/evaluation.py before changing)
+    SEMANTIC_CUTOFF = 0.25
+    KEYWORD_BOOST = 0.5
+    KEYWORD_ONLY_SCORE = 0.45
+    MIN_SEARCH_K = 2000
+
     def __init__(self):
         self.model = None
         self.index = None
+        self._attributes = AttributeMatrix()
+        self._option_embeddings = None
         self.load_resources()
 
     def load_resources(self):
-        if INDEX_PATH.exists():
-            print(f"Loading index from {INDEX_PATH}")
-            self.index = faiss.read_index(str(INDEX_PATH))
-        else:
+        print(f"Loading index from {INDEX_PATH}")
+        self._index_handle = shared_index_handle(INDEX_PATH)
+        self.index = self._index_handle.index
+        if self.index is None:
             print("WARNING: No index found. Search will return empty.")
         
         print(f"Loading CLIP model: {CLIP_MODEL_NAME}...")
         self.model = SentenceTransformer(CLIP_MODEL_NAME)
         print("Model loaded.")
 
-    def search(self, query: str, top_k: int = DEFAULT_TOP_K, favorites_only: bool = False, folder: str = None, project_slug: str = None):
+    def reload_index(self, force: bool = False):
+        """Pick up an index published by the indexer (atomic rename) without a restart."""
+        # The handle is shared: another strategy may already have loaded the new index
+        if force:
+            self._index_handle.reload()
+        else:
+            self._index_handle.refresh()
+        self.index = self._index_handle.index
+
+    def search(self, query: str, top_k: int = DEFAULT_TOP_K, favorites_only: bool = False, folder: str = None, project_slug: str = None, diversify: bool = None):
         # Override project_slug with global config if defined
         if PROJECT_SLUG:
             project_slug = PROJECT_SLUG
-            
+
+        self.reload_index()
         if not self.index or not self.model:
             print("Search Error: Index or Model missing")
             return []
@@ -69,7 +93,7 @@ class StandardSearch(SearchInterface):
         text_emb = self.model.encode([query]).astype('float32')
         faiss.normalize_L2(text_emb)
         
-        search_k = max(top_k * 20, 2000)
+        search_k = max(top_k * 20, self.MIN_SEARCH_K)
         D, I = self.index.search(text_emb, search_k)
         
         found_ids = [int(id) for id in I[0] if id != -1]
@@ -111,22 +135,25 @@ class StandardSearch(SearchInterface):
         for img in semantic_results:
             if project_slug and img.get('project_slug') != project_slug: continue
             img['similarity'] = scores.get(img['id'], 0)
-            if img['similarity'] < 0.25: continue
+            if img['similarity'] < self.SEMANTIC_CUTOFF: continue
             final_map[img['id']] = img
 
         for img in keyword_results:
             if img['id'] in final_map:
-                final_map[img['id']]['similarity'] += 0.5 
+                final_map[img['id']]['similarity'] += self.KEYWORD_BOOST
             else:
-                img['similarity'] = 0.45 
+                img['similarity'] = self.KEYWORD_ONLY_SCORE
                 final_map[img['id']] = img
         
         results = list(final_map.values())
         results.sort(key=lambda x: x['similarity'], reverse=True)
+        if DIVERSIFY_RESULTS if diversify is None else diversify:
+            return self._diversify(results, top_k, 'similarity')
         return results[:top_k]
 
 
-    def search_by_image(self, image_id: int, top_k: int = DEFAULT_TOP_K):
+    def search_by_image(self, image_id: int, top_k: int = DEFAULT_TOP_K, diversify: bool = None):
+        self.reload_index()
         if not self.index or not self.model:
             return []
 
@@ -172,7 +199,9 @@ class StandardSearch(SearchInterface):
         img_emb = img_emb.astype('float32')
         faiss.normalize_L2(img_emb)
 
-        search_k = top_k * 4
+        use_mmr = DIVERSIFY_RESULTS if diversify is None else diversify
+        # MMR needs a deeper pool to have alternatives to the near-duplicates
+        search_k = top_k * (20 if use_mmr else 4)
         distances, ids = self.index.search(img_emb, search_k)
         
         valid_ids = [int(i) for i in ids[0] if i >= 0]
@@ -208,8 +237,27 @@ class StandardSearch(SearchInterface):
             candidates.append(img)
             
         candidates.sort(key=lambda x: x['score'], reverse=True)
+        if use_mmr:
+            return self._diversify(candidates, top_k, 'score')
         return candidates[:top_k]
 
+    def _get_vectors(self, image_ids: List[int]) -> np.ndarray:
+        """Look up stored (normalized) index vectors for DB ids; missing ids get zeros."""
+        found, vectors = self._index_handle.lookup(image_ids)
+        out = np.zeros((len(image_ids), self.index.d), dtype=np.float32)
+        out[found] = vectors
+        return out
+
+    def _diversify(self, results: List[Dict], top_k: int, score_key: str) -> List[Dict]:
+        """MMR re-rank with a per-folder/per-project cap (see backend/diversify.py)."""
+        if not results:
+            return results
+        vectors = self._get_vectors([r['id'] for r in results])
+        relevance = [r[score_key] for r in results]
+        groups = [r.get(MMR_GROUP_BY) or r['id'] for r in results]
+        order = mmr_select(vectors, relevance, top_k, MMR_LAMBDA, groups, MMR_MAX_PER_GROUP)
+        return [results[i] for i in order]
+
     def search_by_object(self, object_id: str, top_k: int = DEFAULT_TOP_K):
         conn = get_db_connection()
         try:
@@ -281,42 +329,43 @@ class StandardSearch(SearchInterface):
         finally: conn.close()
 
     def analyze_board(self, image_ids: List[int]):
-        from sentence_transformers import util
-        import torch
-        if not self.model or not image_ids: return {}
+        """
+        Style / Material / Atmosphere for a board, from the precomputed attribute
+        matrix (backend/attributes.py) averaged over every board image.
+        """
+        if not image_ids: return {}
         try:
-            categories = {
-                "Style": ["Modern Minimalist", "Rustic Organic", "Traditional Formal", "Cottage Garden", "Luxury Resort"],
-                "Material": ["Natural Stone", "Concrete Pavers", "Wood Decking", "Brick", "Gravel"],
-                "Atmosphere": ["Warm & Cozy", "Cool & Sleek", "Bright & Airy", "Moody & Dramatic"]
-            }
-            limit_ids = image_ids[:5] 
-            conn = get_db_connection()
-            placeholders = ','.join(['%s'] * len(limit_ids))
-            sql = f"SELECT file_path FROM images WHERE id IN ({placeholders})"
-            params = list(limit_ids)
             if PROJECT_SLUG:
-                sql += " AND project_slug = %s"
-                params.append(PROJECT_SLUG)
-            with conn.cursor() as cur:
-                cur.execute(sql, tuple(params))
-                rows = cur.fetchall()
-            conn.close()
-            
-            images = []
-            for r in rows:
-                if os.path.exists(r[0]):
-                    try: images.append(Image.open(r[0]))
-                    except: pass
-            
-            if not images: return {"error": "No valid images"}
-            img_embs = self.model.encode(images)
-            mean_emb = np.mean(img_embs, axis=0)
-            report = {}
-            for cat, options in categories.items():
-                opt_embs = self.model.encode(options)
-                sims = util.cos_sim(mean_emb, opt_embs)[0]
-                best_idx = int(np.argmax(sims))
-                report[cat] = options[best_idx]
-            return report
-        except: return {"error": "Analysis failed"}
+                # Only this project's images may shape its report
+                conn = get_db_connection()
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT id FROM images WHERE id = ANY(%s) AND project_slug = %s",
+                                    (list(image_ids), PROJECT_SLUG))
+                        allowed = {r[0] for r in cur.fetchall()}
+                finally:
+                    conn.close()
+                image_ids = [iid for iid in image_ids if iid in allowed]
+                if not image_ids: return {"error": "No valid images"}
+            self.reload_index()
+            found, rows = self._attributes.lookup(image_ids)
+            missing = [iid for iid, hit in zip(image_ids, found) if not hit]
+            if missing and self.index is not None:
+                # Indexed after the matrix was built: score the stored vectors directly
+                vectors = self._get_vectors(missing)
+                vectors = vectors[np.linalg.norm(vectors, axis=1) > 0]
+                if len(vectors):
+                    rows = np.vstack([rows, vectors @ self._attribute_option_embeddings().T])
+            if not len(rows): return {"error": "No valid images"}
+            return attribute_report(rows.mean(axis=0))
+        except Exception as e:
+            print(f"Analysis Error: {e}")
+            return {"error": "Analysis failed"}
+
+    def _attribute_option_embeddings(self) -> np.ndarray:
+        if self._attributes.option_embeddings is not None:
+            return self._attributes.option_embeddings
+        if self._option_embeddings is None:
+            self._option_embeddings = self.model.encode(
+                [option for _, option in ATTRIBUTE_OPTIONS], normalize_embeddings=True).astype(np.float32)
+        return self._option_embeddings
@@ -30,6 +30,20 @@ function resolveAssetUrl(path, type = 'thumbnail') {
     return finalUrl;
 }
 
+// Responsive <picture> for a result row: WebP/JPEG srcsets from /api/thumbnails when
+// the API provided them, the legacy single-size thumbnail otherwise
+function pictureHtml(img, alt, sizes = '(max-width: 600px) 50vw, 300px') {
+    const fallback = resolveAssetUrl(img.thumbnail_path);
+    if (!img.thumbnails) {
+        return `<img src="${fallback}" loading="lazy" alt="${alt}">`;
+    }
+    return `
+        <picture>
+            <source type="image/webp" srcset="${img.thumbnails.webp}" sizes="${sizes}">
+            <img src="${img.thumbnails.src}" srcset="${img.thumbnails.jpg}" sizes="${sizes}" loading="lazy" alt="${alt}">
+        </picture>`;
+}
+
 // --- BRANDING UTILS ---
 function applyBranding() {
     // 1. App-level Metadata
@@ -481,14 +495,12 @@ function renderImageCard(card, img, index) {
     card.onmouseenter = () => { if (visionBoard.length === 0) calculateLiveAnalysis([img]); };
     card.onmouseleave = () => { if (visionBoard.length === 0) calculateLiveAnalysis([]); };
 
-    const thumbUrl = resolveAssetUrl(img.thumbnail_path);
-    console.log(`[DEBUG] Resolved thumbUrl:`, thumbUrl);
     const isSelected = visionBoard.includes(img.id);
     const iconClass = isSelected ? 'active' : '';
     const actionIcon = isSelected ? ICONS.CHECK_CIRCLE : ICONS.PLUS;
 
     card.innerHTML = `
-        <img src="${thumbUrl}" loading="lazy" alt="${img.filename}">
+        ${pictureHtml(img, img.filename)}
         <div class="card-overlay">
             <div class="card-actions">
                 <button class="icon-btn" onclick="event.stopPropagation(); window.triggerSimilaritySearch(${img.id})" title="Find Similar">
@@ -512,11 +524,10 @@ function renderImageCard(card, img, index) {
 
 function renderProjectCard(card, project, index) {
     const hero = project.hero_image;
-    const thumbUrl = resolveAssetUrl(hero.thumbnail_path);
 
     card.classList.add('project-card');
     card.innerHTML = `
-        <img src="${thumbUrl}" loading="lazy" alt="${hero.filename}">
+        ${pictureHtml(hero, hero.filename)}
         <div class="card-overlay">
             <div class="project-info">
                 <div class="project-title">${project.id.startsWith('temp_') ? 'Portfolio Collection' : 'Design Project'}</div>
@@ -917,16 +928,37 @@ window.refineImageAnalysis = async function (imageId) {
             method: 'POST'
         });
 
-        clearInterval(interval);
-
         if (!res.ok) {
+            clearInterval(interval);
             const errData = await res.json().catch(() => ({}));
             throw new Error(errData.detail || `Server error: ${res.status}`);
         }
 
-        const data = await res.json();
+        // The refine worker runs the job; poll until it finishes
+        const { job_id } = await res.json();
+        const deadline = Date.now() + 5 * 60 * 1000;
+        let data;
+        do {
+            await new Promise(resolve => setTimeout(resolve, 1500));
+            const statusRes = await fetch(`${API_BASE}/refine/${job_id}`);
+            if (!statusRes.ok) {
+                clearInterval(interval);
+                throw new Error(`Server error: ${statusRes.status}`);
+            }
+            data = await statusRes.json();
+        } while ((data.status === 'pending' || data.status === 'running') && Date.now() < deadline);
+
+        clearInterval(interval);
+
+        if (data.status === 'pending' || data.status === 'running') {
+            throw new Error('Scan is still queued; check back in a few minutes');
+        }
+
+        if (data.status === 'failed') {
+            throw new Error(data.error || 'Refinement failed');
+        }
 
-        if (data.status === 'success') {
+        if (data.status === 'done') {
             showNotification('Deep Intelligence Updated');
 
             // Refresh metadata from DB
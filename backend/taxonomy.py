@@ -200,3 +200,11 @@ def get_category_tags(category: str) -> list:
 def get_tag_category(tag: str) -> str:
     """Get the category for a specific tag."""
     return TAG_TO_CATEGORY.get(tag, "unknown")
+
+# Board-level descriptors for the lead "vision report" (analyze_board): the
+# option whose text embedding best matches the board's images wins per category
+BOARD_ATTRIBUTES = {
+    "Style": ["Modern Minimalist", "Rustic Organic", "Traditional Formal", "Cottage Garden", "Luxury Resort"],
+    "Material": ["Natural Stone", "Concrete Pavers", "Wood Decking", "Brick", "Gravel"],
+    "Atmosphere": ["Warm & Cozy", "Cool & Sleek", "Bright & Airy", "Moody & Dramatic"],
+}
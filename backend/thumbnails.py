@@ -0,0 +1,264 @@
+"""
+Multi-resolution thumbnails.
+Renditions are keyed by content hash and width, e.g. sizes/ab/<hash>_400.webp,
+so they are immutable (cacheable forever) and shared by byte-identical copies.
+They are rendered on first request (or eagerly by the indexer with
+THUMBNAIL_EAGER) and kept under a size budget by evicting the least recently
+served files.
+
+Usage:
+    python3 -m backend.thumbnails --gc [--dry-run]   # remove orphaned thumbnails
+    python3 -m backend.thumbnails --warm             # render every rendition now
+"""
+
+import io
+import os
+import re
+import time
+import argparse
+import threading
+
+from PIL import Image
+
+from backend.config import (
+    THUMBNAILS_DIR, THUMBNAIL_WIDTHS, THUMBNAIL_FORMATS, THUMBNAIL_CACHE_MAX_MB
+)
+from backend.db import get_image_by_hash, get_thumbnail_references
+
+RENDITIONS_DIR = THUMBNAILS_DIR / "sizes"
+MEDIA_TYPES = {'webp': 'image/webp', 'jpg': 'image/jpeg'}
+SAVE_OPTIONS = {
+    'webp': dict(format='WEBP', quality=80, method=4),
+    'jpg': dict(format='JPEG', quality=82, optimize=True, progressive=True),
+}
+HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# Served files are re-touched at most this often, so LRU bookkeeping costs
+# one utime per file per day rather than one per request
+TOUCH_INTERVAL = 24 * 3600
+# Check the cache budget after this many renders
+PRUNE_EVERY = 100
+
+_render_count = 0
+_prune_lock = threading.Lock()
+
+
+def rendition_path(file_hash, width, fmt):
+    return RENDITIONS_DIR / file_hash[:2] / f"{file_hash}_{width}.{fmt}"
+
+
+def rendition_url(file_hash, width, fmt):
+    return f"/api/thumbnails/{file_hash}/{width}.{fmt}"
+
+
+def thumbnail_urls(file_hash):
+    """srcset strings per format plus a default src, or None without a hash."""
+    if not file_hash:
+        return None
+    urls = {
+        fmt: ", ".join(f"{rendition_url(file_hash, w, fmt)} {w}w" for w in THUMBNAIL_WIDTHS)
+        for fmt in THUMBNAIL_FORMATS
+    }
+    urls['src'] = rendition_url(file_hash, THUMBNAIL_WIDTHS[len(THUMBNAIL_WIDTHS) // 2], 'jpg')
+    return urls
+
+
+def add_thumbnail_urls(results):
+    """Attach a 'thumbnails' entry to each result row that has a content hash."""
+    for r in results or []:
+        if isinstance(r, dict) and r.get('file_hash'):
+            r['thumbnails'] = thumbnail_urls(r['file_hash'])
+    return results
+
+
+def is_valid_rendition(file_hash, width, fmt):
+    return bool(HASH_RE.match(file_hash or '')) and width in THUMBNAIL_WIDTHS and fmt in THUMBNAIL_FORMATS
+
+
+def save_atomic(img, path, fmt):
+    """Save img as fmt ('jpg'/'webp', see SAVE_OPTIONS) via a temp file and rename, so readers never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    img.save(tmp_path, **SAVE_OPTIONS[fmt])
+    os.replace(tmp_path, path)
+
+
+def write_renditions(img, file_hash, widths=THUMBNAIL_WIDTHS, formats=THUMBNAIL_FORMATS):
+    """
+    Render the given widths/formats from an RGB image. Widths are produced
+    largest first, each from the previous one; images are never upscaled.
+    Existing files are left alone. Returns the number of files written.
+    """
+    written = 0
+    current = img
+    for width in sorted(widths, reverse=True):
+        w, h = current.size
+        if w > width:
+            current = current.resize((width, max(1, round(h * width / w))), Image.LANCZOS)
+        for fmt in formats:
+            path = rendition_path(file_hash, width, fmt)
+            if not path.exists():
+                save_atomic(current, path, fmt)
+                written += 1
+    return written
+
+
+def _open_source(file_hash, width):
+    """Decode the best available source for a hash (original, remote URL or legacy thumbnail)."""
+    row = get_image_by_hash(file_hash)
+    if not row:
+        return None
+    return open_source(row['file_path'], row['thumbnail_path'], width)
+
+
+def open_source(file_path, thumb, width):
+    """
+    Decode an image row's original (local path or URL), falling back to its
+    legacy thumbnail, at no less than the requested width. None without a source.
+    """
+    if file_path and os.path.exists(file_path):
+        source = file_path
+    elif file_path and file_path.startswith('http'):
+        import requests
+        resp = requests.get(file_path, timeout=15)
+        resp.raise_for_status()
+        source = io.BytesIO(resp.content)
+    elif thumb and thumb.startswith('http'):
+        import requests
+        resp = requests.get(thumb, timeout=15)
+        resp.raise_for_status()
+        source = io.BytesIO(resp.content)
+    elif thumb and (THUMBNAILS_DIR / thumb).exists():
+        source = THUMBNAILS_DIR / thumb
+    else:
+        return None
+
+    with Image.open(source) as img:
+        # JPEG draft decode straight to (at least) the requested width
+        img.draft('RGB', (width, max(1, img.size[1] * width // img.size[0])))
+        return img.convert('RGB')
+
+
+def get_rendition(file_hash, width, fmt):
+    """Path to the rendition, rendering it first if needed. None if there is no source."""
+    global _render_count
+    path = rendition_path(file_hash, width, fmt)
+    try:
+        st = path.stat()
+        if time.time() - st.st_mtime > TOUCH_INTERVAL:
+            os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+
+    img = _open_source(file_hash, width)
+    if img is None:
+        return None
+    write_renditions(img, file_hash, widths=(width,), formats=(fmt,))
+
+    _render_count += 1
+    if _render_count % PRUNE_EVERY == 0:
+        threading.Thread(target=prune_cache, daemon=True).start()
+    return path
+
+
+def _iter_renditions():
+    if not RENDITIONS_DIR.exists():
+        return
+    for shard in os.scandir(RENDITIONS_DIR):
+        if shard.is_dir():
+            yield from (e for e in os.scandir(shard.path) if e.is_file())
+
+
+def prune_cache(max_bytes=THUMBNAIL_CACHE_MAX_MB * 1024 * 1024):
+    """Evict least recently served renditions until the cache is under 90% of its budget."""
+    if not _prune_lock.acquire(blocking=False):
+        return 0
+    try:
+        entries = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in _iter_renditions()]
+        total = sum(size for _, size, _ in entries)
+        if total <= max_bytes:
+            return 0
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except FileNotFoundError:
+                pass
+        print(f"Thumbnail cache: evicted {removed} renditions ({total / 1e6:.0f} MB left)")
+        return removed
+    finally:
+        _prune_lock.release()
+
+
+def collect_orphans(dry_run=False):
+    """
+    Remove thumbnails no image row references: legacy single-size files
+    (matched against thumbnail_path), renditions (matched against file_hash)
+    and temp files left behind by interrupted writes.
+    """
+    thumbs, hashes = get_thumbnail_references()
+    if not thumbs and not hashes:
+        print("No image rows found; refusing to treat every thumbnail as an orphan.")
+        return 0, 0
+
+    orphans = []
+    for entry in os.scandir(THUMBNAILS_DIR):
+        if entry.is_file() and entry.name not in thumbs:
+            orphans.append(entry)
+    for entry in _iter_renditions():
+        if entry.name.endswith('.tmp') or entry.name.split('_', 1)[0] not in hashes:
+            orphans.append(entry)
+
+    freed = sum(e.stat().st_size for e in orphans)
+    if not dry_run:
+        for entry in orphans:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+    verb = "Would remove" if dry_run else "Removed"
+    print(f"{verb} {len(orphans)} orphaned thumbnails ({freed / 1e6:.1f} MB).")
+    return len(orphans), freed
+
+
+def warm_cache():
+    """Render every width/format for every hash that is not cached yet."""
+    _, hashes = get_thumbnail_references()
+    written = 0
+    for i, file_hash in enumerate(sorted(hashes), 1):
+        missing = [(w, f) for w in THUMBNAIL_WIDTHS for f in THUMBNAIL_FORMATS
+                   if not rendition_path(file_hash, w, f).exists()]
+        if not missing:
+            continue
+        try:
+            img = _open_source(file_hash, max(THUMBNAIL_WIDTHS))
+            if img is not None:
+                written += write_renditions(img, file_hash)
+        except Exception as e:
+            print(f"Error rendering {file_hash}: {e}")
+        if i % 100 == 0:
+            print(f"[{i}/{len(hashes)}] {written} renditions written")
+    print(f"Done. {written} renditions written.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Thumbnail rendition maintenance")
+    parser.add_argument("--gc", action="store_true", help="Delete thumbnails no image references")
+    parser.add_argument("--dry-run", action="store_true", help="With --gc, only report what would be deleted")
+    parser.add_argument("--warm", action="store_true", help="Render all renditions ahead of time")
+    parser.add_argument("--prune", action="store_true", help="Enforce THUMBNAIL_CACHE_MAX_MB now")
+    args = parser.parse_args()
+
+    if args.gc:
+        collect_orphans(dry_run=args.dry_run)
+    if args.warm:
+        warm_cache()
+    if args.prune:
+        prune_cache()
+    if not (args.gc or args.warm or args.prune):
+        parser.print_help()
@@ -1,22 +1,256 @@
 """
 Vision Analysis Engine
 Analyzes vision boards to extract themes, patterns, and actionable insights.
-Uses pre-computed tags and CLIP embeddings for instant analysis.
+Uses pre-computed tags and the CLIP vectors stored in the index for instant
+analysis; no image is opened and no model is loaded.
+
+Boards are edited one image at a time, so analyses are cached per image-id
+set as mergeable aggregates (tag counters, score sums, cluster centroid sums).
+A request for a board one or two images away from a cached one updates those
+aggregates instead of starting over.
 """
 
+import copy
+import time
+import threading
 import numpy as np
-from sklearn.cluster import KMeans
-from collections import Counter
+from collections import Counter, OrderedDict
 from typing import List, Dict, Any
 import psycopg2.extras
 
+from backend.config import INDEX_PATH, VISION_CACHE_BOARDS, VISION_CACHE_TTL
 from backend.db import get_db_connection
 from backend.taxonomy import TAXONOMY, get_tag_label, get_tag_category, TAG_TO_CATEGORY
-from backend.search import SearchEngine
+from backend.index_store import shared_index_handle
+from backend.clustering import cluster_auto
+
+SITE_FIELDS = ('privacy_level', 'terrain_type', 'hardscape_ratio')
+# Cached image rows kept for re-use across boards
+MAX_CACHED_ROWS = 20000
+# Cached boards scanned for a near match, most recently used first
+NEAR_MATCH_SCAN = 32
+
+
+def _max_clusters(n):
+    """Upper bound on themes for a board of n clustered images; silhouette picks k within it."""
+    if n < 6:
+        return 2
+    if n < 12:
+        return 3
+    return min(5, n // 4)
+
+
+def _most_common(counter: Counter, limit: int = None):
+    """Counter.most_common with ties broken by key, so cached and fresh results agree."""
+    ranked = sorted(counter.items(), key=lambda kv: (-kv[1], kv[0]))
+    return ranked[:limit] if limit else ranked
+
+
+class _BoardState:
+    """Mergeable aggregates for one board; add/remove cost O(tags of the image)."""
+
+    def __init__(self):
+        self.rows = {}                 # id -> row the aggregates were built from
+        self.tag_counts = Counter()
+        self.score_sums = Counter()
+        self.score_counts = Counter()
+        self.site = {field: Counter() for field in SITE_FIELDS}
+        self.total_tags = 0
+        # Clustering: id -> cluster, per-cluster vector sums / counts / tag counters
+        self.assign = {}
+        self.sums = None
+        self.counts = None
+        self.cluster_tags = []
+        self.changes_since_cluster = 0
+        self.clustered_bound = None
+        self.result = None
+
+    def copy(self):
+        """Independent aggregates that still share the (read-only) cached rows."""
+        other = _BoardState()
+        other.rows = dict(self.rows)
+        other.tag_counts = Counter(self.tag_counts)
+        other.score_sums = Counter(self.score_sums)
+        other.score_counts = Counter(self.score_counts)
+        other.site = {field: Counter(c) for field, c in self.site.items()}
+        other.total_tags = self.total_tags
+        other.assign = dict(self.assign)
+        other.sums = None if self.sums is None else self.sums.copy()
+        other.counts = None if self.counts is None else self.counts.copy()
+        other.cluster_tags = [Counter(c) for c in self.cluster_tags]
+        other.changes_since_cluster = self.changes_since_cluster
+        other.clustered_bound = self.clustered_bound
+        return other
+
+    def apply(self, row, sign):
+        tags = row['tags'] or []
+        scores = row['style_scores'] or {}
+        for tag in tags:
+            self.tag_counts[tag] += sign
+            if self.tag_counts[tag] <= 0:
+                del self.tag_counts[tag]
+            if tag in scores:
+                self.score_sums[tag] += sign * scores[tag]
+                self.score_counts[tag] += sign
+                if self.score_counts[tag] <= 0:
+                    del self.score_counts[tag]
+                    del self.score_sums[tag]
+        self.total_tags += sign * len(tags)
+        for field in SITE_FIELDS:
+            if row.get(field):
+                self.site[field][row[field]] += sign
+                if self.site[field][row[field]] <= 0:
+                    del self.site[field][row[field]]
+
 
 class VisionAnalyzer:
     def __init__(self):
-        self.search_engine = SearchEngine()
+        # Shared with the search strategies: one copy of the index per process
+        self._index_handle = shared_index_handle(INDEX_PATH)
+        self._index = self._index_handle.index
+        self._rows = OrderedDict()     # id -> (row, xmin token, checked_at)
+        self._boards = OrderedDict()   # frozenset(ids) -> _BoardState
+        self._lock = threading.Lock()
+    
+    def _stored_vectors(self, image_ids: List[int]):
+        """
+        Index vectors for the given ids.
+        
+        Returns:
+            (found_ids, vectors) for the ids present in the index
+        """
+        found, vectors = self._index_handle.lookup(image_ids)
+        return np.asarray(image_ids, dtype=np.int64)[found].tolist(), vectors
+    
+    def _fetch_rows(self, image_ids) -> Dict[int, Dict]:
+        """
+        Rows for the board, from the row cache where possible. Rows not checked
+        within VISION_CACHE_TTL are revalidated against their xmin (which changes
+        on every UPDATE), and only rows that changed are read in full.
+        """
+        now = time.monotonic()
+        stale = [i for i in image_ids if i not in self._rows or now - self._rows[i][2] > VISION_CACHE_TTL]
+        if stale:
+            conn = get_db_connection()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT id, xmin::text FROM images WHERE id = ANY(%s)", (stale,))
+                    tokens = dict(cur.fetchall())
+                changed = [i for i in tokens if i not in self._rows or self._rows[i][1] != tokens[i]]
+                if changed:
+                    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                        cur.execute(f"""
+                            SELECT id, tags, style_scores, {', '.join(SITE_FIELDS)}, xmin::text AS token
+                            FROM images
+                            WHERE id = ANY(%s)
+                        """, (changed,))
+                        for row in cur.fetchall():
+                            row = dict(row)
+                            self._rows[row['id']] = (row, row.pop('token'), now)
+            finally:
+                conn.close()
+            for i in stale:
+                if i not in tokens:
+                    self._rows.pop(i, None)
+                elif i in self._rows:
+                    row, token, _ = self._rows[i]
+                    self._rows[i] = (row, token, now)
+        
+        rows = {}
+        for i in image_ids:
+            if i in self._rows:
+                self._rows.move_to_end(i)
+                rows[i] = self._rows[i][0]
+        while len(self._rows) > MAX_CACHED_ROWS:
+            self._rows.popitem(last=False)
+        return rows
+    
+    def _board_state(self, key: frozenset, rows: Dict[int, Dict]) -> _BoardState:
+        """Cached state for the board: exact hit, derived from the nearest cached board, or built fresh."""
+        state = self._boards.get(key)
+        if state is None:
+            base, base_key = None, None
+            limit = max(4, len(key) // 4)
+            for i, (cached_key, cached) in enumerate(reversed(self._boards.items())):
+                if i >= NEAR_MATCH_SCAN:
+                    break
+                if abs(len(cached_key) - len(key)) > limit:
+                    continue
+                distance = len(cached_key ^ key)
+                if distance <= limit and (base is None or distance < len(base_key ^ key)):
+                    base, base_key = cached, cached_key
+            state = base.copy() if base is not None else _BoardState()
+            self._boards[key] = state
+            while len(self._boards) > VISION_CACHE_BOARDS:
+                self._boards.popitem(last=False)
+        self._boards.move_to_end(key)
+        
+        # Bring the aggregates in line with the board and its current rows
+        removed = [i for i in state.rows if i not in rows]
+        changed = [i for i, row in rows.items() if state.rows.get(i) is not row]
+        for i in removed:
+            self._unassign(state, i)
+            state.apply(state.rows.pop(i), -1)
+        for i in changed:
+            if i in state.rows:
+                self._unassign(state, i)
+                state.apply(state.rows[i], -1)
+            state.rows[i] = rows[i]
+            state.apply(rows[i], +1)
+        if removed or changed:
+            self._assign(state, changed)
+            state.result = None
+        return state
+    
+    def _cluster(self, state: _BoardState):
+        """Full spherical k-means over the board's stored vectors."""
+        valid_ids, embeddings = self._stored_vectors(list(state.rows))
+        state.assign, state.sums, state.counts, state.cluster_tags = {}, None, None, []
+        state.changes_since_cluster = 0
+        state.clustered_bound = None
+        if len(valid_ids) < 3:
+            return
+        bound = _max_clusters(len(state.rows))
+        labels, _, _ = cluster_auto(embeddings, range(2, bound + 1))
+        k = int(labels.max()) + 1
+        one_hot = np.zeros((len(labels), k), dtype=np.float32)
+        one_hot[np.arange(len(labels)), labels] = 1
+        state.sums = one_hot.T @ embeddings
+        state.counts = one_hot.sum(axis=0).astype(np.int64)
+        state.cluster_tags = [Counter() for _ in range(k)]
+        for img_id, label in zip(valid_ids, labels.tolist()):
+            state.assign[img_id] = label
+            state.cluster_tags[label].update(state.rows[img_id]['tags'] or [])
+        state.clustered_bound = bound
+    
+    def _assign(self, state: _BoardState, image_ids: List[int]):
+        """Add images to the nearest existing theme centroid; re-cluster once drift adds up."""
+        state.changes_since_cluster += len(image_ids)
+        if (state.sums is None or state.clustered_bound != _max_clusters(len(state.rows))
+                or state.changes_since_cluster > max(2, len(state.rows) // 4) or (state.counts == 0).any()):
+            # Re-cluster lazily, when the result is next built
+            state.sums = None
+            return
+        valid_ids, vectors = self._stored_vectors(image_ids)
+        if not valid_ids:
+            return
+        centroids = state.sums / np.maximum(np.linalg.norm(state.sums, axis=1, keepdims=True), 1e-12)
+        for img_id, vec, label in zip(valid_ids, vectors, np.argmax(vectors @ centroids.T, axis=1).tolist()):
+            state.assign[img_id] = label
+            state.sums[label] += vec
+            state.counts[label] += 1
+            state.cluster_tags[label].update(state.rows[img_id]['tags'] or [])
+    
+    def _unassign(self, state: _BoardState, img_id: int):
+        label = state.assign.pop(img_id, None)
+        if label is None or state.sums is None:
+            return
+        _, vec = self._stored_vectors([img_id])
+        if len(vec):
+            state.sums[label] -= vec[0]
+        state.counts[label] -= 1
+        state.cluster_tags[label].subtract(state.rows[img_id]['tags'] or [])
+        state.cluster_tags[label] = +state.cluster_tags[label]
     
     def analyze_vision_board(self, image_ids: List[int]) -> Dict[str, Any]:
         """
@@ -31,52 +265,33 @@ class VisionAnalyzer:
         if not image_ids:
             return {"error": "No images provided"}
         
-        # Fetch image data
-        conn = get_db_connection()
-        placeholders = ','.join(['%s'] * len(image_ids))
-        
-        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute(f"""
-                SELECT id, tags, caption, style_scores, file_path,
-                       privacy_level, terrain_type, hardscape_ratio
-                FROM images 
-                WHERE id IN ({placeholders})
-            """, tuple(image_ids))
-            images = [dict(row) for row in cur.fetchall()]
-        conn.close()
-        
-        if not images:
-            return {"error": "No images found"}
-        
-        # Aggregate Site Intelligence (Most frequent non-null value)
-        privacies = [img['privacy_level'] for img in images if img.get('privacy_level')]
-        terrains = [img['terrain_type'] for img in images if img.get('terrain_type')]
-        ratios = [img['hardscape_ratio'] for img in images if img.get('hardscape_ratio')]
-        
-        def most_common(lst):
-            return Counter(lst).most_common(1)[0][0] if lst else "Mixed"
-
-        # Extract all tags and scores
-        all_tags = []
-        tag_scores = {}
+        with self._lock:
+            # A newly published index (loaded here or by a search strategy)
+            # invalidates every cached clustering
+            self._index_handle.refresh()
+            if self._index_handle.index is not self._index:
+                self._index = self._index_handle.index
+                self._boards.clear()
+            
+            rows = self._fetch_rows(list(dict.fromkeys(image_ids)))
+            if not rows:
+                return {"error": "No images found"}
+            
+            state = self._board_state(frozenset(rows), rows)
+            if state.result is None:
+                state.result = self._build_result(state, image_ids)
+            return copy.deepcopy(state.result)
+    
+    def _build_result(self, state: _BoardState, image_ids: List[int]) -> Dict[str, Any]:
+        total_images = len(state.rows)
         
-        for img in images:
-            if img['tags']:
-                for tag in img['tags']:
-                    all_tags.append(tag)
-                    # Accumulate scores
-                    if img['style_scores'] and tag in img['style_scores']:
-                        score = img['style_scores'][tag]
-                        tag_scores[tag] = tag_scores.get(tag, []) + [score]
-        
-        # Aggregate tags
-        tag_counts = Counter(all_tags)
-        total_images = len(images)
+        def most_common(counter):
+            return _most_common(counter, 1)[0][0] if counter else "Mixed"
         
         # Calculate weighted scores
         top_elements = []
-        for tag, count in tag_counts.most_common(15):
-            avg_score = np.mean(tag_scores.get(tag, [0.5]))
+        for tag, count in _most_common(state.tag_counts, 15):
+            avg_score = state.score_sums[tag] / state.score_counts[tag] if state.score_counts[tag] else 0.5
             percentage = (count / total_images) * 100
             
             top_elements.append({
@@ -85,11 +300,11 @@ class VisionAnalyzer:
                 "category": get_tag_category(tag),
                 "count": count,
                 "percentage": round(percentage, 1),
-                "confidence": round(avg_score, 2)
+                "confidence": round(float(avg_score), 2)
             })
         
         # Cluster into themes
-        themes = self._cluster_themes(images, image_ids)
+        themes = self._themes(state, image_ids)
         
         # Extract category-specific insights
         materials = self._extract_category_tags(top_elements, "materials")
@@ -116,17 +331,18 @@ class VisionAnalyzer:
             "maintenance_vibe": maintenance_vibe[0] if maintenance_vibe else None,
             "unconscious_patterns": unconscious_patterns,
             "sales_brief": sales_brief,
-            "privacy_level": most_common(privacies),
-            "terrain_type": most_common(terrains),
-            "hardscape_ratio": most_common(ratios),
-            "tag_diversity": len(set(all_tags)),
-            "avg_tags_per_image": round(len(all_tags) / total_images, 1)
+            "privacy_level": most_common(state.site['privacy_level']),
+            "terrain_type": most_common(state.site['terrain_type']),
+            "hardscape_ratio": most_common(state.site['hardscape_ratio']),
+            "tag_diversity": len(state.tag_counts),
+            "avg_tags_per_image": round(state.total_tags / total_images, 1)
         }
     
-    def _cluster_themes(self, images: List[Dict], image_ids: List[int], n_clusters: int = None) -> List[Dict]:
+    def _themes(self, state: _BoardState, image_ids: List[int]) -> List[Dict]:
         """
-        Cluster images into 2-5 design themes using CLIP embeddings.
+        Design themes (2-5) from the board's clustering of stored CLIP vectors.
         """
+        images = list(state.rows.values())
         if len(images) < 3:
             # Too few images to cluster meaningfully
             return [{
@@ -136,64 +352,30 @@ class VisionAnalyzer:
                 "top_tags": self._get_top_tags_for_images(images)
             }]
         
-        # Auto-determine number of clusters
-        if n_clusters is None:
-            if len(images) < 6:
-                n_clusters = 2
-            elif len(images) < 12:
-                n_clusters = 3
-            else:
-                n_clusters = min(5, len(images) // 4)
-        
         try:
-            # Load images and get embeddings
-            from PIL import Image
-            import os
-            
-            valid_images = []
-            valid_ids = []
-            
-            for img in images:
-                if os.path.exists(img['file_path']):
-                    try:
-                        pil_img = Image.open(img['file_path'])
-                        valid_images.append(pil_img)
-                        valid_ids.append(img['id'])
-                    except:
-                        continue
-            
-            if len(valid_images) < 3:
-                # Fallback to tag-based grouping
+            if state.sums is None:
+                self._cluster(state)
+            if state.sums is None:
+                # Fewer than 3 images have stored vectors: fall back to tag-based grouping
                 return self._tag_based_themes(images, image_ids)
             
-            # Encode images
-            embeddings = self.search_engine.model.encode(valid_images)
-            
-            # Cluster
-            kmeans = KMeans(n_clusters=min(n_clusters, len(valid_images)), random_state=42)
-            labels = kmeans.fit_predict(embeddings)
+            members = [[] for _ in range(len(state.counts))]
+            for img_id, label in state.assign.items():
+                members[label].append(img_id)
+            clustered = len(state.assign)
             
             # Build theme groups
             themes = []
-            for cluster_id in range(n_clusters):
-                cluster_indices = np.where(labels == cluster_id)[0]
-                cluster_image_ids = [valid_ids[i] for i in cluster_indices]
-                cluster_images = [images[image_ids.index(img_id)] for img_id in cluster_image_ids]
-                
-                # Get top tags for this cluster
-                top_tags = self._get_top_tags_for_images(cluster_images)
-                
-                # Generate theme name from top tags
-                theme_name = self._generate_theme_name(top_tags)
-                
-                # Calculate confidence (silhouette-like score)
-                confidence = len(cluster_image_ids) / len(valid_images)
-                
+            for cluster_id, cluster_image_ids in enumerate(members):
+                if not cluster_image_ids:
+                    continue
+                top_tags = [tag for tag, _ in _most_common(state.cluster_tags[cluster_id], 5)]
                 themes.append({
-                    "name": theme_name,
-                    "confidence": round(confidence, 2),
-                    "image_ids": cluster_image_ids,
-                    "top_tags": top_tags[:5],
+                    "name": self._generate_theme_name(top_tags),
+                    # Share of the board in this theme
+                    "confidence": round(len(cluster_image_ids) / clustered, 2),
+                    "image_ids": sorted(cluster_image_ids),
+                    "top_tags": top_tags,
                     "image_count": len(cluster_image_ids)
                 })
             
@@ -230,7 +412,8 @@ class VisionAnalyzer:
         # Convert to themes
         themes = []
         for style_tag, img_ids in sorted(style_groups.items(), key=lambda x: len(x[1]), reverse=True):
-            cluster_images = [img for img in images if img['id'] in img_ids]
+            members = set(img_ids)
+            cluster_images = [img for img in images if img['id'] in members]
             top_tags = self._get_top_tags_for_images(cluster_images)
             
             themes.append({
@@ -251,7 +434,7 @@ class VisionAnalyzer:
                 all_tags.extend(img['tags'])
         
         tag_counts = Counter(all_tags)
-        return [tag for tag, _ in tag_counts.most_common(limit)]
+        return [tag for tag, _ in _most_common(tag_counts, limit)]
     
     def _generate_theme_name(self, top_tags: List[str]) -> str:
         """Generate a descriptive theme name from top tags."""
@@ -0,0 +1,296 @@
+"""
+Queue worker for the distributed pipeline (see backend/jobs.py).
+Run as many as the hardware allows, on one box or several; each process
+leases a job, heartbeats while it runs and reports the result. Models stay
+loaded between jobs, and an idle worker wakes as soon as a job is queued.
+
+Usage:
+    python3 -m backend.worker --stages index,tag --processes 4
+    python3 -m backend.worker --stages index --merge   # also publish shards on this box
+    python3 -m backend.worker --stages lead            # lead reports (the API also runs these)
+    python3 -m backend.worker --stages refine,objects  # the API's "refine" button
+"""
+
+import os
+import time
+import select
+import asyncio
+import socket
+import argparse
+import threading
+import multiprocessing
+
+import numpy as np
+import psycopg2.extras
+
+from backend.config import LEAD_RETRY_SECONDS
+from backend.db import get_db_connection, get_images_by_paths
+from backend.bulk_writer import BulkWriter
+from backend.embedding_cache import EmbeddingCache
+from backend import jobs
+
+IDLE_SLEEP = 5.0
+
+
+class IndexStage:
+    """Decode + embed + upsert a chunk of paths; the vectors go back as a shard."""
+
+    def __init__(self, decode_workers):
+        import faiss
+        from backend.indexer import Indexer
+        self._faiss = faiss
+        # Only the pipeline is needed: vectors go out as shards, never into the published index
+        self.indexer = Indexer(workers=decode_workers, checkpoint_every=0, load_state=False)
+        self.indexer.load_model()
+
+    def run(self, payload, progress):
+        faiss = self._faiss
+        paths = [p for p in payload['paths'] if os.path.exists(p)]
+        # Fresh in-memory index (and hash cache) per job: it only collects this chunk's vectors
+        self.indexer.index = faiss.IndexIDMap(faiss.IndexFlatIP(self.indexer.index.d))
+        self.indexer.embedding_cache = EmbeddingCache(load=False)
+        if paths:
+            update_ids = {path: meta['id'] for path, meta in get_images_by_paths(paths).items()}
+            self.indexer._run_pipeline(paths, update_ids)
+
+        index = self.indexer.index
+        ids = faiss.vector_to_array(index.id_map)
+        vectors = index.index.reconstruct_n(0, index.ntotal) if index.ntotal else np.zeros((0, index.d), np.float32)
+        result = {'indexed': int(index.ntotal), 'missing': len(payload['paths']) - len(paths),
+                  'failed': len(paths) - int(index.ntotal)}
+        return result, (ids, vectors)
+
+
+class TagStage:
+    def __init__(self, decode_workers):
+        from backend.batch_tagger import BatchTagger
+        self.tagger = BatchTagger()
+        self.writer = BulkWriter("tag-stage")
+
+    def run(self, payload, progress):
+        conn = get_db_connection()
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                cur.execute("SELECT id, file_path FROM images WHERE id = ANY(%s)", (payload['image_ids'],))
+                rows = cur.fetchall()
+        finally:
+            conn.close()
+        # Flushed before returning, so the job only completes once its rows are saved
+        success, errors = self.tagger.tag_rows(rows, writer=self.writer)
+        return {'tagged': success, 'errors': errors}, None
+
+
+class ObjectStage:
+    def __init__(self, decode_workers):
+        import process_objects_m3
+        process_objects_m3.load_models()
+        self.objects = process_objects_m3
+
+    def run(self, payload, progress):
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT id, file_path FROM images WHERE id = ANY(%s)", (payload['image_ids'],))
+                rows = cur.fetchall()
+        finally:
+            conn.close()
+        writer = self.objects.object_writer
+        failed_before = writer.stats['failed_rows']
+        for image_id, file_path in rows:
+            self.objects.process_image(image_id, file_path)
+        writer.flush()
+        if writer.stats['failed_rows'] > failed_before:
+            raise RuntimeError("object rows could not be saved")
+        return {'processed': len(rows)}, None
+
+
+class RefineStage:
+    """
+    On-demand re-analysis of one image: SAM/CLIP objects and GPT-4o
+    enrichment, run side by side with the models and event loop kept resident.
+    """
+
+    def __init__(self, decode_workers):
+        import process_objects_m3
+        import enrich_images  # creates its API clients at import time
+        process_objects_m3.load_models()
+        self.objects = process_objects_m3
+        self.enrich = enrich_images
+        # enrich_images' async client stays bound to this one loop
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="refine-loop", daemon=True).start()
+
+    def run(self, payload, progress):
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT file_path FROM images WHERE id = %s", (payload['image_id'],))
+                row = cur.fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            raise ValueError(f"Image {payload['image_id']} not found")
+        image_id, file_path = payload['image_id'], row[0]
+
+        object_writer, enrich_writer = self.objects.object_writer, self.enrich.writer
+        failed_before = object_writer.stats['failed_rows'] + enrich_writer.stats['failed_rows']
+        # The GPT call is network-bound: it runs while SAM/CLIP use the CPU
+        enrichment = asyncio.run_coroutine_threadsafe(self.enrich.enrich_image(image_id, file_path), self.loop)
+        progress({'step': 'objects'})
+        self.objects.process_image(image_id, file_path)
+        progress({'step': 'enrichment'})
+        enrichment.result()
+        progress({'step': 'saving'})
+        object_writer.flush()
+        enrich_writer.flush()
+        if object_writer.stats['failed_rows'] + enrich_writer.stats['failed_rows'] > failed_before:
+            raise RuntimeError("refinement results could not be saved")
+        return {'image_id': image_id}, None
+
+
+class LeadStage:
+    """PDF report + notification emails for one lead (backend/leads.py)."""
+    # Mostly mail delivery failures: back off instead of retrying at once
+    retry_delay = LEAD_RETRY_SECONDS
+
+    def __init__(self, decode_workers):
+        from backend import leads
+        self.leads = leads
+
+    def run(self, payload, progress):
+        return self.leads.process_lead(payload['lead_id']), None
+
+
+STAGE_CLASSES = {'index': IndexStage, 'tag': TagStage, 'objects': ObjectStage, 'lead': LeadStage,
+                 'refine': RefineStage}
+
+
+class Heartbeat:
+    """Keeps a job's lease alive from a background thread (own connection)."""
+
+    def __init__(self, job_id, worker_id, interval):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.interval = interval
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _beat(self):
+        conn = get_db_connection()
+        try:
+            while not self._stop.wait(self.interval):
+                if not jobs.heartbeat(conn, self.job_id, self.worker_id):
+                    print(f"Lost the lease on job {self.job_id}; its result will be discarded.")
+                    self.lost = True
+                    return
+        finally:
+            conn.close()
+
+
+def work(stages, decode_workers=1, merge=False, once=False, lease_seconds=jobs.LEASE_SECONDS, wake=None):
+    """
+    Claim and run jobs until the queue is empty (once=True) or forever.
+    An idle worker waits up to IDLE_SLEEP seconds for NOTIFY job_added, or for
+    wake (a threading.Event) when one is given.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    if threading.current_thread() is not threading.main_thread():
+        worker_id += f":{threading.current_thread().name}"
+    handlers = {}
+    conn = get_db_connection()
+    if wake is None:
+        with conn.cursor() as c:
+            c.execute("LISTEN job_added")
+        conn.commit()
+    print(f"Worker {worker_id} serving stages: {', '.join(stages)}")
+    done = 0
+    start = time.perf_counter()
+    try:
+        while True:
+            jobs.reap_expired(conn)
+            job = jobs.claim(conn, worker_id, stages, lease_seconds)
+            if job is None:
+                if merge:
+                    jobs.merge_shards()
+                if once:
+                    break
+                if wake is not None:
+                    wake.wait(IDLE_SLEEP)
+                    wake.clear()
+                else:
+                    select.select([conn], [], [], IDLE_SLEEP)
+                    conn.poll()
+                    conn.notifies.clear()
+                continue
+
+            stage = job['stage']
+            if stage not in handlers:
+                handlers[stage] = STAGE_CLASSES[stage](decode_workers)
+            print(f"[{worker_id}] job {job['id']} ({stage}, attempt {job['attempts']}/{job['max_attempts']})")
+
+            try:
+                with Heartbeat(job['id'], worker_id, lease_seconds / 3):
+                    result, shard = handlers[stage].run(
+                        job['payload'], lambda step: jobs.set_progress(conn, job['id'], worker_id, step))
+            except Exception as e:
+                print(f"[{worker_id}] job {job['id']} failed: {e}")
+                jobs.fail(conn, job['id'], worker_id, e, getattr(handlers[stage], 'retry_delay', 0))
+                continue
+
+            if jobs.complete(conn, job['id'], worker_id, result, shard):
+                done += 1
+                print(f"[{worker_id}] job {job['id']} done: {result} "
+                      f"({done / (time.perf_counter() - start) * 60:.1f} jobs/min)")
+            else:
+                print(f"[{worker_id}] job {job['id']} was taken over by another worker; result dropped.")
+            if merge and stage == 'index':
+                jobs.merge_shards()
+    finally:
+        conn.close()
+
+
+def _work_process(stages, decode_workers, merge, once):
+    try:
+        work(stages, decode_workers, merge, once)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distributed pipeline worker")
+    parser.add_argument("--stages", default="index,tag,objects", help="Comma-separated stages to serve")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes on this box")
+    parser.add_argument("--decode-workers", type=int,
+                        help="Decode processes per index worker (default: cores / processes)")
+    parser.add_argument("--merge", action="store_true",
+                        help="Merge finished index shards into this box's published index")
+    parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(jobs.STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    decode_workers = args.decode_workers or max(1, (os.cpu_count() or 2) // args.processes)
+
+    jobs.init_job_tables()
+    if args.processes == 1:
+        work(stages, decode_workers, args.merge, args.once)
+    else:
+        # Spawned, not forked: each process loads its own models and connections
+        ctx = multiprocessing.get_context("spawn")
+        procs = [ctx.Process(target=_work_process, args=(stages, decode_workers, args.merge and i == 0, args.once))
+                 for i in range(args.processes)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
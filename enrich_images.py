@@ -9,6 +9,8 @@ import psycopg2.extras
 from openai import AsyncOpenAI
 from supabase import create_client, Client
 
+from backend.bulk_writer import BulkWriter
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -30,6 +32,8 @@ PROJECT_SLUG = os.getenv("PROJECT_SLUG")
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+writer = BulkWriter("enrich")
+
 PROMPT = (
     "As an expert Landscape Architect, analyze this professional property photograph. "
     "Provide a JSON response with terms characterizing the design. "
@@ -113,12 +117,7 @@ async def enrich_image(image_id: int, image_path: str):
         if not analysis_str:
             logger.error(f"Empty content from AI for image {image_id}. Reason: {finish_reason}, Refusal: {refusal}")
             # Mark as refused to avoid re-scanning
-            conn = psycopg2.connect(DATABASE_URL)
-            cur = conn.cursor()
-            cur.execute("UPDATE public.images SET design_style = %s WHERE id = %s", ('[Refused by AI]', image_id))
-            conn.commit()
-            cur.close()
-            conn.close()
+            writer.update('images', 'id', image_id, {'design_style': '[Refused by AI]'}, block=False)
             return
 
         logger.debug(f"AI response for {image_id}: {analysis_str}")
@@ -128,56 +127,25 @@ async def enrich_image(image_id: int, image_path: str):
             analysis_str = analysis_str.replace("```json", "").replace("```", "").strip()
         analysis = json.loads(analysis_str)
         
-        # Use psycopg2 for reliable array updates
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
-        sql = """
-            UPDATE public.images 
-            SET 
-                rich_tags = %s,
-                hardscape_materials = %s,
-                softscape_elements = %s,
-                architectural_features = %s,
-                design_style = %s,
-                lighting_atmosphere = %s,
-                maintenance_level = %s,
-                seasonal_interest = %s,
-                spatial_purpose = %s,
-                color_palette = %s,
-                privacy_level = %s,
-                terrain_type = %s,
-                hardscape_ratio = %s,
-                material_palette = %s
-            WHERE id = %s
-        """
-        
-        cur.execute(sql, (
-            analysis.get("rich_tags", []),
-            analysis.get("hardscape_materials", []),
-            analysis.get("softscape_elements", []),
-            analysis.get("architectural_features", []),
-            analysis.get("design_style"),
-            analysis.get("lighting_atmosphere"),
-            analysis.get("maintenance_level"),
-            analysis.get("seasonal_interest"),
-            analysis.get("spatial_purpose"),
-            analysis.get("color_palette", []),
-            analysis.get("privacy_level"),
-            analysis.get("terrain_type"),
-            analysis.get("hardscape_ratio"),
-            analysis.get("material_palette", []),
-            image_id
-        ))
-        
-        conn.commit()
-        if cur.rowcount > 0:
-            logger.info(f"Successfully enriched image {image_id}: {analysis.get('privacy_level')}, {analysis.get('hardscape_ratio')}")
-        else:
-            logger.error(f"Failed to find image {image_id} for update")
-            
-        cur.close()
-        conn.close()
+        # Written behind by the shared bulk writer, many images per UPDATE;
+        # never blocks, since waiting here would stall the whole event loop
+        writer.update('images', 'id', image_id, {
+            'rich_tags': analysis.get("rich_tags", []),
+            'hardscape_materials': analysis.get("hardscape_materials", []),
+            'softscape_elements': analysis.get("softscape_elements", []),
+            'architectural_features': analysis.get("architectural_features", []),
+            'design_style': analysis.get("design_style"),
+            'lighting_atmosphere': analysis.get("lighting_atmosphere"),
+            'maintenance_level': analysis.get("maintenance_level"),
+            'seasonal_interest': analysis.get("seasonal_interest"),
+            'spatial_purpose': analysis.get("spatial_purpose"),
+            'color_palette': analysis.get("color_palette", []),
+            'privacy_level': analysis.get("privacy_level"),
+            'terrain_type': analysis.get("terrain_type"),
+            'hardscape_ratio': analysis.get("hardscape_ratio"),
+            'material_palette': analysis.get("material_palette", []),
+        }, block=False)
+        logger.info(f"Enriched image {image_id}: {analysis.get('privacy_level')}, {analysis.get('hardscape_ratio')}")
 
     except Exception as e:
         logger.error(f"Error enriching image {image_id}: {str(e)}")
@@ -209,11 +177,14 @@ async def main():
 
     # 2. Process in batches
     batch_size = 5
-    for i in range(0, len(images), batch_size):
-        batch = images[i:i + batch_size]
-        tasks = [enrich_image(img["id"], img["file_path"]) for img in batch]
-        await asyncio.gather(*tasks)
-        logger.info(f"Completed batch {i//batch_size + 1}")
+    try:
+        for i in range(0, len(images), batch_size):
+            batch = images[i:i + batch_size]
+            tasks = [enrich_image(img["id"], img["file_path"]) for img in batch]
+            await asyncio.gather(*tasks)
+            logger.info(f"Completed batch {i//batch_size + 1}")
+    finally:
+        writer.close()
 
 if __name__ == "__main__":
     if not OPENAI_API_KEY or OPENAI_API_KEY == "your-key-here":
@@ -1,4 +1,20 @@
+"""
+SAM + CLIP object extraction: segment each image with SAM, label the mask
+crops zero-shot with CLIP and store the objects (polygon, label, embedding).
+
+Usage:
+    python3 process_objects_m3.py                                # unprocessed images, one at a time
+    python3 process_objects_m3.py --processes 4 --memory-gb 12   # several images at once
+    python3 process_objects_m3.py --benchmark --images 8 --sides 0,1024,768,512
+    python3 process_objects_m3.py --reclassify                    # every image, reusing cached SAM masks
+"""
+
 import os
+import json
+import time
+import hashlib
+import argparse
+import multiprocessing
 import cv2
 import torch
 import numpy as np
@@ -10,9 +26,27 @@ from dotenv import load_dotenv
 from transformers import CLIPProcessor, CLIPModel
 from segment_anything import sam_model_registry, SamAutomaticMaskGenerator
 
+from backend.bulk_writer import BulkWriter
+from backend.mask_cache import MaskCache, settings_key
+
 # --- CONFIGURATION ---
 BATCH_SIZE = 1  # Process one image fully (segment -> crop -> embed) at a time for memory safety
+# SAM runs on a copy whose longest side is at most this many px (0 = full resolution);
+# masks and polygons are mapped back to the original image
+SAM_MAX_SIDE = int(os.getenv("SAM_MAX_SIDE", "1024"))
+SAM_POINTS_PER_SIDE = int(os.getenv("SAM_POINTS_PER_SIDE", "32"))
+SAM_CROP_LAYERS = int(os.getenv("SAM_CROP_LAYERS", "1"))
+SAM_GENERATOR_SETTINGS = dict(
+    pred_iou_thresh=0.86,
+    stability_score_thresh=0.92,
+    crop_n_points_downscale_factor=2,
+    min_mask_region_area=100,  # Avoid tiny specks
+)
+# Rough resident size of one process (SAM vit_b + CLIP + one image), for --memory-gb
+PROCESS_MEMORY_GB = 2.5
 CLIP_CONFIDENCE_THRESHOLD = 0.6
+CROP_BATCH_SIZE = 32  # Mask crops per CLIP vision forward pass
+MIN_CROP_SIZE = 50  # Crops narrower or shorter than this (px) are skipped
 CHECKPOINT_PATH = "sam_vit_b_01ec64.pth" # Must ensure this file exists or provide download link instructions
 MODEL_TYPE = "vit_b"
 # MPS has float64 issues with SAM AutomaticMaskGenerator, so we run SAM on CPU and CLIP on MPS
@@ -57,53 +91,118 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 def get_db_connection():
     return psycopg2.connect(DATABASE_URL)
 
-# --- MODELS ---
-print(f"🚀 Initializing on DEVICE: {DEVICE}")
+# Object rows are written behind the SAM/CLIP work, many images per flush
+object_writer = BulkWriter("objects")
 
-# 1. CLIP
-print("Loading CLIP...")
-clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").to(DEVICE)
-clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+# --- MODELS (loaded once per process, on first use) ---
+clip_model = None
+clip_processor = None
+mask_generator = None
+label_embeddings = None
+logit_scale = None
 
-# 2. SAM
-print("Loading SAM...")
-if not os.path.exists(CHECKPOINT_PATH):
-    print(f"⚠️  WARNING: Checkpoint {CHECKPOINT_PATH} not found. Analysis will likely fail.")
+def load_models():
+    global clip_model, clip_processor, mask_generator, label_embeddings, logit_scale
+    if mask_generator is not None:
+        return
+    print(f"🚀 Initializing on DEVICE: {DEVICE}")
 
-sam = sam_model_registry[MODEL_TYPE](checkpoint=CHECKPOINT_PATH)
-sam.to(device=SAM_DEVICE)
-mask_generator = SamAutomaticMaskGenerator(
-    model=sam,
-    points_per_side=32,
-    pred_iou_thresh=0.86,
-    stability_score_thresh=0.92,
-    crop_n_layers=1,
-    crop_n_points_downscale_factor=2,
-    min_mask_region_area=100,  # Avoid tiny specks
-)
+    # 1. CLIP
+    print("Loading CLIP...")
+    clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").to(DEVICE)
+    clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+
+    # 2. SAM
+    print("Loading SAM...")
+    if not os.path.exists(CHECKPOINT_PATH):
+        print(f"⚠️  WARNING: Checkpoint {CHECKPOINT_PATH} not found. Analysis will likely fail.")
+
+    sam = sam_model_registry[MODEL_TYPE](checkpoint=CHECKPOINT_PATH)
+    sam.to(device=SAM_DEVICE)
+    mask_generator = SamAutomaticMaskGenerator(
+        model=sam,
+        points_per_side=SAM_POINTS_PER_SIDE,
+        crop_n_layers=SAM_CROP_LAYERS,
+        **SAM_GENERATOR_SETTINGS,
+    )
+
+    # 3. Label text embeddings: encoded once, every crop is scored against this matrix
+    label_embeddings = encode_labels(TARGET_OBJECTS)
+    logit_scale = clip_model.logit_scale.exp().item()
+
+def encode_labels(labels):
+    """L2-normalized CLIP text embeddings, one row per label."""
+    inputs = clip_processor(text=labels, return_tensors="pt", padding=True).to(DEVICE)
+    with torch.no_grad():
+        text_features = clip_model.get_text_features(**inputs)
+    return text_features / text_features.norm(dim=-1, keepdim=True)
+
+def embed_crops(image_crops):
+    """CLIP image features (n x 512, unnormalized) for a list of crops, CROP_BATCH_SIZE per forward pass."""
+    batches = []
+    for start in range(0, len(image_crops), CROP_BATCH_SIZE):
+        inputs = clip_processor(images=image_crops[start:start + CROP_BATCH_SIZE], return_tensors="pt").to(DEVICE)
+        with torch.no_grad():
+            batches.append(clip_model.get_image_features(**inputs))
+    return torch.cat(batches)
+
+def classify_embeddings(image_features):
+    """
+    Zero-shot labels for image features: softmax over TARGET_OBJECTS of the
+    scaled cosine similarities, exactly as CLIPModel's logits_per_image.
+    Returns (labels, confidences).
+    """
+    normed = image_features / image_features.norm(dim=-1, keepdim=True)
+    probs = (logit_scale * normed @ label_embeddings.T).softmax(dim=1)
+    confidences, indices = probs.max(dim=1)
+    return [TARGET_OBJECTS[i] for i in indices.tolist()], confidences.tolist()
 
 def get_embedding(image_crop):
     """Generates a 512d vector for the cropped image using CLIP."""
-    inputs = clip_processor(images=image_crop, return_tensors="pt").to(DEVICE)
-    with torch.no_grad():
-        image_features = clip_model.get_image_features(**inputs)
-    return image_features.cpu().numpy().flatten().tolist()
+    return embed_crops([image_crop])[0].cpu().numpy().tolist()
 
 def classify_crop(image_crop):
     """Classifies the crop against TARGET_OBJECTS using CLIP zero-shot."""
-    inputs = clip_processor(text=TARGET_OBJECTS, images=image_crop, return_tensors="pt", padding=True).to(DEVICE)
-    with torch.no_grad():
-        outputs = clip_model(**inputs)
-        probs = outputs.logits_per_image.softmax(dim=1)  # softmax over classes
-    
-    # Get top prediction
-    top_prob, top_idx = probs[0].topk(1)
-    confidence = top_prob.item()
-    label = TARGET_OBJECTS[top_idx.item()]
-    
-    return label, confidence
+    labels, confidences = classify_embeddings(embed_crops([image_crop]))
+    return labels[0], confidences[0]
+
+_mask_caches = {}
 
-def process_image(image_id, image_path):
+def mask_cache():
+    """Mask cache for the current SAM settings (everything that changes SAM's output)."""
+    settings = dict(
+        model=MODEL_TYPE, checkpoint=os.path.basename(CHECKPOINT_PATH), max_side=SAM_MAX_SIDE,
+        points_per_side=SAM_POINTS_PER_SIDE, crop_n_layers=SAM_CROP_LAYERS, **SAM_GENERATOR_SETTINGS,
+    )
+    key = settings_key(settings)
+    if key not in _mask_caches:
+        _mask_caches[key] = MaskCache(settings)
+    return _mask_caches[key]
+
+def sam_scale(shape, max_side=None):
+    """SAM input size relative to the original (1.0 when no downscaling is needed)."""
+    max_side = SAM_MAX_SIDE if max_side is None else max_side
+    longest = max(shape[:2])
+    if not max_side or longest <= max_side:
+        return 1.0
+    return max_side / longest
+
+def sam_input(image, max_side=None):
+    """The image SAM sees (longest side capped at max_side) and its scale relative to the original."""
+    scale = sam_scale(image.shape, max_side)
+    if scale == 1.0:
+        return image, 1.0
+    size = (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+
+def process_image(image_id, image_path, save=True, use_cache=True):
+    """
+    Segment, classify and (with save) queue the image's objects, replacing any
+    it already has. SAM masks come from the mask cache when this content was
+    segmented before with the same settings (use_cache=False always runs SAM).
+    Returns {'masks': n, 'objects': n, 'cached': bool}, or None if the image could not be loaded.
+    """
+    load_models()
     print(f"Processing Image ID {image_id}: {image_path}")
     
     # 1. Load Image (Local or URL)
@@ -113,11 +212,7 @@ def process_image(image_id, image_path):
             print(f"Downloading from URL: {image_path}")
             response = requests.get(image_path)
             response.raise_for_status()
-            # Convert to numpy for SAM/CV2
-            image_bytes = np.frombuffer(response.content, np.uint8)
-            image_np = cv2.imdecode(image_bytes, cv2.IMREAD_COLOR)
-            if image_np is not None:
-                image_np = cv2.cvtColor(image_np, cv2.COLOR_BGR2RGB)
+            data = response.content
         else:
             # Check local path
             actual_path = image_path
@@ -130,9 +225,14 @@ def process_image(image_id, image_path):
                     print(f"❌ File not found: {image_path}")
                     return
 
-            image_np = cv2.imread(actual_path)
-            if image_np is not None:
-                image_np = cv2.cvtColor(image_np, cv2.COLOR_BGR2RGB)
+            with open(actual_path, 'rb') as f:
+                data = f.read()
+
+        # Convert to numpy for SAM/CV2; the bytes' hash keys the SAM mask cache
+        file_hash = hashlib.sha256(data).hexdigest()
+        image_np = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if image_np is not None:
+            image_np = cv2.cvtColor(image_np, cv2.COLOR_BGR2RGB)
 
         if image_np is None:
             print(f"❌ Could not load image: {image_path}")
@@ -145,43 +245,58 @@ def process_image(image_id, image_path):
     # Use image_np for the rest of the function...
     image = image_np 
 
-    # Generate Masks (SAM)
-    print("  - Generating SAM masks...", end="", flush=True)
-    masks = mask_generator.generate(image)
-    print(f" Done. Found {len(masks)} masks.")
+    # Generate Masks (SAM), on a downscaled copy for large photos, unless this
+    # content was already segmented with the same settings
+    height, width = image.shape[:2]
+    sam_masks = mask_cache()
+    masks = sam_masks.get(file_hash) if use_cache else None
+    cached = masks is not None
+    if cached:
+        scale = sam_scale(image.shape)
+        print(f"  - Reusing {len(masks)} cached SAM masks.")
+    else:
+        sam_image, scale = sam_input(image)
+        print(f"  - Generating SAM masks ({sam_image.shape[1]}x{sam_image.shape[0]})...", end="", flush=True)
+        masks = mask_generator.generate(sam_image)
+        try:
+            sam_masks.put(file_hash, masks, sam_image.shape)
+        except OSError as e:
+            print(f" (not cached: {e})", end="")
+        print(f" Done. Found {len(masks)} masks.")
 
-    objects_to_save = []
-    
-    # Analyze Channels (Crops)
-    for i, mask_data in enumerate(masks):
+    # Crop every mask large enough to classify
+    kept_masks = []
+    crops = []
+    for mask_data in masks:
         # mask_data['segmentation'] is binary mask
-        # mask_data['bbox'] is [x, y, w, h]
-        x, y, w, h = map(int, mask_data['bbox'])
+        # mask_data['bbox'] is [x, y, w, h], in SAM-input pixels
+        x, y, w, h = _full_res_bbox(mask_data['bbox'], scale, width, height)
         
-        # Skip tiny crops
-        if w < 50 or h < 50: 
+        # Skip tiny crops (measured at full resolution)
+        if w < MIN_CROP_SIZE or h < MIN_CROP_SIZE:
             continue
             
-        # Crop Image
-        crop = image[y:y+h, x:x+w]
-        pil_crop = Image.fromarray(crop)
-        
-        # CLIP Classification
-        label, confidence = classify_crop(pil_crop)
-        
+        kept_masks.append(mask_data)
+        crops.append(Image.fromarray(image[y:y+h, x:x+w]))
+
+    if not crops:
+        if save:
+            save_objects(image_id, [])
+        return {'masks': len(masks), 'objects': 0, 'cached': cached}
+
+    # One batched CLIP vision pass gives both the label and the stored embedding
+    print(f"  - Classifying {len(crops)} crops...", end="", flush=True)
+    features = embed_crops(crops)
+    labels, confidences = classify_embeddings(features)
+    embeddings = features.cpu().numpy()
+    print(" Done.")
+
+    objects_to_save = []
+    for mask_data, label, confidence, embedding in zip(kept_masks, labels, confidences, embeddings):
         if confidence > CLIP_CONFIDENCE_THRESHOLD:
-            # Generate Embedding
-            embedding = get_embedding(pil_crop)
-            
-            # Prepare Polygon for DB (Simplified)
-            # mask_data['segmentation'] is a boolean array. We need contours.
-            # This can be heavy, let's keep it simple or skip distinct polygon logic for now if just bbox is enough.
-            # User asked for mask_polygon (jsonb).
-            # Convert binary mask to polygon
-            # For efficiency in this script, we'll store bbox as a simple polygon or do a quick contour.
-            # Let's do quick contour:
-            
-            # This mask is for the WHOLE image. We need to extract contours.
+            x, y, w, h = _full_res_bbox(mask_data['bbox'], scale, width, height)
+
+            # Convert the whole-image binary mask to a simplified polygon (largest contour)
             binary_mask = mask_data['segmentation'].astype(np.uint8) * 255
             contours, _ = cv2.findContours(binary_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
             
@@ -191,8 +306,8 @@ def process_image(image_id, image_path):
                 # Simplify
                 epsilon = 0.005 * cv2.arcLength(largest, True)
                 approx = cv2.approxPolyDP(largest, epsilon, True)
-                # Convert to list of [x, y]
-                polygon_points = approx.reshape(-1, 2).tolist()
+                # Convert to list of [x, y] in original image pixels
+                polygon_points = np.round(approx.reshape(-1, 2) / scale).astype(int).tolist()
             else:
                 polygon_points = [[x, y], [x+w, y], [x+w, y+h], [x, y+h]] # Fallback to bbox
             
@@ -203,54 +318,35 @@ def process_image(image_id, image_path):
                 'label': label,
                 'confidence': confidence,
                 'mask_polygon': polygon_points, # Serialized as JSON automatically by psycopg2 if using json dump or adapter
-                'object_embedding': embedding
+                'object_embedding': embedding.tolist()
             })
 
-    # Batch Insert
-    if objects_to_save:
+    # Batch Insert (an empty list clears objects left by an earlier vocabulary)
+    if save:
         save_objects(image_id, objects_to_save)
+    return {'masks': len(masks), 'objects': len(objects_to_save), 'cached': cached}
+
+def _full_res_bbox(bbox, scale, width, height):
+    """SAM [x, y, w, h] mapped back to original pixels, clipped to the image."""
+    x, y, w, h = (int(round(v / scale)) for v in bbox)
+    x, y = min(max(x, 0), width - 1), min(max(y, 0), height - 1)
+    return x, y, max(1, min(w, width - x)), max(1, min(h, height - y))
 
 def save_objects(image_id, objects):
+    """Queue the image's objects; they replace its previous ones on the writer's next flush."""
     print(f"  - Saving {len(objects)} objects to DB (image {image_id})...")
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # Clear previous objects
-    try:
-        cur.execute("DELETE FROM public.image_objects WHERE image_id = %s", (image_id,))
-    except Exception as e:
-        print(f"⚠️ Could not delete old objects: {e}")
-        conn.rollback()
-        cur = conn.cursor()
-
-    sql = """
-        INSERT INTO image_objects (image_id, label, confidence, mask_polygon, object_embedding)
-        VALUES (%s, %s, %s, %s, %s)
-    """
-    
-    import json
-    data = [
-        (
-            obj['image_id'], 
-            obj['label'], 
-            obj['confidence'], 
-            json.dumps(obj['mask_polygon']), 
-            obj['object_embedding']
-        ) 
+    object_writer.replace('image_objects', 'image_id', image_id, [
+        {
+            'image_id': obj['image_id'],
+            'label': obj['label'],
+            'confidence': obj['confidence'],
+            'mask_polygon': json.dumps(obj['mask_polygon']),
+            'object_embedding': obj['object_embedding'],
+        }
         for obj in objects
-    ]
-    
-    try:
-        cur.executemany(sql, data)
-        conn.commit()
-    except Exception as e:
-        print(f"❌ DB Error: {e}")
-        conn.rollback()
-    finally:
-        cur.close()
-        conn.close()
+    ])
 
-def main():
+def fetch_unprocessed():
     conn = get_db_connection()
     cur = conn.cursor()
     
@@ -277,11 +373,121 @@ def main():
     rows = cur.fetchall()
     cur.close()
     conn.close()
-    
+    return rows
+
+def fetch_all(limit=None):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    sql = "SELECT id, file_path FROM images"
+    params = []
+    project_slug = os.getenv("PROJECT_SLUG")
+    if project_slug:
+        sql += " WHERE project_slug = %s"
+        params.append(project_slug)
+    # LIMIT NULL is no limit
+    cur.execute(sql + " ORDER BY id LIMIT %s", tuple(params + [limit]))
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    return rows
+
+def pool_size(processes, memory_gb=None):
+    """Processes that fit the memory budget (at least one)."""
+    if memory_gb:
+        processes = min(processes, int(memory_gb // PROCESS_MEMORY_GB))
+    return max(1, processes)
+
+def _init_pool_worker(threads, max_side):
+    global SAM_MAX_SIDE
+    # Split the cores between processes instead of every process using all of them
+    torch.set_num_threads(threads)
+    SAM_MAX_SIDE = max_side
+    load_models()
+
+def _process_row(row, save=True):
+    """Pool task: one image, flushed before returning (pool workers exit without atexit)."""
+    start = time.time()
+    stats = process_image(row[0], row[1], save=save) or {'masks': 0, 'objects': 0}
+    if save:
+        object_writer.flush()
+    return start, time.time(), stats
+
+def _benchmark_row(row):
+    start = time.time()
+    stats = process_image(row[0], row[1], save=False, use_cache=False) or {'masks': 0, 'objects': 0}
+    return start, time.time(), stats
+
+def run_pool(rows, processes, max_side=None, task=_process_row):
+    """Run task over rows in a spawned process pool. Returns the task results in order."""
+    max_side = SAM_MAX_SIDE if max_side is None else max_side
+    threads = max(1, (os.cpu_count() or 1) // processes)
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(processes, initializer=_init_pool_worker, initargs=(threads, max_side)) as pool:
+        return pool.map(task, rows, chunksize=1)
+
+def benchmark(limit=8, sides=(0, 1024, 768, 512), processes=1):
+    """masks/sec and images/hour per SAM input size, on local images of this project. Nothing is saved."""
+    global SAM_MAX_SIDE
+    rows = [r for r in fetch_all(limit * 4) if os.path.exists(r[1])][:limit]
+    if not rows:
+        print("No local images to benchmark.")
+        return
+    print(f"Benchmarking {len(rows)} images, {processes} process(es), "
+          f"points_per_side={SAM_POINTS_PER_SIDE}, crop_n_layers={SAM_CROP_LAYERS}")
+    for side in sides:
+        if processes > 1:
+            results = run_pool(rows, processes, side, task=_benchmark_row)
+        else:
+            SAM_MAX_SIDE = side
+            results = [_benchmark_row(row) for row in rows]
+        # Wall clock from the first image started to the last finished (model loading excluded)
+        elapsed = max(end for _, end, _ in results) - min(start for start, _, _ in results)
+        masks = sum(stats['masks'] for _, _, stats in results)
+        objects = sum(stats['objects'] for _, _, stats in results)
+        label = f"{side}px" if side else "full res"
+        print(f"  {label:>9}: {masks / elapsed:6.1f} masks/s  {len(rows) / elapsed * 3600:7.0f} images/hour  "
+              f"({masks} masks, {objects} objects, {elapsed:.1f}s)")
+
+def main(processes=1, memory_gb=None, reclassify=False):
+    """
+    Extract objects for images that have none, or with reclassify for every
+    image of the project (e.g. after a TARGET_OBJECTS or threshold change; cached SAM
+    masks make that a CLIP-only pass).
+    """
+    rows = fetch_all(None) if reclassify else fetch_unprocessed()
     print(f"Found {len(rows)} images to process.")
     
-    for row in rows:
-        process_image(row[0], row[1])
+    processes = pool_size(processes, memory_gb)
+    if processes > 1 and len(rows) > 1:
+        print(f"Running {processes} processes")
+        results = run_pool(rows, processes)
+        print(f"SAM masks: {sum(1 for _, _, stats in results if stats.get('cached'))} of {len(results)} images from cache")
+        return
+
+    try:
+        for row in rows:
+            process_image(row[0], row[1])
+    finally:
+        object_writer.close()
+    sam_masks = mask_cache()
+    print(f"SAM masks: {sam_masks.hits} images from cache, {sam_masks.misses} segmented")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="SAM + CLIP object extraction")
+    parser.add_argument("--processes", type=int, default=1, help="Images processed at once")
+    parser.add_argument("--memory-gb", type=float,
+                        help=f"Memory budget; caps --processes at about {PROCESS_MEMORY_GB} GB each")
+    parser.add_argument("--max-side", type=int, help=f"SAM input size in px, 0 = full res (default {SAM_MAX_SIDE})")
+    parser.add_argument("--reclassify", action="store_true",
+                        help="Redo every image, not just new ones; SAM masks come from the mask cache")
+    parser.add_argument("--benchmark", action="store_true", help="Report throughput per SAM input size; saves nothing")
+    parser.add_argument("--images", type=int, default=8, help="Images for --benchmark")
+    parser.add_argument("--sides", default="0,1024,768,512", help="SAM input sizes for --benchmark")
+    args = parser.parse_args()
+
+    if args.max_side is not None:
+        SAM_MAX_SIDE = args.max_side
+    if args.benchmark:
+        benchmark(args.images, [int(v) for v in args.sides.split(",")], pool_size(args.processes, args.memory_gb))
+    else:
+        main(args.processes, args.memory_gb, args.reclassify)